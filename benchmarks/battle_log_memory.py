@@ -0,0 +1,55 @@
+import glob
+import sys
+import tracemalloc
+from src.replay_management.battle_log import ColumnarBattleLog, StringTable
+from src.replay_management.process_replay import iter_battle_lines, parse_replay_file
+from src.replay_management.showdown_protocol import generate_replay_commands
+
+# Compares the memory held by the ShowdownMessage object lists against
+# ColumnarBattleLog for the same replays, each loaded `copies` times to
+# approximate a corpus. Usage: python -m benchmarks.battle_log_memory [copies] [glob]
+
+def measure(build):
+
+    tracemalloc.start()
+    held = build()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return held, current, peak
+
+def main():
+
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    pattern = sys.argv[2] if len(sys.argv) > 2 else 'replays/*.html'
+
+    battle_texts = []
+    for replay_file in sorted(glob.glob(pattern)):
+        battle_text = parse_replay_file(replay_file)
+        try:
+            generate_replay_commands(battle_text.split('\n'))
+        except Exception as e:
+            print(f"Skipping {replay_file}: {e!r}")
+            continue
+        battle_texts.append(battle_text)
+
+    corpus = battle_texts * copies
+
+    def build_objects():
+        return [generate_replay_commands(battle_text.split('\n')) for battle_text in corpus]
+
+    def build_columnar():
+        strings = StringTable()
+        return [ColumnarBattleLog.from_lines(iter_battle_lines(battle_text), strings) for battle_text in corpus]
+
+    objects, objects_current, _ = measure(build_objects)
+    del objects
+    logs, columnar_current, _ = measure(build_columnar)
+
+    num_commands = sum(len(log) for log in logs)
+    print(f"{len(corpus)} replays, {num_commands} commands")
+    print(f"object lists:  {objects_current / 1e6:8.2f} MB ({objects_current / num_commands:6.1f} B/command)")
+    print(f"columnar logs: {columnar_current / 1e6:8.2f} MB ({columnar_current / num_commands:6.1f} B/command)")
+
+if __name__ == '__main__':
+    main()
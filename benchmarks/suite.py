@@ -0,0 +1,209 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from src.replay_management.process_replay import ReplayProcessor, iter_battle_lines, parse_replay_file
+from src.replay_management.showdown_protocol import ParseCounters, generate_replay_commands
+from .synthetic import write_synthetic_corpus
+
+# Times each stage of the pipeline over the bundled replays and synthetic
+# corpora, saves the results as JSON and compares them with a baseline.
+# Run it as a module from the repository root, so src and replays/ resolve:
+# python -m benchmarks.suite [--output results.json] [--baseline baseline.json]
+#
+# Compares against benchmarks/baseline.json by default, and exits with
+# status 1 if any stage is more than --threshold slower than it. Timings are
+# machine specific: refresh the baseline on the machine doing the comparing
+# with python -m benchmarks.suite --save-baseline.
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+def _extract(replay_files):
+    return [parse_replay_file(replay_file) for replay_file in replay_files]
+
+def _tokenize(battle_texts):
+    return [generate_replay_commands(iter_battle_lines(battle_text), ParseCounters()) for battle_text in battle_texts]
+
+def _build_processors(command_lists):
+    return [ReplayProcessor(commands) for commands in command_lists]
+
+def _split_into_turns(processors):
+    return [processor.split_into_turns() for processor in processors]
+
+def _build_states(processors):
+    return [list(processor.iter_states()) for processor in processors]
+
+def _encode_features(replay_states):
+
+    from src.replay_management.features import StateEncoder
+
+    encoder = StateEncoder()
+    return [encoder.encode(states) for states in replay_states]
+
+# (name, setup, run): setup builds a fresh input for run from the outputs of
+# the stages before it, outside the timed region, since processors cache
+# what they compute
+STAGES = (
+    ('extract', lambda data: data['replay_files'], _extract),
+    ('tokenize', lambda data: data['battle_texts'], _tokenize),
+    ('processor', lambda data: data['command_lists'], _build_processors),
+    ('split_into_turns', lambda data: _build_processors(data['command_lists']), _split_into_turns),
+    ('states', lambda data: _build_processors(data['command_lists']), _build_states),
+    ('features', lambda data: data['replay_states'], _encode_features)
+)
+
+# Where each stage's output goes for the stages after it
+STAGE_OUTPUTS = {'extract': 'battle_texts', 'tokenize': 'command_lists', 'states': 'replay_states'}
+
+def time_stage(setup, run, data, repeats):
+
+    best = None
+    output = None
+
+    for _ in range(repeats):
+        stage_input = setup(data)
+        start_time = time.perf_counter()
+        output = run(stage_input)
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, output
+
+def run_workload(replay_files, repeats, stages=None):
+
+    data = {'replay_files': replay_files}
+    results = {}
+
+    for name, setup, run in STAGES:
+        if stages is not None and name not in stages and name not in STAGE_OUTPUTS:
+            continue
+
+        try:
+            seconds, output = time_stage(setup, run, data, repeats)
+        except ImportError as e:
+            # features needs numpy
+            print(f"Skipping {name}: {e}")
+            continue
+
+        if name in STAGE_OUTPUTS:
+            data[STAGE_OUTPUTS[name]] = output
+        if name == 'extract':
+            data['num_lines'] = sum(battle_text.count('\n') + 1 for battle_text in output)
+
+        if stages is None or name in stages:
+            results[name] = {
+                'seconds': seconds,
+                'replays_per_second': len(replay_files) / seconds if seconds else None,
+                'lines_per_second': data['num_lines'] / seconds if seconds else None
+            }
+
+    return results
+
+def get_workloads(args, synthetic_dir):
+
+    workloads = {}
+
+    bundled = sorted(glob.glob(args.replays))
+    if bundled:
+        workloads['bundled'] = bundled
+
+    for game_type in ('singles', 'doubles'):
+        workloads[f'synthetic-{game_type}'] = write_synthetic_corpus(
+            os.path.join(synthetic_dir, game_type), args.synthetic, args.seed, args.turns, game_type
+        )
+
+    return workloads
+
+def compare(results, baseline, threshold, min_delta=0.001):
+
+    # (workload, stage, baseline seconds, seconds, relative change, regressed)
+    # for every stage present in both. Slowdowns under min_delta seconds are
+    # timer noise on the tiny stages, not regressions.
+    rows = []
+
+    for workload, stages in results['workloads'].items():
+        for stage, result in stages.items():
+            base = baseline.get('workloads', {}).get(workload, {}).get(stage)
+            if base is None:
+                continue
+            change = result['seconds'] / base['seconds'] - 1 if base['seconds'] else 0.0
+            regressed = change > threshold and result['seconds'] - base['seconds'] > min_delta
+            rows.append((workload, stage, base['seconds'], result['seconds'], change, regressed))
+
+    return rows
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark each stage of replay processing")
+    parser.add_argument('--replays', default='replays/*.html', help="glob of real replays to include")
+    parser.add_argument('--synthetic', type=int, default=200, help="synthetic replays per game type")
+    parser.add_argument('--turns', type=int, default=20, help="turns per synthetic replay")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the first synthetic replay")
+    parser.add_argument('--repeats', type=int, default=5, help="runs per stage; the fastest is kept")
+    parser.add_argument('--stages', default=None, help="comma separated stages to report (default: all)")
+    parser.add_argument('--output', default=None, help="write the results here as JSON")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="results to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the baseline")
+    parser.add_argument('--threshold', type=float, default=0.1, help="slowdown flagged as a regression")
+    parser.add_argument('--min-delta', type=float, default=1.0, help="smallest slowdown flagged (ms)")
+    args = parser.parse_args()
+
+    stages = set(args.stages.split(',')) if args.stages else None
+
+    with tempfile.TemporaryDirectory() as synthetic_dir:
+        workloads = get_workloads(args, synthetic_dir)
+
+        results = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'config': {'synthetic': args.synthetic, 'turns': args.turns, 'seed': args.seed, 'repeats': args.repeats},
+            'workloads': {}
+        }
+
+        for workload, replay_files in workloads.items():
+            results['workloads'][workload] = run_workload(replay_files, args.repeats, stages)
+
+    for workload, stage_results in results['workloads'].items():
+        for stage, result in stage_results.items():
+            print(f"{workload:>18} {stage:>16}: {result['seconds'] * 1000:9.2f}ms "
+                  f"{result['replays_per_second']:10.0f} replays/s {result['lines_per_second']:12.0f} lines/s")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to store one")
+        return
+
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+
+    if baseline.get('config') != results['config']:
+        print(f"Warning: baseline was run with {baseline.get('config')}")
+
+    regressions = 0
+    rows = compare(results, baseline, args.threshold, args.min_delta / 1000)
+    for workload, stage, base_seconds, seconds, change, regressed in rows:
+        flag = 'REGRESSION' if regressed else ''
+        print(f"{workload:>18} {stage:>16}: {base_seconds * 1000:9.2f}ms -> {seconds * 1000:9.2f}ms "
+              f"({change:+.1%}) {flag}")
+        regressions += regressed
+
+    if regressions:
+        print(f"{regressions} stage(s) more than {args.threshold:.0%} slower than the baseline")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+import inspect
+import os
+import random
+from src.replay_management.showdown_protocol import class_lookup, command_specs
+
+# Seeded generator of synthetic but valid battle logs, for benchmarking on
+# corpora larger than the bundled replays. Every line is a command from
+# class_lookup with the arguments its message class requires, and
+# the Pokemon, HP and fainting are kept consistent so the logs also drive
+# BattleState through whole battles.
+
+SPECIES = ('Groudon', 'Kyogre', 'Zacian-Crowned', 'Calyrex-Shadow', 'Incineroar', 'Rillaboom', 'Regieleki',
+           'Grimmsnarl', 'Charizard', 'Venusaur', 'Umbreon', 'Dragapult', 'Clefairy', 'Snorlax', 'Palossand',
+           'Accelgor', 'Amoonguss', 'Thundurus', 'Landorus-Therian', 'Urshifu-Rapid-Strike', 'Tornadus',
+           'Indeedee-F', 'Hatterene', 'Whimsicott', 'Gastrodon', 'Porygon2', 'Dusclops', 'Xerneas', 'Yveltal',
+           'Lunala', 'Solgaleo', 'Necrozma-Dusk-Mane', 'Metagross', 'Tapu Fini', 'Tapu Koko', 'Kartana')
+MOVES = ('Protect', 'Fake Out', 'Rock Slide', 'Heat Wave', 'Leaf Storm', 'Snarl', 'Yawn', 'Tailwind',
+         'Trick Room', 'Follow Me', 'Rage Powder', 'Spore', 'Precipice Blades', 'Origin Pulse', 'Water Spout',
+         'Dazzling Gleam', 'Moonblast', 'Shadow Ball', 'Astral Barrage', 'Behemoth Blade', 'Close Combat',
+         'Surging Strikes', 'Thunderbolt', 'Volt Switch', 'Electroweb', 'Ice Beam', 'Earth Power', 'Flare Blitz',
+         'Wood Hammer', 'Grassy Glide', 'Parting Shot', 'Helping Hand', 'Wide Guard', 'Max Guard',
+         'Max Overgrowth', 'Max Airstream', 'Dynamax Cannon', 'Thunder Wave', 'Will-O-Wisp', 'Reflect')
+ITEMS = ('Sitrus Berry', 'Life Orb', 'Focus Sash', 'Choice Scarf', 'Assault Vest', 'Weakness Policy',
+         'Leftovers', 'Safety Goggles', 'Figy Berry', 'Rusted Sword')
+ABILITIES = ('Intimidate', 'Drought', 'Drizzle', 'Grassy Surge', 'Psychic Surge', 'Prankster', 'Regenerator',
+             'Unseen Fist', 'As One', 'Water Compaction', 'Defiant', 'Competitive')
+EFFECTS = ('move: Protect', 'ability: Intimidate', 'item: Sitrus Berry', 'confusion', 'move: Yawn', 'Dynamax',
+           'move: Taunt', 'Substitute', 'move: Follow Me', 'move: Helping Hand')
+STATUSES = ('brn', 'par', 'slp', 'frz', 'psn', 'tox')
+BOOST_STATS = ('atk', 'def', 'spa', 'spd', 'spe', 'accuracy', 'evasion')
+WEATHERS = ('SunnyDay', 'RainDance', 'Sandstorm', 'Hail', 'none')
+FIELD_CONDITIONS = ('move: Electric Terrain', 'move: Grassy Terrain', 'move: Misty Terrain',
+                    'move: Psychic Terrain', 'move: Trick Room', 'move: Gravity')
+SIDE_CONDITIONS = ('move: Reflect', 'move: Light Screen', 'move: Aurora Veil', 'move: Tailwind',
+                   'move: Safeguard', 'Spikes', 'move: Stealth Rock')
+
+GAME_TYPES = {'singles': 1, 'doubles': 2}
+
+# Relative frequency of the commands following each move. Any command in
+# class_lookup whose arguments can be generated below may be given.
+DEFAULT_COMMAND_MIX = {
+    '-damage': 40, '-heal': 6, '-boost': 6, '-unboost': 8, '-supereffective': 8, '-resisted': 6, '-crit': 3,
+    '-miss': 2, '-immune': 1, '-fail': 2, '-status': 3, '-curestatus': 1, '-start': 4, '-end': 3,
+    '-activate': 4, '-singleturn': 3, '-item': 1, '-enditem': 2, '-ability': 3, '-weather': 2,
+    '-fieldstart': 1, '-fieldend': 1, '-sidestart': 2, '-sideend': 1, 'cant': 1, '-hitcount': 1,
+    '-clearnegativeboost': 1, '-message': 1
+}
+
+# Commands about the Pokemon a move hit rather than its user
+TARGET_COMMANDS = {'-supereffective', '-resisted', '-crit', '-immune'}
+
+# Commands generate_battle_log writes itself, as part of the battle's structure
+STRUCTURAL_COMMANDS = {
+    'player', 'teamsize', 'gametype', 'gen', 'tier', 'rated', 'rule', 'clearpoke', 'poke', 'start', 'request',
+    'inactive', 'inactiveoff', 'upkeep', 'turn', 'win', 'tie', 't:', 'move', 'switch', 'faint'
+}
+
+class SyntheticBattle(object):
+
+    def __init__(self, rng, game_type, team_size=6):
+        self.rng = rng
+        self.active_slots = GAME_TYPES[game_type]
+        self.usernames = {'p1': f"Synthetic{rng.randrange(100000)}", 'p2': f"Synthetic{rng.randrange(100000)}"}
+
+        species = rng.sample(SPECIES, team_size * 2)
+        self.teams = {'p1': species[:team_size], 'p2': species[team_size:]}
+        self.details = {name: f"{name}, L50" + rng.choice(('', ', M', ', F')) for name in species}
+        self.hp = {name: 100 for name in species}
+        self.status = {}
+
+        # Active Pokemon by position ("p1a") and the bench left to send out
+        self.active = {}
+        self.bench = {player: list(team) for player, team in self.teams.items()}
+
+    def position(self, player, slot):
+        return f"{player}{'abc'[slot]}"
+
+    def active_positions(self, player=None):
+        return [position for position in sorted(self.active) if player is None or position[:2] == player]
+
+    def pokemon_text(self, position):
+        return f"{position}: {self.active[position]}"
+
+    def hp_text(self, name):
+        if self.hp[name] <= 0:
+            return '0 fnt'
+        status = self.status.get(name)
+        return f"{self.hp[name]}\\/100" + (f" {status}" if status else '')
+
+    def switch_in(self, position):
+
+        # Returns the switch line, or None if the side has no one left to send
+        player = position[:2]
+        if not self.bench[player]:
+            self.active.pop(position, None)
+            return None
+
+        name = self.bench[player].pop(self.rng.randrange(len(self.bench[player])))
+        self.active[position] = name
+
+        return f"|switch|{position}: {name}|{self.details[name]}|{self.hp_text(name)}"
+
+    def other_position(self, position):
+        opponents = self.active_positions('p2' if position.startswith('p1') else 'p1')
+        return self.rng.choice(opponents) if opponents else position
+
+def _arg_builders(battle, subject, command):
+
+    rng = battle.rng
+    name = battle.active[subject]
+
+    return {
+        'pokemon': lambda: battle.pokemon_text(subject),
+        'source': lambda: battle.pokemon_text(subject),
+        'attacker': lambda: battle.pokemon_text(subject),
+        'target': lambda: battle.pokemon_text(battle.other_position(subject)),
+        'defender': lambda: battle.pokemon_text(battle.other_position(subject)),
+        'details': lambda: battle.details[name],
+        'species': lambda: name,
+        'hp_status': lambda: battle.hp_text(name),
+        'hp': lambda: battle.hp_text(name),
+        'stat': lambda: rng.choice(BOOST_STATS),
+        'amount': lambda: str(rng.randint(1, 2)),
+        'stats': lambda: ', '.join(rng.sample(BOOST_STATS, 2)),
+        'move': lambda: rng.choice(MOVES),
+        'effect': lambda: rng.choice(EFFECTS),
+        'action': lambda: rng.choice(EFFECTS),
+        'item': lambda: rng.choice(ITEMS),
+        'megastone': lambda: rng.choice(ITEMS),
+        'ability': lambda: rng.choice(ABILITIES),
+        'status': lambda: rng.choice(STATUSES),
+        'reason': lambda: rng.choice(('par', 'slp', 'frz', 'flinch', 'recharge')),
+        'weather': lambda: rng.choice(WEATHERS),
+        'condition': lambda: rng.choice(SIDE_CONDITIONS if command.startswith('-side') else FIELD_CONDITIONS),
+        'side': lambda: f"{subject[:2]}: {battle.usernames[subject[:2]]}",
+        'num': lambda: str(rng.randint(2, 5)),
+        'position': lambda: str(rng.randrange(battle.active_slots)),
+        'message': lambda: f"{name} is exerting its pressure!"
+    }
+
+_required_params = {}
+
+def _get_required_params(command):
+
+    params = _required_params.get(command)
+    if params is None:
+        min_args, _ = command_specs[command]
+        params = [param.name for param in list(inspect.signature(class_lookup[command].__init__).parameters.values())[1:]]
+        params = params[:min_args]
+        _required_params[command] = params
+
+    return params
+
+def check_command_mix(command_mix):
+
+    for command in command_mix:
+        if command not in class_lookup:
+            raise ValueError(f"{command} is not a protocol command")
+        if command in STRUCTURAL_COMMANDS:
+            raise ValueError(f"{command} is part of the battle structure and can't be mixed in")
+
+def _event_line(battle, subject, command):
+
+    if command == '-damage':
+        name = battle.active[subject]
+        target = battle.other_position(subject)
+        target_name = battle.active[target]
+        battle.hp[target_name] = max(0, battle.hp[target_name] - battle.rng.randint(5, 70))
+        return f"|-damage|{battle.pokemon_text(target)}|{battle.hp_text(target_name)}"
+
+    if command in TARGET_COMMANDS:
+        subject = battle.other_position(subject)
+
+    if command == '-heal':
+        name = battle.active[subject]
+        battle.hp[name] = min(100, battle.hp[name] + battle.rng.randint(5, 30))
+    elif command == '-status':
+        battle.status[battle.active[subject]] = battle.rng.choice(STATUSES)
+    elif command == '-curestatus':
+        battle.status.pop(battle.active[subject], None)
+
+    builders = _arg_builders(battle, subject, command)
+    try:
+        args = [builders[param]() for param in _get_required_params(command)]
+    except KeyError as e:
+        raise ValueError(f"Can't generate the {e} argument of {command}") from None
+
+    return '|'.join(['', command] + args)
+
+def generate_battle_log(seed=0, turns=20, game_type='doubles', command_mix=None, events_per_move=3):
+
+    # Returns the text of one battle log, as found in a replay's
+    # battle-log-data script. The same arguments always give the same log.
+    rng = random.Random(seed)
+    command_mix = DEFAULT_COMMAND_MIX if command_mix is None else command_mix
+    check_command_mix(command_mix)
+    mix_commands = list(command_mix)
+    mix_weights = [command_mix[command] for command in mix_commands]
+
+    battle = SyntheticBattle(rng, game_type)
+    timestamp = 1600000000 + rng.randrange(10 ** 8)
+
+    lines = [f"|t:|{timestamp}", f"|gametype|{game_type}"]
+    for player, username in battle.usernames.items():
+        lines.append(f"|player|{player}|{username}|{rng.randrange(300)}|{rng.randint(1000, 1800)}")
+    for player, team in battle.teams.items():
+        lines.append(f"|teamsize|{player}|{len(team)}")
+    lines += ["|gen|8", "|tier|[Gen 8] Synthetic Battle", "|rated|", "|rule|Species Clause: Limit one of each Pokémon",
+              "|clearpoke"]
+    for player, team in battle.teams.items():
+        for name in team:
+            lines.append(f"|poke|{player}|{battle.details[name]}|")
+    lines += ["|", f"|t:|{timestamp + 30}", "|start"]
+
+    for player in battle.teams:
+        for slot in range(battle.active_slots):
+            lines.append(battle.switch_in(battle.position(player, slot)))
+
+    winner = None
+
+    for turn in range(1, turns + 1):
+        lines += [f"|turn|{turn}", "|"]
+        timestamp += rng.randint(10, 60)
+        lines.append(f"|t:|{timestamp}")
+
+        order = battle.active_positions()
+        rng.shuffle(order)
+
+        for position in order:
+            if position not in battle.active or battle.hp[battle.active[position]] <= 0:
+                continue
+            if not battle.active_positions('p2' if position.startswith('p1') else 'p1'):
+                break
+
+            target = battle.other_position(position)
+            lines.append(f"|move|{battle.pokemon_text(position)}|{rng.choice(MOVES)}|{battle.pokemon_text(target)}")
+
+            for _ in range(rng.randint(0, events_per_move * 2)):
+                command = rng.choices(mix_commands, mix_weights)[0]
+                lines.append(_event_line(battle, position, command))
+
+            # Anything knocked out by this move faints before the next one
+            for fainted in battle.active_positions():
+                if battle.hp[battle.active[fainted]] <= 0:
+                    lines.append(f"|faint|{battle.pokemon_text(fainted)}")
+                    del battle.active[fainted]
+
+        lines += ["|", "|upkeep"]
+
+        for player in battle.teams:
+            for slot in range(battle.active_slots):
+                position = battle.position(player, slot)
+                if position not in battle.active:
+                    switch_line = battle.switch_in(position)
+                    if switch_line is not None:
+                        lines.append(switch_line)
+
+        for player, opponent in (('p1', 'p2'), ('p2', 'p1')):
+            if not battle.active_positions(player):
+                winner = opponent
+        if winner is not None:
+            break
+
+    if winner is None:
+        # Out of turns: whoever has more HP left wins by forfeit
+        remaining = {player: sum(battle.hp[name] for name in team) for player, team in battle.teams.items()}
+        winner = max(remaining, key=remaining.get)
+        loser = 'p1' if winner == 'p2' else 'p2'
+        lines.append(f"|-message|{battle.usernames[loser]} forfeited.")
+
+    lines += ["|", f"|win|{battle.usernames[winner]}"]
+
+    return '\n'.join(lines)
+
+def replay_html(battle_text, title="Synthetic replay"):
+
+    # Minimal page in the layout of a downloaded replay. Showdown escapes
+    # "</" inside the log so the script element can't be closed early.
+    battle_text = battle_text.replace('</', '<\\/')
+
+    return (f'<!DOCTYPE html>\n<meta charset="utf-8" />\n<!-- version 1 -->\n<title>{title}</title>\n'
+            f'<div class="wrapper replay-wrapper" style="max-width:1180px;margin:0 auto">\n'
+            f'<div class="battle"></div><div class="battle-log"></div><div class="replay-controls"></div>\n'
+            f'<script type="text/plain" class="battle-log-data">{battle_text}\n</script>\n</div>\n')
+
+def write_synthetic_corpus(directory, num_replays, seed=0, turns=20, game_type='doubles', command_mix=None):
+
+    # Writes num_replays replay pages and returns their paths. Replay i uses
+    # seed + i, so a corpus can be extended without changing existing files.
+    os.makedirs(directory, exist_ok=True)
+
+    replay_files = []
+    for idx in range(num_replays):
+        battle_text = generate_battle_log(seed + idx, turns, game_type, command_mix)
+        replay_file = os.path.join(directory, f"synthetic-{game_type}-{seed + idx}.html")
+        with open(replay_file, 'w', encoding='utf-8') as f:
+            f.write(replay_html(battle_text, f"Synthetic {game_type} replay {seed + idx}"))
+        replay_files.append(replay_file)
+
+    return replay_files
@@ -0,0 +1,130 @@
+import glob
+import io
+import sys
+import time
+from contextlib import redirect_stdout
+from src.replay_management.process_replay import parse_replay_file
+from src.replay_management.showdown_protocol import (ParseCounters, build_command, class_lookup,
+                                                    generate_replay_commands, tokenize_replay_messages)
+
+# Measures lines/s of generate_replay_commands against the previous
+# split/scan/del tokenizer, on the bundled replays and on a synthetic large
+# log made by repeating their turns. Usage:
+# python -m benchmarks.tokenizer_throughput [repeats] [glob]
+
+def check_for_special_value(split_message, special_val):
+
+    for idx, s in enumerate(split_message):
+        if special_val in s:
+            return idx
+
+    return -1
+
+def reference_tokenize(battle_messages):
+
+    # The tokenizer generate_replay_commands used before the single pass version
+    for message in battle_messages:
+
+        if message == '|':
+            continue
+
+        split_message = message.split('|')
+
+        if len(split_message) <= 1:
+            print(message)
+            continue
+
+        from_text = None
+        of_text = None
+
+        from_idx = check_for_special_value(split_message, '[from]')
+        if from_idx != -1:
+            from_text = split_message[from_idx]
+            del split_message[from_idx]
+
+        of_idx = check_for_special_value(split_message, '[of]')
+        if of_idx != -1:
+            of_text = split_message[of_idx]
+            del split_message[of_idx]
+
+        if split_message[1] not in class_lookup:
+            print(f"Unknown command: {message}")
+            continue
+
+        yield split_message[1], split_message[2:], from_text, of_text
+
+def reference_replay_commands(battle_messages):
+
+    match_history = []
+
+    for command, args, from_text, of_text in reference_tokenize(battle_messages):
+        try:
+            match_history.append(build_command(command, args, from_text, of_text))
+        except TypeError:
+            continue
+
+    return match_history
+
+def exhaust(iterator):
+
+    for _ in iterator:
+        pass
+
+def time_lines_per_second(tokenize, lines, repeats):
+
+    best = None
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            tokenize(lines)
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+
+    return len(lines) / best
+
+def synthetic_log(battle_texts, num_lines):
+
+    # Header up to the first turn of the first replay, then the turns of all
+    # replays repeated until the log is num_lines long
+    header, _, _ = battle_texts[0].partition('\n|turn|1\n')
+    header_lines = header.split('\n')
+
+    turn_lines = []
+    for battle_text in battle_texts:
+        _, _, turns = battle_text.partition('\n|turn|1\n')
+        turn_lines.extend(turns.split('\n'))
+
+    lines = list(header_lines)
+    while len(lines) < num_lines:
+        lines.extend(turn_lines)
+
+    return lines[:num_lines]
+
+def main():
+
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    pattern = sys.argv[2] if len(sys.argv) > 2 else 'replays/*.html'
+
+    battle_texts = [parse_replay_file(replay_file) for replay_file in sorted(glob.glob(pattern))]
+
+    workloads = [('bundled replays', [line for battle_text in battle_texts for line in battle_text.split('\n')])]
+    for num_lines in (100000, 1000000):
+        workloads.append((f"synthetic {num_lines} lines", synthetic_log(battle_texts, num_lines)))
+
+    for name, lines in workloads:
+        workload_repeats = max(1, repeats * 1000 // len(lines)) if len(lines) < 1000 else max(1, repeats // 10)
+
+        stages = [
+            ('tokenize', lambda l: exhaust(reference_tokenize(l)),
+             lambda l: exhaust(tokenize_replay_messages(l, ParseCounters()))),
+            ('tokenize + build', reference_replay_commands,
+             lambda l: generate_replay_commands(l, ParseCounters()))
+        ]
+
+        for stage, old_tokenize, new_tokenize in stages:
+            old_rate = time_lines_per_second(old_tokenize, lines, workload_repeats)
+            new_rate = time_lines_per_second(new_tokenize, lines, workload_repeats)
+            print(f"{name:>24} {stage:>16}: {old_rate:10.0f} -> {new_rate:10.0f} lines/s ({new_rate / old_rate:.2f}x)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+import weakref
+import numpy as np
+from .features import MISSING, PLAYERS, StateEncoder
+from .move_data import move_table
+
+# One slot's part of a joint action is ACTION_WIDTH int32 columns:
+# kind, moves.json index, target and team index to switch to. Targets use
+# Showdown's numbering: 1, 2 are the opposing slots from the left, -1, -2
+# the user's own side, and 0 means no target (singles, or a pass/switch).
+ACTION_WIDTH = 4
+KIND_COL, MOVE_COL, TARGET_COL, SWITCH_COL = range(ACTION_WIDTH)
+
+PASS = 0
+MOVE = 1
+SWITCH = 2
+
+def _opponent(player):
+    return 'p2' if player == 'p1' else 'p1'
+
+class PreferAttacksModel(object):
+
+    # Baseline scorer until a trained one exists: attacking beats switching
+    # beats passing, and attacks on weakened foes score higher. Any callable
+    # with the same signature can be used instead; it gets the encoder's
+    # (1, n) float and int rows for the state plus the (actions, slots *
+    # ACTION_WIDTH) action array and returns one score per action.
+
+    def __init__(self, encoder, player):
+        columns = {name: idx for idx, name in enumerate(encoder.float_names)}
+        opponent = _opponent(player)
+        self.foe_hp_cols = [columns[f'{opponent}:active{slot}:hp'] for slot in range(encoder.active_slots)]
+
+    def __call__(self, floats, ints, actions):
+
+        kinds = actions[:, KIND_COL::ACTION_WIDTH]
+        targets = actions[:, TARGET_COL::ACTION_WIDTH]
+
+        # Missing HP of the foe each slot targets; 0 for anything else
+        foe_missing_hp = np.concatenate([[0.0], 1.0 - floats[0, self.foe_hp_cols]])
+        targeted = np.where(targets > 0, targets, 0)
+
+        scores = np.where(kinds == MOVE, 1.0, np.where(kinds == SWITCH, 0.2, 0.0)) + foe_missing_hp[targeted]
+
+        return scores.sum(axis=1)
+
+class JointActionEnumerator(object):
+
+    # Enumerates every joint action a side can choose for its active slots
+    # from a BattleState snapshot, as one int32 array with a row per joint
+    # action, and scores them with a single model call.
+    #
+    # Only what the replay has revealed is known: each Pokemon's moves are
+    # the ones it has used so far (a single unknown move, index MISSING, if
+    # none), and every team member not known to have fainted is a switch
+    # candidate. Move targeting isn't modelled, so every move may target
+    # every other Pokemon on the field.
+    #
+    # Snapshots don't change, so the enumeration and encoding of each is
+    # cached for as long as the snapshot is alive.
+
+    def __init__(self, model=None, encoder=None, active_slots=2):
+        self.active_slots = active_slots
+        self.encoder = encoder if encoder is not None else StateEncoder(active_slots)
+        self.models = {player: model if model is not None else PreferAttacksModel(self.encoder, player)
+                       for player in PLAYERS}
+
+        self._actions = weakref.WeakKeyDictionary()
+        self._encoded = weakref.WeakKeyDictionary()
+        # Move name -> moves.json index. Enumerating isn't a replay
+        # occurrence, so misses aren't counted in move_table.unknown.
+        self._move_indices = {}
+
+    def _known_moves(self, pokemon):
+
+        # Indices of the moves pokemon has used, or a single MISSING
+        move_indices = self._move_indices
+        for move in pokemon.moves:
+            if move not in move_indices:
+                move_indices[move] = move_table.find_index(move)
+
+        return np.array([move_indices[move] for move in pokemon.moves] or [MISSING], dtype=np.int32)
+
+    def _team(self, state, player):
+
+        # [(team index, PokemonState or None)] in team preview order, then any
+        # Pokemon that weren't previewed
+        side = state.sides[player]
+        by_species = {}
+        for (owner, _), pokemon in state.pokemon.items():
+            if owner == player:
+                by_species.setdefault(pokemon.species, pokemon)
+
+        species_order = list(side.team)
+        species_order += [species for species in by_species if species not in side.team]
+
+        return [(idx, by_species.get(species)) for idx, species in enumerate(species_order)]
+
+    def _slot_actions(self, state, player, slot, position, switch_targets):
+
+        side = state.sides[player]
+        key = side.active.get(position)
+        pokemon = state.pokemon.get(key) if key is not None else None
+
+        if pokemon is None or pokemon.fainted:
+            return np.array([[PASS, MISSING, 0, MISSING]], dtype=np.int32)
+
+        if self.active_slots == 1:
+            targets = [0]
+        else:
+            opponent_side = state.sides.get(_opponent(player))
+            targets = []
+            for foe_slot in range(self.active_slots):
+                foe_position = _opponent(player) + 'abc'[foe_slot]
+                if opponent_side is not None and foe_position in opponent_side.active:
+                    targets.append(foe_slot + 1)
+            for ally_slot in range(self.active_slots):
+                ally_position = player + 'abc'[ally_slot]
+                if ally_slot != slot and ally_position in side.active:
+                    targets.append(-(ally_slot + 1))
+            if not targets:
+                targets = [0]
+
+        move_indices = self._known_moves(pokemon)
+
+        num_moves = len(move_indices)
+        num_targets = len(targets)
+        moves = np.empty((num_moves * num_targets, ACTION_WIDTH), dtype=np.int32)
+        moves[:, KIND_COL] = MOVE
+        moves[:, MOVE_COL] = np.repeat(move_indices, num_targets)
+        moves[:, TARGET_COL] = np.tile(np.array(targets, dtype=np.int32), num_moves)
+        moves[:, SWITCH_COL] = MISSING
+
+        switches = np.empty((len(switch_targets), ACTION_WIDTH), dtype=np.int32)
+        switches[:, KIND_COL] = SWITCH
+        switches[:, MOVE_COL] = MISSING
+        switches[:, TARGET_COL] = 0
+        switches[:, SWITCH_COL] = switch_targets
+
+        return np.concatenate([moves, switches])
+
+    def _enumerate(self, state, player):
+
+        side = state.sides.get(player)
+        if side is None:
+            return np.zeros((0, self.active_slots * ACTION_WIDTH), dtype=np.int32)
+
+        active_keys = set(side.active.values())
+        switch_targets = [
+            idx for idx, pokemon in self._team(state, player)
+            if pokemon is None or (not pokemon.fainted and (pokemon.player, pokemon.name) not in active_keys)
+        ]
+
+        slot_actions = [
+            self._slot_actions(state, player, slot, player + 'abc'[slot], switch_targets)
+            for slot in range(self.active_slots)
+        ]
+
+        # Cartesian product of the slots' actions, as index grids
+        grids = np.meshgrid(*[np.arange(len(actions)) for actions in slot_actions], indexing='ij')
+        joint = np.concatenate([actions[grid.ravel()] for actions, grid in zip(slot_actions, grids)], axis=1)
+
+        # Two slots can't switch to the same Pokemon
+        kinds = joint[:, KIND_COL::ACTION_WIDTH]
+        switch_to = joint[:, SWITCH_COL::ACTION_WIDTH]
+        legal = np.ones(len(joint), dtype=bool)
+        for first in range(self.active_slots):
+            for second in range(first + 1, self.active_slots):
+                legal &= ~((kinds[:, first] == SWITCH) & (kinds[:, second] == SWITCH) &
+                           (switch_to[:, first] == switch_to[:, second]))
+
+        return joint[legal]
+
+    def enumerate(self, state, player):
+
+        # (joint actions, slots * ACTION_WIDTH) int32 array; don't modify it,
+        # it's shared with later calls for the same state
+        per_player = self._actions.get(state)
+        if per_player is None:
+            per_player = {}
+            self._actions[state] = per_player
+
+        actions = per_player.get(player)
+        if actions is None:
+            actions = self._enumerate(state, player)
+            actions.setflags(write=False)
+            per_player[player] = actions
+
+        return actions
+
+    def _encode(self, state):
+
+        encoded = self._encoded.get(state)
+        if encoded is None:
+            encoded = self.encoder.encode([state])
+            self._encoded[state] = encoded
+
+        return encoded
+
+    def score(self, state, player):
+
+        actions = self.enumerate(state, player)
+        if not len(actions):
+            return actions, np.zeros(0, dtype=np.float32)
+
+        floats, ints = self._encode(state)
+
+        return actions, np.asarray(self.models[player](floats, ints, actions))
+
+    def top_k(self, state, player, k=5):
+
+        # The k best joint actions and their scores, best first
+        actions, scores = self.score(state, player)
+        if len(scores) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best], kind='stable')]
+
+        return actions[best], scores[best]
+
+    def describe(self, state, player, joint_action):
+
+        # Showdown choice string for one row, e.g. "move 3 1, switch 5".
+        # Moves are given by their position among the Pokemon's known moves,
+        # and switches by team index, both 1-based as in Showdown.
+        side = state.sides[player]
+        choices = []
+
+        for slot in range(self.active_slots):
+            kind, move_idx, target, switch_idx = joint_action[slot * ACTION_WIDTH:(slot + 1) * ACTION_WIDTH]
+            if kind == PASS:
+                choices.append('pass')
+            elif kind == SWITCH:
+                choices.append(f'switch {switch_idx + 1}')
+            else:
+                pokemon = state.pokemon[side.active[player + 'abc'[slot]]]
+                known = list(self._known_moves(pokemon))
+                choice = f'move {known.index(move_idx) + 1}'
+                choices.append(choice + (f' {target}' if target else ''))
+
+        return ', '.join(choices)
@@ -0,0 +1,223 @@
+import struct
+from array import array
+from .showdown_protocol import class_lookup, build_command, tokenize_replay_messages
+from .symbols import StringTable
+
+# Opcodes are positions in class_lookup, so they stay stable as long as the
+# lookup table only grows at the end
+opcode_ids = {command: idx for idx, command in enumerate(class_lookup)}
+opcode_commands = list(class_lookup)
+opcode_classes = list(class_lookup.values())
+
+NO_VALUE = -1
+
+# Binary layout written by ColumnarBattleLog.to_bytes: the header, then the
+# 4 byte columns, the opcodes, the 1 byte columns and finally the UTF-8 string
+# data, so every column stays aligned for memoryview.cast
+FORMAT_MAGIC = b'PSBL'
+FORMAT_VERSION = 1
+FORMAT_HEADER = struct.Struct('<4sIIIIIII')
+
+def parse_position(arg):
+
+    # "p1a: Groudon" -> (1, 0), "p2" -> (2, -1), anything else -> (-1, -1)
+    if len(arg) < 2 or arg[0] != 'p' or not arg[1].isdigit():
+        return NO_VALUE, NO_VALUE
+
+    if len(arg) == 2 or arg[2] == ':':
+        return int(arg[1]), NO_VALUE
+
+    if 'a' <= arg[2] <= 'c' and (len(arg) == 3 or arg[3] == ':'):
+        return int(arg[1]), ord(arg[2]) - ord('a')
+
+    return NO_VALUE, NO_VALUE
+
+class ColumnarBattleLog(object):
+
+    # Struct-of-arrays storage for a parsed battle log. Each command is an
+    # opcode plus side/slot ids and a run of interned argument ids, and the
+    # ShowdownMessage objects are only built when an entry is indexed.
+
+    def __init__(self, strings=None):
+        self.strings = strings if strings is not None else StringTable()
+
+        self.opcodes = array('H')
+        self.sides = array('b')
+        self.slots = array('b')
+        self.from_ids = array('i')
+        self.of_ids = array('i')
+
+        # Arguments of command i are arg_ids[arg_offsets[i]:arg_offsets[i + 1]]
+        self.arg_offsets = array('I', [0])
+        self.arg_ids = array('I')
+
+        # Leftover bracketed tags are rare, so they're kept sparsely by index
+        self.extra_tags = {}
+
+    @classmethod
+    def from_lines(cls, battle_messages, strings=None, counters=None):
+
+        battle_log = cls(strings)
+
+        for command, args, from_text, of_text, tags in tokenize_replay_messages(battle_messages, counters):
+            battle_log.append(command, args, from_text, of_text, tags)
+
+        return battle_log
+
+    def append(self, command, args, from_text=None, of_text=None, tags=None):
+
+        intern = self.strings.intern
+
+        if tags:
+            self.extra_tags[len(self.opcodes)] = tuple(intern(tag) for tag in tags)
+
+        self.opcodes.append(opcode_ids[command])
+
+        side, slot = parse_position(args[0]) if args else (NO_VALUE, NO_VALUE)
+        self.sides.append(side)
+        self.slots.append(slot)
+
+        self.from_ids.append(NO_VALUE if from_text is None else intern(from_text))
+        self.of_ids.append(NO_VALUE if of_text is None else intern(of_text))
+
+        self.arg_ids.extend(intern(arg) for arg in args)
+        self.arg_offsets.append(len(self.arg_ids))
+
+    def command_type(self, idx):
+        return opcode_classes[self.opcodes[idx]]
+
+    def command_types(self):
+        return (opcode_classes[opcode] for opcode in self.opcodes)
+
+    def get_args(self, idx):
+        strings = self.strings.strings
+        return [strings[arg_id] for arg_id in self.arg_ids[self.arg_offsets[idx]:self.arg_offsets[idx + 1]]]
+
+    def _materialize(self, idx):
+
+        from_id = self.from_ids[idx]
+        of_id = self.of_ids[idx]
+        tag_ids = self.extra_tags.get(idx)
+
+        return build_command(
+            opcode_commands[self.opcodes[idx]],
+            self.get_args(idx),
+            None if from_id == NO_VALUE else self.strings[from_id],
+            None if of_id == NO_VALUE else self.strings[of_id],
+            None if tag_ids is None else [self.strings[tag_id] for tag_id in tag_ids]
+        )
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def __getitem__(self, idx):
+
+        if isinstance(idx, slice):
+            return [self._materialize(i) for i in range(*idx.indices(len(self)))]
+
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("battle log index out of range")
+
+        return self._materialize(idx)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self._materialize(idx)
+
+    def to_bytes(self):
+
+        # Strings are renumbered into a table local to this log, so a log
+        # built against a large shared table is stored compactly
+        strings = self.strings.strings
+        local = StringTable()
+        intern = local.intern
+
+        from_ids = array('i', (NO_VALUE if value_id == NO_VALUE else intern(strings[value_id]) for value_id in self.from_ids))
+        of_ids = array('i', (NO_VALUE if value_id == NO_VALUE else intern(strings[value_id]) for value_id in self.of_ids))
+        arg_ids = array('I', (intern(strings[value_id]) for value_id in self.arg_ids))
+
+        # Stored flat as (index, count, ids...) runs
+        tags = array('I')
+        for idx, tag_ids in sorted(self.extra_tags.items()):
+            tags.append(idx)
+            tags.append(len(tag_ids))
+            tags.extend(intern(strings[tag_id]) for tag_id in tag_ids)
+
+        encoded = [value.encode('utf-8') for value in local.strings]
+        string_offsets = array('I', [0])
+        for value in encoded:
+            string_offsets.append(string_offsets[-1] + len(value))
+
+        header = FORMAT_HEADER.pack(FORMAT_MAGIC, FORMAT_VERSION, len(self), len(arg_ids), len(encoded),
+                                    len(tags), string_offsets[-1], 0)
+
+        columns = [from_ids, of_ids, self.arg_offsets, arg_ids, string_offsets, tags, self.opcodes, self.sides, self.slots]
+
+        return b''.join([header] + [column.tobytes() for column in columns] + encoded)
+
+    @classmethod
+    def from_buffer(cls, buffer):
+
+        # Columns are zero-copy views into buffer (e.g. an mmap), which has to
+        # stay open as long as the log is used. Logs loaded this way are
+        # read-only; only the strings are decoded up front.
+        view = memoryview(buffer)
+        if len(view) < FORMAT_HEADER.size:
+            raise ValueError("Truncated battle log")
+
+        magic, version, num_commands, num_args, num_strings, num_tags, num_string_bytes, _ = FORMAT_HEADER.unpack_from(view)
+        if magic != FORMAT_MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Not a battle log written by this version of ColumnarBattleLog")
+
+        offset = FORMAT_HEADER.size
+
+        def take(typecode, count):
+            nonlocal offset
+            end = offset + struct.calcsize(typecode) * count
+            if end > len(view):
+                raise ValueError("Truncated battle log")
+            column = view[offset:end].cast(typecode)
+            offset = end
+            return column
+
+        from_ids = take('i', num_commands)
+        of_ids = take('i', num_commands)
+        arg_offsets = take('I', num_commands + 1)
+        arg_ids = take('I', num_args)
+        string_offsets = take('I', num_strings + 1)
+        tags = take('I', num_tags)
+        opcodes = take('H', num_commands)
+        sides = take('b', num_commands)
+        slots = take('b', num_commands)
+        if offset + num_string_bytes > len(view):
+            raise ValueError("Truncated battle log")
+        string_data = view[offset:offset + num_string_bytes]
+
+        strings = StringTable([str(string_data[string_offsets[i]:string_offsets[i + 1]], 'utf-8') for i in range(num_strings)])
+
+        battle_log = cls(strings)
+        battle_log.opcodes = opcodes
+        battle_log.sides = sides
+        battle_log.slots = slots
+        battle_log.from_ids = from_ids
+        battle_log.of_ids = of_ids
+        battle_log.arg_offsets = arg_offsets
+        battle_log.arg_ids = arg_ids
+        battle_log.buffer = buffer
+
+        idx = 0
+        while idx < len(tags):
+            count = tags[idx + 1]
+            battle_log.extra_tags[tags[idx]] = tuple(tags[idx + 2:idx + 2 + count])
+            idx += 2 + count
+
+        return battle_log
+
+    def nbytes(self):
+
+        # Size of the column buffers, not counting the (possibly shared) string table
+        columns = [self.opcodes, self.sides, self.slots, self.from_ids, self.of_ids, self.arg_offsets, self.arg_ids]
+
+        return sum(column.itemsize * len(column) for column in columns)
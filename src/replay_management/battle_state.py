@@ -0,0 +1,406 @@
+from .showdown_protocol import (AbilityMessage, BoostMessage, ClearAllBoostMessage, ClearBoostMessage,
+                                ClearNegativeBoostMessage, ClearPositiveBoostMessage, CopyBoostMessage,
+                                CureStatusMessage, CureTeamMessage, DamageMessage, DetailsChangeMessage, DragMessage,
+                                EndAbilityMessage, EndEffectMessage, EndItemMessage, FaintMessage, FieldEndMessage,
+                                FieldStartMessage, FormeChangeMessage, HealMessage, InvertBoostMessage, ItemMessage,
+                                MoveMessage, PokeMessage, ReplaceMessage, SetBoostMessage, SetHPMessage, SideEndMessage,
+                                SideStartMessage, StartEffectMessage, StatusMessage, SwapBoostMessage,
+                                SwapSideConditionsMessage, SwitchMessage, TransformMessage, TurnMessage,
+                                UnboostMessage, WeatherMessage)
+
+MAX_BOOST = 6
+
+EFFECT_PREFIXES = ('move: ', 'ability: ', 'item: ')
+
+def effect_name(effect):
+
+    # "move: Grassy Terrain" -> "Grassy Terrain"
+    for prefix in EFFECT_PREFIXES:
+        if effect.startswith(prefix):
+            return effect[len(prefix):]
+
+    return effect
+
+def parse_hp_status(hp_status):
+
+    # "55\/100 brn" -> (55, 100, 'brn'), "0 fnt" -> (0, None, 'fnt')
+    hp_text, _, status = hp_status.replace('\\/', '/').partition(' ')
+    hp, _, max_hp = hp_text.partition('/')
+
+    return int(hp), int(max_hp) if max_hp else None, status or None
+
+def parse_details(details):
+
+    # "Groudon, L50, F, shiny" -> ('Groudon', '50', 'F')
+    fields = details.split(', ')
+    level = '100'
+    gender = None
+
+    for field in fields[1:]:
+        if field.startswith('L'):
+            level = field[1:]
+        elif field in ('M', 'F'):
+            gender = field
+
+    return fields[0], level, gender
+
+class PokemonState(object):
+
+    def __init__(self, player, name):
+        self.player = player
+        self.name = name
+        self.species = name
+        self.level = None
+        self.gender = None
+        self.hp = None
+        self.max_hp = None
+        self.status = None
+        self.boosts = {}
+        self.volatiles = set()
+        self.item = None
+        self.ability = None
+        self.position = None
+        self.fainted = False
+        # Moves seen so far, in the order they were first used
+        self.moves = ()
+
+    def copy(self):
+        pokemon = PokemonState.__new__(PokemonState)
+        pokemon.__dict__.update(self.__dict__)
+        pokemon.boosts = dict(self.boosts)
+        pokemon.volatiles = set(self.volatiles)
+        return pokemon
+
+    @property
+    def hp_fraction(self):
+        if self.hp is None or not self.max_hp:
+            return None
+        return self.hp / self.max_hp
+
+class SideState(object):
+
+    def __init__(self, player):
+        self.player = player
+        # Species shown at team preview, in order
+        self.team = ()
+        # Slot position ('p1a') -> key of the Pokemon there
+        self.active = {}
+        # Side condition -> layers (Spikes etc. stack, most are 1)
+        self.conditions = {}
+
+    def copy(self):
+        side = SideState(self.player)
+        side.team = self.team
+        side.active = dict(self.active)
+        side.conditions = dict(self.conditions)
+        return side
+
+class BattleState(object):
+
+    # Field state of a battle, updated one message at a time by apply.
+    #
+    # Snapshots share every Pokemon and side record with the live state; a
+    # record is only copied the first time it changes after a snapshot, so a
+    # snapshot costs a couple of shallow dict copies however big the state is.
+
+    def __init__(self):
+        self.turn = 0
+        self.weather = None
+        # Field condition -> turn it started
+        self.field_conditions = {}
+        self.sides = {}
+        # (player, name) -> PokemonState
+        self.pokemon = {}
+
+        # Keys of the records in sides/pokemon that no snapshot refers to yet,
+        # and so can be changed in place
+        self._owned = set()
+
+    def snapshot(self):
+
+        state = BattleState.__new__(BattleState)
+        state.turn = self.turn
+        state.weather = self.weather
+        state.field_conditions = dict(self.field_conditions)
+        state.sides = dict(self.sides)
+        state.pokemon = dict(self.pokemon)
+        state._owned = set()
+
+        self._owned.clear()
+
+        return state
+
+    def get_active_pokemon(self, player):
+
+        side = self.sides.get(player)
+        if side is None:
+            return []
+
+        return [self.pokemon[side.active[position]] for position in sorted(side.active)]
+
+    def _side(self, player):
+
+        side = self.sides.get(player)
+        if side is None:
+            side = SideState(player)
+        elif player in self._owned:
+            return side
+        else:
+            side = side.copy()
+
+        self.sides[player] = side
+        self._owned.add(player)
+
+        return side
+
+    def _pokemon(self, player, name):
+
+        key = (player, name)
+        pokemon = self.pokemon.get(key)
+        if pokemon is None:
+            pokemon = PokemonState(player, name)
+        elif key in self._owned:
+            return pokemon
+        else:
+            pokemon = pokemon.copy()
+
+        self.pokemon[key] = pokemon
+        self._owned.add(key)
+
+        return pokemon
+
+    def _message_pokemon(self, command):
+        return self._pokemon(command.player, command.name)
+
+    def _target_pokemon(self, target):
+        position, name = target.split(': ', 1)
+        return self._pokemon(position[:2], name)
+
+    def apply(self, command):
+
+        handler = _get_handler(type(command))
+        if handler is not None:
+            handler(self, command)
+
+    # Handlers, registered in state_handlers below
+
+    def _apply_turn(self, command):
+        self.turn = int(command.number)
+
+    def _apply_poke(self, command):
+        side = self._side(command.player)
+        side.team = side.team + (command.name,)
+
+    def _apply_switch(self, command):
+
+        side = self._side(command.player)
+        previous_key = side.active.get(command.position)
+        if previous_key is not None and previous_key in self.pokemon:
+            previous = self._pokemon(*previous_key)
+            previous.position = None
+            previous.boosts = {}
+            previous.volatiles = set()
+
+        pokemon = self._message_pokemon(command)
+        pokemon.species, pokemon.level, pokemon.gender = parse_details(command.details)
+        pokemon.hp, pokemon.max_hp, pokemon.status = parse_hp_status(command.hp_status)
+        pokemon.position = command.position
+
+        side.active[command.position] = (command.player, command.name)
+
+    def _apply_details_change(self, command):
+
+        pokemon = self._message_pokemon(command)
+        pokemon.species, pokemon.level, pokemon.gender = parse_details(command.details)
+        if command.hp_status:
+            pokemon.hp, pokemon.max_hp, pokemon.status = parse_hp_status(command.hp_status)
+
+    def _apply_move(self, command):
+
+        pokemon = self._message_pokemon(command)
+        if command.move not in pokemon.moves:
+            pokemon.moves = pokemon.moves + (command.move,)
+
+    def _apply_faint(self, command):
+
+        pokemon = self._message_pokemon(command)
+        pokemon.hp = 0
+        pokemon.status = 'fnt'
+        pokemon.fainted = True
+
+    def _apply_hp(self, command):
+
+        pokemon = self._message_pokemon(command)
+        hp, max_hp, status = parse_hp_status(command.hp_status)
+        pokemon.hp = hp
+        if max_hp is not None:
+            pokemon.max_hp = max_hp
+        pokemon.status = status
+
+    def _apply_set_hp(self, command):
+        self._message_pokemon(command).hp = parse_hp_status(command.hp)[0]
+
+    def _apply_status(self, command):
+        self._message_pokemon(command).status = command.status
+
+    def _apply_cure_status(self, command):
+        self._message_pokemon(command).status = None
+
+    def _apply_cure_team(self, command):
+        for player, name in list(self.pokemon):
+            if player == command.player:
+                self._pokemon(player, name).status = None
+
+    def _change_boost(self, command, sign):
+        pokemon = self._message_pokemon(command)
+        boost = pokemon.boosts.get(command.stat, 0) + sign * int(command.amount)
+        pokemon.boosts[command.stat] = max(-MAX_BOOST, min(MAX_BOOST, boost))
+
+    def _apply_boost(self, command):
+        self._change_boost(command, 1)
+
+    def _apply_unboost(self, command):
+        self._change_boost(command, -1)
+
+    def _apply_set_boost(self, command):
+        self._message_pokemon(command).boosts[command.stat] = int(command.amount)
+
+    def _apply_clear_boost(self, command):
+        self._message_pokemon(command).boosts = {}
+
+    def _apply_clear_all_boost(self, command):
+        for side in list(self.sides.values()):
+            for key in side.active.values():
+                self._pokemon(*key).boosts = {}
+
+    def _apply_clear_positive_boost(self, command):
+        pokemon = self._target_pokemon(command.target)
+        pokemon.boosts = {stat: boost for stat, boost in pokemon.boosts.items() if boost < 0}
+
+    def _apply_clear_negative_boost(self, command):
+        pokemon = self._message_pokemon(command)
+        pokemon.boosts = {stat: boost for stat, boost in pokemon.boosts.items() if boost > 0}
+
+    def _apply_invert_boost(self, command):
+        pokemon = self._message_pokemon(command)
+        pokemon.boosts = {stat: -boost for stat, boost in pokemon.boosts.items()}
+
+    def _apply_copy_boost(self, command):
+        source = self._message_pokemon(command)
+        self._target_pokemon(command.target).boosts = dict(source.boosts)
+
+    def _apply_swap_boost(self, command):
+
+        source = self._message_pokemon(command)
+        target = self._target_pokemon(command.target)
+        stats = command.stats.split(', ') if command.stats else set(source.boosts) | set(target.boosts)
+
+        for stat in stats:
+            source_boost = source.boosts.pop(stat, 0)
+            target_boost = target.boosts.pop(stat, 0)
+            if target_boost:
+                source.boosts[stat] = target_boost
+            if source_boost:
+                target.boosts[stat] = source_boost
+
+    def _apply_weather(self, command):
+        self.weather = None if command.weather == 'none' else command.weather
+
+    def _apply_field_start(self, command):
+        self.field_conditions[effect_name(command.condition)] = self.turn
+
+    def _apply_field_end(self, command):
+        self.field_conditions.pop(effect_name(command.condition), None)
+
+    def _apply_side_start(self, command):
+        conditions = self._side(command.side[:2]).conditions
+        condition = effect_name(command.condition)
+        conditions[condition] = conditions.get(condition, 0) + 1
+
+    def _apply_side_end(self, command):
+        self._side(command.side[:2]).conditions.pop(effect_name(command.condition), None)
+
+    def _apply_swap_side_conditions(self, command):
+        p1 = self._side('p1')
+        p2 = self._side('p2')
+        p1.conditions, p2.conditions = p2.conditions, p1.conditions
+
+    def _apply_start_effect(self, command):
+        self._message_pokemon(command).volatiles.add(effect_name(command.effect))
+
+    def _apply_end_effect(self, command):
+        self._message_pokemon(command).volatiles.discard(effect_name(command.effect))
+
+    def _apply_item(self, command):
+        self._message_pokemon(command).item = command.item
+
+    def _apply_end_item(self, command):
+        self._message_pokemon(command).item = None
+
+    def _apply_ability(self, command):
+        self._message_pokemon(command).ability = command.ability
+
+    def _apply_end_ability(self, command):
+        self._message_pokemon(command).ability = None
+
+    def _apply_transform(self, command):
+        self._message_pokemon(command).volatiles.add('Transform')
+
+state_handlers = {
+    TurnMessage: BattleState._apply_turn,
+    PokeMessage: BattleState._apply_poke,
+    SwitchMessage: BattleState._apply_switch,
+    DragMessage: BattleState._apply_switch,
+    ReplaceMessage: BattleState._apply_switch,
+    DetailsChangeMessage: BattleState._apply_details_change,
+    FormeChangeMessage: BattleState._apply_details_change,
+    MoveMessage: BattleState._apply_move,
+    FaintMessage: BattleState._apply_faint,
+    DamageMessage: BattleState._apply_hp,
+    HealMessage: BattleState._apply_hp,
+    SetHPMessage: BattleState._apply_set_hp,
+    StatusMessage: BattleState._apply_status,
+    CureStatusMessage: BattleState._apply_cure_status,
+    CureTeamMessage: BattleState._apply_cure_team,
+    BoostMessage: BattleState._apply_boost,
+    UnboostMessage: BattleState._apply_unboost,
+    SetBoostMessage: BattleState._apply_set_boost,
+    ClearBoostMessage: BattleState._apply_clear_boost,
+    ClearAllBoostMessage: BattleState._apply_clear_all_boost,
+    ClearPositiveBoostMessage: BattleState._apply_clear_positive_boost,
+    ClearNegativeBoostMessage: BattleState._apply_clear_negative_boost,
+    InvertBoostMessage: BattleState._apply_invert_boost,
+    CopyBoostMessage: BattleState._apply_copy_boost,
+    SwapBoostMessage: BattleState._apply_swap_boost,
+    WeatherMessage: BattleState._apply_weather,
+    FieldStartMessage: BattleState._apply_field_start,
+    FieldEndMessage: BattleState._apply_field_end,
+    SideStartMessage: BattleState._apply_side_start,
+    SideEndMessage: BattleState._apply_side_end,
+    SwapSideConditionsMessage: BattleState._apply_swap_side_conditions,
+    StartEffectMessage: BattleState._apply_start_effect,
+    EndEffectMessage: BattleState._apply_end_effect,
+    ItemMessage: BattleState._apply_item,
+    EndItemMessage: BattleState._apply_end_item,
+    AbilityMessage: BattleState._apply_ability,
+    EndAbilityMessage: BattleState._apply_end_ability,
+    TransformMessage: BattleState._apply_transform
+}
+
+_handler_cache = {}
+
+def _get_handler(command_type):
+
+    # Exact class first, then the nearest registered base class
+    if command_type in _handler_cache:
+        return _handler_cache[command_type]
+
+    handler = None
+    for cls in command_type.__mro__:
+        if cls in state_handlers:
+            handler = state_handlers[cls]
+            break
+
+    _handler_cache[command_type] = handler
+
+    return handler
@@ -0,0 +1,332 @@
+import argparse
+import json
+import os
+import time
+import traceback
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
+from .dedup import SeenSet, fingerprint_battle_log
+from .process_replay import ReplayProcessor, iter_battle_lines
+from .sources import iter_replays, read_battle_log
+from .showdown_protocol import ParseCounters, iter_replay_commands
+from .symbols import symbol_table
+
+class ReplayResult(object):
+
+    def __init__(self, path, output=None, num_lines=0, error=None, elapsed=0.0, counters=None, fingerprint=None,
+                 duplicate=False):
+        self.path = path
+        self.output = output
+        self.num_lines = num_lines
+        self.error = error
+        self.elapsed = elapsed
+        self.counters = counters
+        # The battle's dedup fingerprint, if ingest_replay was asked for it,
+        # and whether it was already seen, in which case nothing was parsed
+        self.fingerprint = fingerprint
+        self.duplicate = duplicate
+
+    @property
+    def ok(self):
+        return self.error is None
+
+class IngestStats(object):
+
+    def __init__(self):
+        self.replays = 0
+        self.failures = 0
+        self.duplicates = 0
+        self.lines = 0
+        # Every replay's ParseCounters merged together
+        self.counters = ParseCounters()
+        self.start_time = time.perf_counter()
+        self.end_time = None
+
+    def add(self, result):
+        self.replays += 1
+        self.lines += result.num_lines
+        if result.counters is not None:
+            self.counters.merge(result.counters)
+        if not result.ok:
+            self.failures += 1
+
+    def finish(self):
+        self.end_time = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        end_time = self.end_time if self.end_time is not None else time.perf_counter()
+        return end_time - self.start_time
+
+    @property
+    def replays_per_second(self):
+        return self.replays / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def lines_per_second(self):
+        return self.lines / self.elapsed if self.elapsed > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            'replays': self.replays,
+            'failures': self.failures,
+            'duplicates': self.duplicates,
+            'lines': self.lines,
+            'elapsed': self.elapsed,
+            'replays_per_second': self.replays_per_second,
+            'lines_per_second': self.lines_per_second
+        }
+
+    def summary(self):
+        return (f"{self.replays} replays ({self.failures} failed, {self.duplicates} duplicates skipped), {self.lines} lines in {self.elapsed:.2f}s: "
+                f"{self.replays_per_second:.1f} replays/s, {self.lines_per_second:.0f} lines/s")
+
+def _item_name(item):
+
+    # Replays are paths or (name, battle_text) entries from sources
+    return item[0] if isinstance(item, tuple) else item
+
+# The SeenSet pool workers check fingerprints against, opened from the
+# run's seen file by _init_worker
+_worker_seen = None
+
+def ingest_replay(replay_file, process=None, timed=False, fingerprint=False, seen=None):
+
+    # Runs in the worker: any failure is caught and reported on the result so
+    # one bad replay doesn't take down the rest of the batch. timed records
+    # stage and per-command build times in the result's counters, and
+    # fingerprint puts the battle's dedup fingerprint on the result. Battles
+    # already in seen (or the worker's SeenSet) come back as duplicates
+    # without being tokenized.
+    # replay_file may also be a (name, battle_text) entry, already read, or
+    # a (name, exception) entry for a replay sources couldn't read.
+    start_time = time.perf_counter()
+    num_lines = 0
+    counters = ParseCounters(timed)
+    name = _item_name(replay_file)
+    battle_fingerprint = None
+
+    try:
+        if isinstance(replay_file, tuple):
+            battle_text = replay_file[1]
+            if isinstance(battle_text, Exception):
+                raise battle_text
+        else:
+            with counters.stage('extract'):
+                battle_text = read_battle_log(replay_file)
+        num_lines = battle_text.count('\n') + 1
+        if fingerprint:
+            battle_fingerprint = fingerprint_battle_log(battle_text)
+            seen = seen if seen is not None else _worker_seen
+            if seen is not None and battle_fingerprint in seen:
+                return ReplayResult(name, num_lines=num_lines, elapsed=time.perf_counter() - start_time,
+                                    counters=counters, fingerprint=battle_fingerprint, duplicate=True)
+
+        battle_commands = list(iter_replay_commands(iter_battle_lines(battle_text), counters))
+        output = ReplayProcessor(battle_commands, counters)
+        if process is not None:
+            with counters.stage('process'):
+                output = process(output)
+    except Exception:
+        return ReplayResult(name, num_lines=num_lines, error=traceback.format_exc(),
+                            elapsed=time.perf_counter() - start_time, counters=counters,
+                            fingerprint=battle_fingerprint)
+
+    return ReplayResult(name, output, num_lines, elapsed=time.perf_counter() - start_time, counters=counters,
+                        fingerprint=battle_fingerprint)
+
+def _fingerprint(item):
+
+    try:
+        battle_text = item[1] if isinstance(item, tuple) else read_battle_log(item)
+        return fingerprint_battle_log(battle_text)
+    except Exception:
+        # Left for ingestion to report
+        return None
+
+def iter_unique(replay_files, seen, fingerprints):
+
+    # Lazily drops replays of battles already in the SeenSet seen or seen
+    # earlier in replay_files, recording the fingerprint of the rest in
+    # fingerprints by name. Only the battle log is read; nothing is tokenized.
+    # ingest_corpus fingerprints in its workers instead; this is for finding
+    # duplicates without ingesting anything.
+    first_seen = set()
+
+    for item in replay_files:
+        fingerprint = _fingerprint(item)
+        if fingerprint is not None:
+            if fingerprint in first_seen or fingerprint in seen:
+                continue
+            first_seen.add(fingerprint)
+
+        fingerprints[_item_name(item)] = fingerprint
+        yield item
+
+def find_duplicates(replay_files, seen):
+
+    # Splits replay_files into the first copy of each battle not already in
+    # the SeenSet seen, with its fingerprint, and the rest
+    unique = {}
+    kept = set()
+    for item in iter_unique(replay_files, seen, unique):
+        kept.add(_item_name(item))
+
+    return unique, [item for item in replay_files if _item_name(item) not in kept]
+
+def _init_worker(symbol_file, seen_file=None):
+
+    global _worker_seen
+
+    if symbol_file is not None and os.path.exists(symbol_file):
+        symbol_table.read(symbol_file)
+
+    # A snapshot of what was seen before the run; battles ingested since
+    # are caught when their results come back
+    if seen_file is not None:
+        _worker_seen = SeenSet(seen_file)
+
+def _imap_windowed(pool, worker, items, chunksize, ordered, window):
+
+    # pool.imap over items, window items at a time: imap would otherwise read
+    # the whole input up front, from its own thread. The next window is
+    # submitted before the last is drained, so workers don't sit idle.
+    imap = pool.imap if ordered else pool.imap_unordered
+    items = iter(items)
+    pending = None
+
+    while True:
+        batch = list(islice(items, window))
+        current = imap(worker, batch, chunksize) if batch else None
+        if pending is not None:
+            yield from pending
+        if current is None:
+            return
+        pending = current
+
+def ingest_corpus(source, workers=None, chunksize=8, ordered=True, process=None, stats=None, symbol_file=None,
+                  timed=False, seen=None):
+
+    # Yields a ReplayResult per replay. source is a path, directory or glob
+    # pattern read with sources.iter_replays (so archives and JSON exports
+    # work too), or any iterable of replay paths and (name, battle_text)
+    # entries, which is read lazily. process, if given, is applied to each
+    # ReplayProcessor in the worker and must be picklable (a module level
+    # function). workers=1 runs everything in this process.
+    #
+    # symbol_file is a saved SymbolTable shared by the run: it's loaded here
+    # and in every worker, and saved again with any new symbols at the end.
+    #
+    # Each result carries its replay's ParseCounters, and stats.counters
+    # totals them over the run; timed adds stage and build timings.
+    #
+    # seen, a dedup.SeenSet, skips replays of battles already ingested, in
+    # this run or an earlier one sharing its file. Workers fingerprint each
+    # battle log right after reading it and check it against seen as it was
+    # when the run started, returning battles already there as duplicates
+    # before tokenizing anything. Copies of a battle within the run are
+    # only caught here, when their results come back, so those are still
+    # parsed. An in-memory SeenSet can't be opened by pool workers, so
+    # with one only the check here applies. Battles are added to seen as
+    # they're ingested successfully.
+    replay_files = iter_replays(source) if isinstance(source, str) else source
+
+    _init_worker(symbol_file)
+
+    if stats is None:
+        stats = IngestStats()
+
+    worker = partial(ingest_replay, process=process, timed=timed, fingerprint=seen is not None)
+    # Fingerprints of every battle seen so far in this run, including failures
+    first_seen = set()
+
+    if workers == 1:
+        results = map(partial(worker, seen=seen), replay_files)
+    else:
+        seen_file = None
+        if seen is not None:
+            # Workers open their own connection, so they need what's pending
+            seen.flush()
+            seen_file = seen.seen_file
+        pool = Pool(workers, _init_worker, (symbol_file, seen_file))
+        window = (workers or os.cpu_count() or 1) * chunksize * 4
+        results = _imap_windowed(pool, worker, replay_files, chunksize, ordered, window)
+
+    try:
+        for result in results:
+            if result.duplicate:
+                stats.duplicates += 1
+                continue
+            if result.fingerprint is not None:
+                if result.fingerprint in first_seen or result.fingerprint in seen:
+                    stats.duplicates += 1
+                    continue
+                first_seen.add(result.fingerprint)
+                if result.ok:
+                    seen.add(result.fingerprint, result.path)
+            stats.add(result)
+            yield result
+    finally:
+        if workers != 1:
+            pool.terminate()
+            pool.join()
+        if seen is not None:
+            seen.flush()
+
+    stats.finish()
+
+    if symbol_file is not None:
+        symbol_table.save(symbol_file)
+
+def print_profile(counters, top=10):
+
+    for name, stage in sorted(counters.as_dict()['stages'].items(), key=lambda item: -item[1]['wall']):
+        cpu = f", {stage['cpu']:.3f}s cpu" if stage['cpu'] is not None else ''
+        print(f"{name:>10}: {stage['wall']:.3f}s wall{cpu} over {stage['calls']} calls")
+
+    print(f"Slowest {top} commands to build:")
+    for command, build_time in counters.build_time.most_common(top):
+        count = counters.commands[command]
+        print(f"{command:>16}: {build_time:.3f}s for {count} ({build_time / count * 1e6:.2f}us each)")
+
+    for name, skipped in (('unknown', counters.unknown), ('malformed', counters.malformed)):
+        if skipped:
+            print(f"Skipped {name}: {dict(skipped.most_common(top))}")
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Parse and process a directory, glob or archive of replays")
+    parser.add_argument('source', help="replay file, archive, directory or glob pattern (see sources)")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: cpu count)")
+    parser.add_argument('--chunksize', type=int, default=8, help="replays handed to a worker at a time")
+    parser.add_argument('--unordered', action='store_true', help="yield results as they finish")
+    parser.add_argument('--symbols', default=None, help="symbol table file to load and update")
+    parser.add_argument('--profile', default=None, help="time each stage and command, and write the results here")
+    parser.add_argument('--seen', default=None, help="file of battles already ingested, to skip duplicates")
+    args = parser.parse_args()
+
+    seen = SeenSet(args.seen) if args.seen is not None else None
+
+    stats = IngestStats()
+    replay_profiles = {}
+
+    for result in ingest_corpus(args.source, args.workers, args.chunksize, not args.unordered, stats=stats,
+                                symbol_file=args.symbols, timed=args.profile is not None, seen=seen):
+        if not result.ok:
+            print(f"Failed to process {result.path}:\n{result.error}")
+        if args.profile is not None:
+            replay_profiles[result.path] = result.counters.as_dict()
+
+    print(stats.summary())
+
+    if seen is not None:
+        seen.close()
+
+    if args.profile is not None:
+        print_profile(stats.counters)
+        with open(args.profile, 'w') as f:
+            json.dump({'corpus': stats.counters.as_dict(), 'replays': replay_profiles}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
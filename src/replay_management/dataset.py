@@ -0,0 +1,421 @@
+import argparse
+import glob
+import json
+import os
+import time
+import uuid
+from functools import partial
+import numpy as np
+from .actions import ACTION_WIDTH, KIND_COL, MOVE, MOVE_COL, PASS, SWITCH, SWITCH_COL, TARGET_COL
+from .battle_state import parse_details
+from .corpus import IngestStats, ingest_corpus
+from .features import MISSING, PLAYERS, StateEncoder
+from .move_data import get_move_index
+from .showdown_protocol import MoveMessage, SwitchMessage, UpkeepMessage, WinMessage
+from .symbols import SymbolTable, symbol_table
+
+# A dataset is a directory of shards, each a fixed number of per-turn
+# samples stored as one uncompressed .npy file per column, plus:
+#   dataset.json: the layout (column dtypes and widths, feature names)
+#   <shard>.shard.json: one per finished shard, with its row count, the
+#       replays its rows came from and its symbol file
+#   <writer>.symbols.json: one per writer, the symbol table the species ids
+#       of that writer's shards refer to
+#
+# A shard's .shard.json is written last, so readers only ever see complete
+# shards, and every writer names its shards and symbol file with its own
+# id, so any number of writers can add to the same directory at once.
+
+DATASET_FILE = 'dataset.json'
+SHARD_SUFFIX = '.shard.json'
+SYMBOL_SUFFIX = '.symbols.json'
+
+NO_WINNER = -1
+
+def _slot(position):
+    return 'abc'.index(position[-1])
+
+def _target(player, target, active_slots):
+
+    # Showdown's target numbering, as in actions: 1, 2 the opposing slots,
+    # -1, -2 the user's side, 0 if there's none
+    position = target.split(': ')[0]
+    if active_slots == 1 or len(position) < 3 or position[-1] not in 'abc':
+        return 0
+
+    slot = _slot(position) + 1
+
+    return -slot if position[:-1] == player else slot
+
+def turn_actions(turn, state, active_slots=2):
+
+    # The action each side's active slots chose in one turn, as a row laid
+    # out like actions.JointActionEnumerator rows with the players one after
+    # the other. Only the first move or switch of each slot counts; switches
+    # after upkeep replace fainted Pokemon and aren't choices of the turn.
+    # Switches are to the team preview index of the species, MISSING if it
+    # wasn't previewed.
+    actions = np.full((len(PLAYERS), active_slots, ACTION_WIDTH), MISSING, dtype=np.int32)
+    actions[:, :, KIND_COL] = PASS
+    actions[:, :, TARGET_COL] = 0
+    chosen = set()
+
+    for command in turn:
+        if isinstance(command, UpkeepMessage):
+            break
+        if not isinstance(command, (MoveMessage, SwitchMessage)):
+            continue
+
+        player = command.player
+        slot = _slot(command.position)
+        if player not in PLAYERS or slot >= active_slots or (player, slot) in chosen:
+            continue
+        # Moves called by other moves or abilities aren't choices
+        if isinstance(command, MoveMessage) and command.frm is not None:
+            continue
+
+        chosen.add((player, slot))
+        action = actions[PLAYERS.index(player), slot]
+
+        if isinstance(command, MoveMessage):
+            action[KIND_COL] = MOVE
+            action[MOVE_COL] = get_move_index(command.move)
+            action[TARGET_COL] = _target(player, command.target, active_slots)
+        else:
+            side = state.sides.get(player)
+            species = parse_details(command.details)[0]
+            team = side.team if side is not None else ()
+            action[KIND_COL] = SWITCH
+            action[SWITCH_COL] = team.index(species) if species in team else MISSING
+
+    return actions.reshape(-1)
+
+def replay_samples(processor, active_slots=2):
+
+    # (states, actions, winner) for every turn of a replay: the state at the
+    # start of each turn, the actions chosen in it, and the index in PLAYERS
+    # of the eventual winner (NO_WINNER for ties and unfinished battles).
+    # The last turn of an unfinished battle has no turn to take actions
+    # from, so it has no sample. Module level, so it can run in
+    # ingest_corpus workers.
+    turns = list(processor.iter_turns())
+    states = list(processor.iter_states())[:len(turns)]
+
+    actions = np.empty((len(states), len(PLAYERS) * active_slots * ACTION_WIDTH), dtype=np.int32)
+    for row, (state, turn) in enumerate(zip(states, turns)):
+        actions[row] = turn_actions(turn, state, active_slots)
+
+    winner = NO_WINNER
+    wins = processor.get_commands_of_type(WinMessage)
+    if wins:
+        for player, info in processor.players.items():
+            if info['username'] == wins[0].user and player in PLAYERS:
+                winner = PLAYERS.index(player)
+
+    return states, actions, winner
+
+class DatasetWriter(object):
+
+    # Streams per-turn samples into shards of shard_size rows in directory.
+    # Rows are copied into preallocated shard buffers as replays are added,
+    # so memory use is one shard whatever the size of the corpus.
+    #
+    # writer_id names this writer's shards; the default is random, so
+    # writers in separate processes never collide. Species ids come from
+    # this process's symbol_table, which is saved to the writer's own symbol
+    # file before each shard is finished, so a shard's ids always resolve.
+
+    def __init__(self, directory, encoder=None, shard_size=65536, writer_id=None):
+        self.directory = directory
+        self.encoder = encoder if encoder is not None else StateEncoder()
+        self.shard_size = shard_size
+        self.writer_id = writer_id if writer_id is not None else uuid.uuid4().hex[:12]
+        self.symbol_file = self.writer_id + SYMBOL_SUFFIX
+
+        self.columns = {
+            'floats': (np.float32, self.encoder.num_floats),
+            'ints': (np.int32, self.encoder.num_ints),
+            'actions': (np.int32, len(PLAYERS) * self.encoder.active_slots * ACTION_WIDTH),
+            'winner': (np.int8, 0),
+            'turn': (np.int32, 0),
+            'replay': (np.int32, 0)
+        }
+
+        os.makedirs(directory, exist_ok=True)
+        self._write_layout()
+
+        self.num_shards = 0
+        self.num_rows = 0
+        self._buffers = None
+        self._row = 0
+        self._replays = []
+
+    def _write_layout(self):
+
+        layout = {
+            'version': 1,
+            'columns': {name: {'dtype': np.dtype(dtype).str, 'width': width}
+                        for name, (dtype, width) in self.columns.items()},
+            'float_names': self.encoder.float_names,
+            'int_names': self.encoder.int_names
+        }
+
+        path = os.path.join(self.directory, DATASET_FILE)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                existing = json.load(f)
+            if existing != layout:
+                raise ValueError(f"{path} was written with a different encoder layout")
+            return
+
+        tmp_path = f'{path}.{self.writer_id}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(layout, f)
+        os.replace(tmp_path, path)
+
+    def _allocate(self):
+
+        self._buffers = {}
+        for name, (dtype, width) in self.columns.items():
+            shape = (self.shard_size, width) if width else (self.shard_size,)
+            self._buffers[name] = np.empty(shape, dtype=dtype)
+        self._row = 0
+        self._replays = []
+
+    def add_replay(self, replay_name, states, actions, winner):
+
+        # Appends one replay's samples, as returned by replay_samples
+        states = list(states)
+        if not states:
+            return 0
+
+        floats, ints = self.encoder.encode(states)
+        turns = np.array([state.turn for state in states], dtype=np.int32)
+
+        written = 0
+        while written < len(states):
+            if self._buffers is None:
+                self._allocate()
+
+            if not self._replays or self._replays[-1] != replay_name:
+                self._replays.append(replay_name)
+
+            num_rows = min(len(states) - written, self.shard_size - self._row)
+            rows = slice(self._row, self._row + num_rows)
+            source = slice(written, written + num_rows)
+
+            self._buffers['floats'][rows] = floats[source]
+            self._buffers['ints'][rows] = ints[source]
+            self._buffers['actions'][rows] = actions[source]
+            self._buffers['winner'][rows] = winner
+            self._buffers['turn'][rows] = turns[source]
+            self._buffers['replay'][rows] = len(self._replays) - 1
+
+            self._row += num_rows
+            written += num_rows
+
+            if self._row == self.shard_size:
+                self.flush()
+
+        return written
+
+    def flush(self):
+
+        # Writes out the current shard, even if it isn't full
+        if self._buffers is None or not self._row:
+            return
+
+        name = f'{self.writer_id}-{self.num_shards:05d}'
+        for column, buffer in self._buffers.items():
+            path = os.path.join(self.directory, f'{name}.{column}.npy')
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, buffer[:self._row])
+            os.replace(path + '.tmp', path)
+
+        # The table only grows, so saving it again keeps earlier shards' ids
+        symbol_table.save(os.path.join(self.directory, self.symbol_file))
+
+        shard_path = os.path.join(self.directory, name + SHARD_SUFFIX)
+        with open(shard_path + '.tmp', 'w') as f:
+            json.dump({'name': name, 'rows': self._row, 'replays': self._replays, 'symbols': self.symbol_file}, f)
+        os.replace(shard_path + '.tmp', shard_path)
+
+        self.num_shards += 1
+        self.num_rows += self._row
+        self._buffers = None
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class DatasetReader(object):
+
+    # Random access to the rows of every finished shard in a dataset
+    # directory. Columns are memory-mapped on first use, so opening a
+    # dataset reads only the small JSON files and rows are paged in from
+    # disk as they're read.
+
+    def __init__(self, directory):
+        self.directory = directory
+
+        with open(os.path.join(directory, DATASET_FILE), 'r') as f:
+            layout = json.load(f)
+        self.layout = layout['columns']
+        self.column_names = list(self.layout)
+        self.float_names = layout['float_names']
+        self.int_names = layout['int_names']
+
+        self.shards = []
+        for shard_path in sorted(glob.glob(os.path.join(directory, '*' + SHARD_SUFFIX))):
+            with open(shard_path, 'r') as f:
+                self.shards.append(json.load(f))
+
+        # Row each shard starts at, with the total row count at the end
+        self.offsets = np.zeros(len(self.shards) + 1, dtype=np.int64)
+        np.cumsum([shard['rows'] for shard in self.shards], out=self.offsets[1:])
+
+        self._mapped = {}
+        self._symbols = {}
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def _column(self, shard_idx, column):
+
+        key = shard_idx, column
+        array = self._mapped.get(key)
+        if array is None:
+            path = os.path.join(self.directory, f"{self.shards[shard_idx]['name']}.{column}.npy")
+            array = np.load(path, mmap_mode='r')
+            self._mapped[key] = array
+
+        return array
+
+    def _empty(self, column, num_rows):
+
+        dtype, width = self.layout[column]['dtype'], self.layout[column]['width']
+
+        return np.empty((num_rows, width) if width else (num_rows,), dtype=dtype)
+
+    def get_slice(self, start, stop, columns=None):
+
+        # {column: rows start to stop}. Within one shard these are read-only
+        # views of the mapped files; slices spanning shards are copied.
+        columns = columns if columns is not None else self.column_names
+        start, stop, _ = slice(start, stop).indices(len(self))
+        stop = max(start, stop)
+
+        first = int(np.searchsorted(self.offsets, start, side='right')) - 1
+        last = int(np.searchsorted(self.offsets, stop, side='left'))
+
+        parts = {column: [] for column in columns}
+        for shard_idx in range(first, min(last, len(self.shards))):
+            shard_start = self.offsets[shard_idx]
+            lo = max(start, shard_start) - shard_start
+            hi = min(stop, self.offsets[shard_idx + 1]) - shard_start
+            for column in columns:
+                parts[column].append(self._column(shard_idx, column)[lo:hi])
+
+        result = {}
+        for column, arrays in parts.items():
+            if not arrays:
+                result[column] = self._empty(column, 0)
+            else:
+                result[column] = arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+
+        return result
+
+    def get_rows(self, rows, columns=None):
+
+        # {column: the given rows, in order}, gathered shard by shard
+        columns = columns if columns is not None else self.column_names
+        rows = np.asarray(rows, dtype=np.int64)
+        if rows.size and (rows.min() < 0 or rows.max() >= len(self)):
+            raise IndexError("Row out of range")
+
+        shard_ids = np.searchsorted(self.offsets, rows, side='right') - 1
+        result = {column: self._empty(column, len(rows)) for column in columns}
+
+        for shard_idx in np.unique(shard_ids):
+            selected = np.nonzero(shard_ids == shard_idx)[0]
+            local_rows = rows[selected] - self.offsets[shard_idx]
+            for column in columns:
+                result[column][selected] = self._column(shard_idx, column)[local_rows]
+
+        return result
+
+    def get_replay(self, row):
+
+        # Name of the replay a row came from
+        shard_idx = int(np.searchsorted(self.offsets, row, side='right')) - 1
+        replay_idx = self._column(shard_idx, 'replay')[row - self.offsets[shard_idx]]
+
+        return self.shards[shard_idx]['replays'][replay_idx]
+
+    def get_symbols(self, row):
+
+        # The SymbolTable the ids in a row refer to. Shards from different
+        # writers have their own tables, so ids only compare within one.
+        shard_idx = int(np.searchsorted(self.offsets, row, side='right')) - 1
+        symbol_file = self.shards[shard_idx]['symbols']
+
+        table = self._symbols.get(symbol_file)
+        if table is None:
+            table = SymbolTable.load(os.path.join(self.directory, symbol_file))
+            self._symbols[symbol_file] = table
+
+        return table
+
+    def iter_batches(self, batch_size, columns=None, shuffle=False, seed=None):
+
+        if not shuffle:
+            for start in range(0, len(self), batch_size):
+                yield self.get_slice(start, start + batch_size, columns)
+            return
+
+        order = np.random.default_rng(seed).permutation(len(self))
+        for start in range(0, len(order), batch_size):
+            # Sorted within a batch so each shard is read front to back
+            yield self.get_rows(np.sort(order[start:start + batch_size]), columns)
+
+def export_dataset(source, directory, workers=None, chunksize=8, shard_size=65536, active_slots=2, stats=None):
+
+    # Parses and replays a corpus in parallel workers and streams the samples
+    # into a dataset. Encoding happens here, in one process, so species ids
+    # all come from this process's symbol table, saved by the writer next to
+    # its shards.
+    process = partial(replay_samples, active_slots=active_slots)
+
+    with DatasetWriter(directory, StateEncoder(active_slots), shard_size) as writer:
+        for result in ingest_corpus(source, workers, chunksize, ordered=False, process=process, stats=stats):
+            if not result.ok:
+                continue
+            writer.add_replay(result.path, *result.output)
+
+    return writer
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Export per-turn training samples from replays into shards")
+    parser.add_argument('source', help="directory of .html replays or a glob pattern")
+    parser.add_argument('directory', help="dataset directory to add shards to")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: cpu count)")
+    parser.add_argument('--shard-size', type=int, default=65536, help="rows per shard")
+    parser.add_argument('--active-slots', type=int, default=2, help="active Pokemon per side to encode")
+    args = parser.parse_args()
+
+    stats = IngestStats()
+    start_time = time.perf_counter()
+    writer = export_dataset(args.source, args.directory, args.workers, shard_size=args.shard_size,
+                            active_slots=args.active_slots, stats=stats)
+
+    print(stats.summary())
+    print(f"Wrote {writer.num_rows} rows in {writer.num_shards} shards in {time.perf_counter() - start_time:.2f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import hashlib
+import math
+import sqlite3
+from .process_replay import iter_battle_lines
+
+# Lines that differ between copies of the same battle: who joined, left or
+# was renamed while the replay was saved, chat, and raw HTML
+IGNORED_COMMANDS = frozenset(('j', 'J', 'join', 'l', 'L', 'leave', 'n', 'N', 'name', 'c', 'c:', 'chat', 'raw',
+                              'html', 'uhtml', 'uhtmlchange', 'b', 'B', 'battle', ''))
+
+def normalize_battle_log(battle_text):
+
+    # The protocol lines that identify a battle, stripped of whitespace
+    for line in iter_battle_lines(battle_text):
+        line = line.strip()
+        if not line or line == '|':
+            continue
+        if line.startswith('|'):
+            end = line.find('|', 1)
+            command = line[1:end] if end != -1 else line[1:]
+            if command in IGNORED_COMMANDS:
+                continue
+        yield line
+
+def fingerprint_battle_log(battle_text):
+
+    digest = hashlib.blake2b(digest_size=16)
+    for line in normalize_battle_log(battle_text):
+        digest.update(line.encode('utf-8'))
+        digest.update(b'\n')
+
+    return digest.digest()
+
+class BloomFilter(object):
+
+    # Bit array sized for capacity items at error_rate false positives. Items
+    # are fingerprints, which are already uniformly random, so the bit
+    # positions come straight from their bytes by double hashing.
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, fingerprint):
+
+        h1 = int.from_bytes(fingerprint[:8], 'little')
+        h2 = int.from_bytes(fingerprint[8:16], 'little') | 1
+
+        return [(h1 + idx * h2) % self.num_bits for idx in range(self.num_hashes)]
+
+    def add(self, fingerprint):
+
+        bits = self.bits
+        for position in self._positions(fingerprint):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, fingerprint):
+
+        bits = self.bits
+        for position in self._positions(fingerprint):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+
+        return True
+
+class SeenSet(object):
+
+    # Persistent set of battle fingerprints, each with the first replay seen
+    # with it, stored in SQLite (or only in memory if seen_file is None).
+    #
+    # Lookups go through an in-memory Bloom filter first: most replays are
+    # new, and for those the filter answers without touching the database.
+    # The filter is rebuilt twice the size whenever it fills up.
+
+    def __init__(self, seen_file=None, capacity=100000, error_rate=0.001, commit_every=1000):
+        self.seen_file = seen_file
+        self.connection = sqlite3.connect(seen_file if seen_file is not None else ':memory:')
+        if seen_file is not None:
+            # Ingest workers read the file while the run adds to it
+            self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS seen (fingerprint BLOB PRIMARY KEY, path TEXT) '
+                                'WITHOUT ROWID')
+        self.error_rate = error_rate
+        self.commit_every = commit_every
+        self._pending = 0
+
+        self.bloom_negatives = 0
+        self.false_positives = 0
+
+        self._rebuild_filter(capacity)
+
+    def _rebuild_filter(self, capacity):
+
+        num_seen = len(self)
+        self.bloom = BloomFilter(max(capacity, 2 * num_seen), self.error_rate)
+        for fingerprint, in self.connection.execute('SELECT fingerprint FROM seen'):
+            self.bloom.add(fingerprint)
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+
+    def get(self, fingerprint):
+
+        # Path first seen with fingerprint, or None if it's new
+        if fingerprint not in self.bloom:
+            self.bloom_negatives += 1
+            return None
+
+        row = self.connection.execute('SELECT path FROM seen WHERE fingerprint = ?', (fingerprint,)).fetchone()
+        if row is None:
+            self.false_positives += 1
+            return None
+
+        return row[0]
+
+    def __contains__(self, fingerprint):
+        return self.get(fingerprint) is not None
+
+    def add(self, fingerprint, path=None):
+
+        self.connection.execute('INSERT OR IGNORE INTO seen (fingerprint, path) VALUES (?, ?)', (fingerprint, path))
+        self.bloom.add(fingerprint)
+
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.flush()
+
+        if self.bloom.count > self.bloom.capacity:
+            self.flush()
+            self._rebuild_filter(2 * self.bloom.capacity)
+
+    def flush(self):
+        self.connection.commit()
+        self._pending = 0
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_stats(self):
+        return {
+            'seen': len(self),
+            'bloom_negatives': self.bloom_negatives,
+            'false_positives': self.false_positives
+        }
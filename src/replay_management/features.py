@@ -0,0 +1,285 @@
+import numpy as np
+from .move_data import get_move_index
+from .symbols import symbol_table
+
+WEATHERS = ('SunnyDay', 'RainDance', 'Sandstorm', 'Hail', 'DesolateLand', 'PrimordialSea', 'DeltaStream')
+FIELD_CONDITIONS = ('Electric Terrain', 'Grassy Terrain', 'Misty Terrain', 'Psychic Terrain', 'Trick Room',
+                    'Gravity', 'Magic Room', 'Wonder Room')
+SIDE_CONDITIONS = ('Reflect', 'Light Screen', 'Aurora Veil', 'Tailwind', 'Safeguard', 'Mist', 'Spikes',
+                   'Toxic Spikes', 'Stealth Rock', 'Sticky Web')
+STATUSES = ('brn', 'par', 'slp', 'frz', 'psn', 'tox')
+BOOST_STATS = ('atk', 'def', 'spa', 'spd', 'spe', 'accuracy', 'evasion')
+PLAYERS = ('p1', 'p2')
+
+MAX_MOVES = 4
+TEAM_SIZE = 6
+MISSING = -1
+
+def _one_hot_index(values):
+    return {value: idx for idx, value in enumerate(values)}
+
+class StateEncoder(object):
+
+    # Encodes BattleState snapshots as fixed-width rows of two arrays: float32
+    # numeric features and int32 index features (species ids from the symbol
+    # table and move indices from moves.json, MISSING where absent).
+    #
+    # Columns are laid out once here; encode then writes straight into
+    # preallocated arrays, one row per state.
+
+    def __init__(self, active_slots=2, team_size=TEAM_SIZE, max_team_layouts=4096):
+        self.active_slots = active_slots
+        self.team_size = team_size
+        self.max_team_layouts = max_team_layouts
+
+        self.float_names = []
+        self.int_names = []
+
+        self.turn_col = self._add_floats('turn')
+        self.weather_col = self._add_floats(*[f'weather:{weather}' for weather in WEATHERS])
+        self.field_col = self._add_floats(*[f'field:{condition}' for condition in FIELD_CONDITIONS])
+
+        self.side_cols = {}
+        self.active_cols = {}
+        self.active_int_cols = {}
+        self.team_cols = {}
+        self.team_int_cols = {}
+
+        for player in PLAYERS:
+            self.side_cols[player] = self._add_floats(*[f'{player}:side:{condition}' for condition in SIDE_CONDITIONS])
+
+            for slot in range(active_slots):
+                prefix = f'{player}:active{slot}'
+                self.active_cols[player, slot] = self._add_floats(
+                    f'{prefix}:present', f'{prefix}:hp',
+                    *[f'{prefix}:status:{status}' for status in STATUSES],
+                    *[f'{prefix}:boost:{stat}' for stat in BOOST_STATS],
+                    f'{prefix}:dynamax'
+                )
+                self.active_int_cols[player, slot] = self._add_ints(
+                    f'{prefix}:species', *[f'{prefix}:move{idx}' for idx in range(MAX_MOVES)]
+                )
+
+            for idx in range(team_size):
+                prefix = f'{player}:team{idx}'
+                self.team_cols[player, idx] = self._add_floats(
+                    f'{prefix}:present', f'{prefix}:hp', f'{prefix}:fainted', f'{prefix}:active'
+                )
+                self.team_int_cols[player, idx] = self._add_ints(f'{prefix}:species')
+
+        self.num_floats = len(self.float_names)
+        self.num_ints = len(self.int_names)
+
+        self._weather_index = _one_hot_index(WEATHERS)
+        self._field_index = _one_hot_index(FIELD_CONDITIONS)
+        self._side_index = _one_hot_index(SIDE_CONDITIONS)
+        self._status_index = _one_hot_index(STATUSES)
+        self._boost_index = _one_hot_index(BOOST_STATS)
+
+        # Names repeat endlessly, so resolve each one only once. Team layouts
+        # are per team rather than per name, so that cache is kept to the
+        # max_team_layouts most recently used.
+        self._move_cache = {}
+        self._species_cache = {}
+        self._team_layouts = {}
+
+    def _add_floats(self, *names):
+        start = len(self.float_names)
+        self.float_names.extend(names)
+        return start
+
+    def _add_ints(self, *names):
+        start = len(self.int_names)
+        self.int_names.extend(names)
+        return start
+
+    def allocate(self, num_rows):
+
+        floats = np.zeros((num_rows, self.num_floats), dtype=np.float32)
+        ints = np.full((num_rows, self.num_ints), MISSING, dtype=np.int32)
+
+        return floats, ints
+
+    def _move_index(self, move):
+
+        move_idx = self._move_cache.get(move)
+        if move_idx is None:
+            move_idx = get_move_index(move)
+            self._move_cache[move] = move_idx
+
+        return move_idx
+
+    def _species_id(self, species):
+
+        species_id = self._species_cache.get(species)
+        if species_id is None:
+            species_id = symbol_table.intern('species', species)
+            self._species_cache[species] = species_id
+
+        return species_id
+
+    def encode(self, states, floats=None, ints=None, start=0):
+
+        # Writes one row per state into floats/ints from row start, allocating
+        # the arrays if they aren't given. Rows must be zero/MISSING filled, as
+        # allocate leaves them; only the features present are written. Given
+        # arrays must be C-contiguous, since they're written through flat
+        # indices (a flattened copy would silently take the writes instead).
+        #
+        # Features are gathered as flat (index, value) pairs for the whole
+        # batch and scattered into the arrays with one call each, which is far
+        # cheaper than assigning numpy elements one at a time.
+        states = list(states)
+        if floats is None:
+            floats, ints = self.allocate(start + len(states))
+        elif not (floats.flags.c_contiguous and ints.flags.c_contiguous):
+            raise ValueError("encode needs C-contiguous arrays, e.g. from allocate or np.ascontiguousarray")
+        elif floats.shape[1:] != (self.num_floats,) or ints.shape[1:] != (self.num_ints,):
+            raise ValueError(f"encode needs arrays of {self.num_floats} float and {self.num_ints} int columns")
+
+        float_idx = []
+        float_values = []
+        int_idx = []
+        int_values = []
+
+        for row_idx, state in enumerate(states, start):
+            self._encode_state(state, row_idx * self.num_floats, row_idx * self.num_ints,
+                               float_idx, float_values, int_idx, int_values)
+
+        floats.reshape(-1)[float_idx] = float_values
+        ints.reshape(-1)[int_idx] = int_values
+
+        return floats, ints
+
+    def _encode_state(self, state, row, int_row, float_idx, float_values, int_idx, int_values):
+
+        float_idx.append(row + self.turn_col)
+        float_values.append(state.turn)
+
+        if state.weather in self._weather_index:
+            float_idx.append(row + self.weather_col + self._weather_index[state.weather])
+            float_values.append(1.0)
+
+        for condition in state.field_conditions:
+            if condition in self._field_index:
+                float_idx.append(row + self.field_col + self._field_index[condition])
+                float_values.append(1.0)
+
+        seen_by_player = {player: {} for player in PLAYERS}
+        for (player, _), pokemon in state.pokemon.items():
+            if player in seen_by_player:
+                seen_by_player[player][pokemon.species] = pokemon
+
+        for player in PLAYERS:
+            side = state.sides.get(player)
+            if side is None:
+                continue
+
+            side_col = row + self.side_cols[player]
+            for condition, layers in side.conditions.items():
+                if condition in self._side_index:
+                    float_idx.append(side_col + self._side_index[condition])
+                    float_values.append(layers)
+
+            for slot, position in enumerate(sorted(side.active)[:self.active_slots]):
+                self._encode_active(state.pokemon[side.active[position]],
+                                    row + self.active_cols[player, slot], int_row + self.active_int_cols[player, slot],
+                                    float_idx, float_values, int_idx, int_values)
+
+            self._encode_team(seen_by_player[player], player, side, row, int_row,
+                              float_idx, float_values, int_idx, int_values)
+
+    def _encode_active(self, pokemon, col, int_col, float_idx, float_values, int_idx, int_values):
+
+        hp_fraction = pokemon.hp_fraction
+        float_idx.append(col)
+        float_values.append(1.0)
+        float_idx.append(col + 1)
+        float_values.append(0.0 if hp_fraction is None else hp_fraction)
+
+        if pokemon.status in self._status_index:
+            float_idx.append(col + 2 + self._status_index[pokemon.status])
+            float_values.append(1.0)
+
+        boost_col = col + 2 + len(STATUSES)
+        for stat, boost in pokemon.boosts.items():
+            if stat in self._boost_index:
+                float_idx.append(boost_col + self._boost_index[stat])
+                float_values.append(boost / 6.0)
+
+        if 'Dynamax' in pokemon.volatiles:
+            float_idx.append(boost_col + len(BOOST_STATS))
+            float_values.append(1.0)
+
+        int_idx.append(int_col)
+        int_values.append(self._species_id(pokemon.species))
+        for idx, move in enumerate(pokemon.moves[:MAX_MOVES]):
+            int_idx.append(int_col + 1 + idx)
+            int_values.append(self._move_index(move))
+
+    def _team_layout(self, player, species_order):
+
+        # (float column, int column, species id, species) for each team
+        # member, cached since a side's team rarely changes between turns.
+        # The cache dict is kept in least to most recently used order.
+        key = (player, species_order)
+        layouts = self._team_layouts
+        layout = layouts.pop(key, None)
+        if layout is None:
+            layout = [
+                (self.team_cols[player, idx], self.team_int_cols[player, idx], self._species_id(species), species)
+                for idx, species in enumerate(species_order[:self.team_size])
+            ]
+            if len(layouts) >= self.max_team_layouts:
+                del layouts[next(iter(layouts))]
+        layouts[key] = layout
+
+        return layout
+
+    def _encode_team(self, seen, player, side, row, int_row, float_idx, float_values, int_idx, int_values):
+
+        # Team order is the team preview order, then any Pokemon that weren't
+        # previewed in the order they appeared
+        species_order = side.team
+        if len(seen) > len(species_order) or any(species not in species_order for species in seen):
+            species_order = species_order + tuple(species for species in seen if species not in side.team)
+
+        for col, int_col, species_id, species in self._team_layout(player, species_order):
+            col += row
+            int_idx.append(int_row + int_col)
+            int_values.append(species_id)
+
+            pokemon = seen.get(species)
+            if pokemon is None:
+                float_idx.extend((col, col + 1))
+                float_values.extend((1.0, 1.0))
+                continue
+
+            hp = pokemon.hp
+            max_hp = pokemon.max_hp
+            float_idx.extend((col, col + 1, col + 2, col + 3))
+            float_values.extend((
+                1.0,
+                hp / max_hp if hp is not None and max_hp else 1.0,
+                1.0 if pokemon.fainted else 0.0,
+                1.0 if pokemon.position is not None else 0.0
+            ))
+
+    def encode_replays(self, processors):
+
+        # One row per turn of every replay, in order, plus the replay each
+        # row came from. Sizes are counted first so the arrays are only
+        # allocated once.
+        replay_states = [list(processor.iter_states()) for processor in processors]
+        num_rows = sum(len(states) for states in replay_states)
+
+        floats, ints = self.allocate(num_rows)
+        replay_ids = np.empty(num_rows, dtype=np.int32)
+
+        row = 0
+        for replay_idx, states in enumerate(replay_states):
+            self.encode(states, floats, ints, row)
+            replay_ids[row:row + len(states)] = replay_idx
+            row += len(states)
+
+        return floats, ints, replay_ids
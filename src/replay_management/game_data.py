@@ -0,0 +1,257 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import numpy as np
+from .move_data import MOVES_FILE, UNKNOWN_MOVE, move_table, to_move_id
+
+GAME_DATA_FILE = os.path.join(os.path.dirname(__file__), '..', '..', 'lookups', 'game_data.bin')
+
+MISSING = -1
+
+TYPES = ('Normal', 'Fire', 'Water', 'Electric', 'Grass', 'Ice', 'Fighting', 'Poison', 'Ground', 'Flying',
+         'Psychic', 'Bug', 'Rock', 'Ghost', 'Dragon', 'Dark', 'Steel', 'Fairy')
+type_ids = {name: idx for idx, name in enumerate(TYPES)}
+
+CATEGORIES = ('Physical', 'Special', 'Status')
+category_ids = {name: idx for idx, name in enumerate(CATEGORIES)}
+
+STATS = ('hp', 'atk', 'def', 'spa', 'spd', 'spe')
+
+# Attacking type -> defending types it isn't neutral against (Gen 6 onwards)
+TYPE_CHART = {
+    'Normal': {'Rock': 0.5, 'Ghost': 0, 'Steel': 0.5},
+    'Fire': {'Fire': 0.5, 'Water': 0.5, 'Grass': 2, 'Ice': 2, 'Bug': 2, 'Rock': 0.5, 'Dragon': 0.5, 'Steel': 2},
+    'Water': {'Fire': 2, 'Water': 0.5, 'Grass': 0.5, 'Ground': 2, 'Rock': 2, 'Dragon': 0.5},
+    'Electric': {'Water': 2, 'Electric': 0.5, 'Grass': 0.5, 'Ground': 0, 'Flying': 2, 'Dragon': 0.5},
+    'Grass': {'Fire': 0.5, 'Water': 2, 'Grass': 0.5, 'Poison': 0.5, 'Ground': 2, 'Flying': 0.5, 'Bug': 0.5,
+              'Rock': 2, 'Dragon': 0.5, 'Steel': 0.5},
+    'Ice': {'Fire': 0.5, 'Water': 0.5, 'Grass': 2, 'Ice': 0.5, 'Ground': 2, 'Flying': 2, 'Dragon': 2, 'Steel': 0.5},
+    'Fighting': {'Normal': 2, 'Ice': 2, 'Poison': 0.5, 'Flying': 0.5, 'Psychic': 0.5, 'Bug': 0.5, 'Rock': 2,
+                 'Ghost': 0, 'Dark': 2, 'Steel': 2, 'Fairy': 0.5},
+    'Poison': {'Grass': 2, 'Poison': 0.5, 'Ground': 0.5, 'Rock': 0.5, 'Ghost': 0.5, 'Steel': 0, 'Fairy': 2},
+    'Ground': {'Fire': 2, 'Electric': 2, 'Grass': 0.5, 'Poison': 2, 'Flying': 0, 'Bug': 0.5, 'Rock': 2, 'Steel': 2},
+    'Flying': {'Electric': 0.5, 'Grass': 2, 'Fighting': 2, 'Bug': 2, 'Rock': 0.5, 'Steel': 0.5},
+    'Psychic': {'Fighting': 2, 'Poison': 2, 'Psychic': 0.5, 'Dark': 0, 'Steel': 0.5},
+    'Bug': {'Fire': 0.5, 'Grass': 2, 'Fighting': 0.5, 'Poison': 0.5, 'Flying': 0.5, 'Psychic': 2, 'Ghost': 0.5,
+            'Dark': 2, 'Steel': 0.5, 'Fairy': 0.5},
+    'Rock': {'Fire': 2, 'Ice': 2, 'Fighting': 0.5, 'Ground': 0.5, 'Flying': 2, 'Bug': 2, 'Steel': 0.5},
+    'Ghost': {'Normal': 0, 'Psychic': 2, 'Ghost': 2, 'Dark': 0.5},
+    'Dragon': {'Dragon': 2, 'Steel': 0.5, 'Fairy': 0},
+    'Dark': {'Fighting': 0.5, 'Psychic': 2, 'Ghost': 2, 'Dark': 0.5, 'Fairy': 0.5},
+    'Steel': {'Fire': 0.5, 'Water': 0.5, 'Electric': 0.5, 'Ice': 2, 'Rock': 2, 'Steel': 0.5, 'Fairy': 2},
+    'Fairy': {'Fire': 0.5, 'Fighting': 2, 'Poison': 0.5, 'Dragon': 2, 'Dark': 2, 'Steel': 0.5}
+}
+
+def type_chart_matrix():
+
+    # chart[attacking type id, defending type id] -> damage multiplier
+    chart = np.ones((len(TYPES), len(TYPES)), dtype=np.float32)
+    for attacking, matchups in TYPE_CHART.items():
+        for defending, multiplier in matchups.items():
+            chart[type_ids[attacking], type_ids[defending]] = multiplier
+
+    return chart
+
+# Binary layout written by build_game_data: the header, a table of contents
+# entry per table, then each table's data starting on an 8 byte boundary
+FORMAT_MAGIC = b'PSGD'
+FORMAT_VERSION = 1
+FORMAT_HEADER = struct.Struct('<4sII')
+TABLE_ENTRY = struct.Struct('<24s4sIIQ')
+
+def _write_tables(tables, out_file):
+
+    # tables: name -> 1 or 2 dimensional numpy array
+    entries = []
+    offset = FORMAT_HEADER.size + TABLE_ENTRY.size * len(tables)
+    chunks = []
+
+    for name, table in tables.items():
+        padding = -offset % 8
+        chunks.append(b'\0' * padding)
+        offset += padding
+
+        table = np.ascontiguousarray(table)
+        rows = table.shape[0]
+        cols = table.shape[1] if table.ndim > 1 else 0
+        entries.append(TABLE_ENTRY.pack(name.encode('ascii'), table.dtype.str.encode('ascii'), rows, cols, offset))
+
+        data = table.tobytes()
+        chunks.append(data)
+        offset += len(data)
+
+    header = FORMAT_HEADER.pack(FORMAT_MAGIC, FORMAT_VERSION, len(tables))
+
+    tmp_file = out_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(b''.join([header] + entries + chunks))
+    os.replace(tmp_file, out_file)
+
+def _with_sentinel(values, dtype):
+
+    # Every per-move and per-species table gets one extra row of MISSING at
+    # the end, so gathering with MISSING (-1) ids needs no masking
+    return np.array(values + [MISSING], dtype=dtype)
+
+def build_game_data(moves_source=None, species_source=None, out_file=GAME_DATA_FILE, moves_file=MOVES_FILE):
+
+    # Compiles the tables from Showdown data exports (the moves and pokedex
+    # tables as JSON objects keyed by id). Either source may be left out, in
+    # which case its tables are all MISSING. Returns the number of moves and
+    # species filled in.
+    with open(moves_file, 'r') as f:
+        num_moves = len(json.load(f))
+
+    move_columns = {column: [MISSING] * num_moves for column in ('power', 'accuracy', 'type', 'category', 'priority', 'pp')}
+    num_filled_moves = 0
+
+    if moves_source is not None:
+        with open(moves_source, 'r', encoding='utf-8') as f:
+            moves = json.load(f)
+
+        for move_id, move in moves.items():
+            # Moves missing from moves.json aren't replay misses, so they're
+            # left out of move_table.unknown
+            idx = move_table.find_index(move.get('name', move_id))
+            if idx == UNKNOWN_MOVE:
+                continue
+
+            accuracy = move.get('accuracy', MISSING)
+            move_columns['power'][idx] = move.get('basePower', MISSING)
+            # Moves that can't miss have accuracy true; stored as 0
+            move_columns['accuracy'][idx] = 0 if accuracy is True else accuracy
+            move_columns['type'][idx] = type_ids.get(move.get('type'), MISSING)
+            move_columns['category'][idx] = category_ids.get(move.get('category'), MISSING)
+            move_columns['priority'][idx] = move.get('priority', 0)
+            move_columns['pp'][idx] = move.get('pp', MISSING)
+            num_filled_moves += 1
+
+    species_names = []
+    species_types = []
+    species_stats = []
+
+    if species_source is not None:
+        with open(species_source, 'r', encoding='utf-8') as f:
+            pokedex = json.load(f)
+
+        for species_id, species in pokedex.items():
+            types = [type_ids.get(name, MISSING) for name in species.get('types', ())][:2]
+            stats = species.get('baseStats', {})
+            species_names.append(species.get('name', species_id))
+            species_types.append(types + [MISSING] * (2 - len(types)))
+            species_stats.append([stats.get(stat, MISSING) for stat in STATS])
+
+    tables = {
+        'move_power': _with_sentinel(move_columns['power'], np.int16),
+        'move_accuracy': _with_sentinel(move_columns['accuracy'], np.int16),
+        'move_type': _with_sentinel(move_columns['type'], np.int8),
+        'move_category': _with_sentinel(move_columns['category'], np.int8),
+        'move_priority': _with_sentinel(move_columns['priority'], np.int8),
+        'move_pp': _with_sentinel(move_columns['pp'], np.int16),
+        'species_types': np.array(species_types + [[MISSING, MISSING]], dtype=np.int8),
+        'species_stats': np.array(species_stats + [[MISSING] * len(STATS)], dtype=np.int16),
+        'species_names': np.frombuffer('\n'.join(species_names).encode('utf-8'), dtype=np.uint8),
+        'type_chart': type_chart_matrix()
+    }
+
+    _write_tables(tables, out_file)
+
+    return num_filled_moves, len(species_names)
+
+class GameData(object):
+
+    # Static move, species and type tables as read-only numpy views straight
+    # into the mapped file, so loading costs only the table of contents and
+    # the species names. Move tables are indexed by moves.json index and
+    # species tables by species_index; both accept MISSING ids, which gather
+    # MISSING values.
+
+    def __init__(self, buffer):
+
+        self.buffer = buffer
+        magic, version, num_tables = FORMAT_HEADER.unpack_from(buffer)
+        if magic != FORMAT_MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Not a game data file written by this version of build_game_data")
+
+        self.tables = {}
+        for idx in range(num_tables):
+            name, dtype, rows, cols, offset = TABLE_ENTRY.unpack_from(buffer, FORMAT_HEADER.size + idx * TABLE_ENTRY.size)
+            dtype = np.dtype(dtype.rstrip(b'\0').decode('ascii'))
+            table = np.frombuffer(buffer, dtype=dtype, count=rows * max(cols, 1), offset=offset)
+            self.tables[name.rstrip(b'\0').decode('ascii')] = table.reshape(rows, cols) if cols else table
+
+        names = self.tables['species_names'].tobytes().decode('utf-8')
+        self.species_names = names.split('\n') if names else []
+        self.species_ids = {to_move_id(name): idx for idx, name in enumerate(self.species_names)}
+
+        self.type_chart = self.tables['type_chart']
+
+        # With a neutral row and column at the end for MISSING (-1) ids
+        self._padded_chart = np.ones((len(TYPES) + 1, len(TYPES) + 1), dtype=np.float32)
+        self._padded_chart[:-1, :-1] = self.type_chart
+
+    @classmethod
+    def load(cls, game_data_file=GAME_DATA_FILE):
+
+        with open(game_data_file, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return cls(buffer)
+
+    def __getattr__(self, name):
+
+        # move_power, species_stats, ... are the tables of the same name
+        tables = self.__dict__.get('tables')
+        if tables is not None and name in tables:
+            return tables[name]
+        raise AttributeError(name)
+
+    def species_index(self, name):
+        return self.species_ids.get(to_move_id(name), MISSING)
+
+    def species_indices(self, names):
+        return np.array([self.species_index(name) for name in names], dtype=np.int32)
+
+    def move_attributes(self, move_ids, *attributes):
+
+        # Gathers the named move tables for an array of move ids, e.g.
+        # power, move_type = game_data.move_attributes(ids, 'power', 'type')
+        move_ids = np.asarray(move_ids)
+        return tuple(self.tables['move_' + attribute][move_ids] for attribute in attributes)
+
+    def effectiveness(self, attack_types, defender_types):
+
+        # Damage multipliers of each attack type against each defender, whose
+        # types are (..., 2) arrays with MISSING for a missing second type.
+        # Typeless attacks and MISSING defenders are neutral.
+        attack_types = np.asarray(attack_types)
+        defender_types = np.asarray(defender_types)
+
+        return self._padded_chart[attack_types[..., None], defender_types].prod(axis=-1)
+
+_game_data = None
+
+def get_game_data():
+
+    # Shared tables, mapped on first use. Run the build command first.
+    global _game_data
+    if _game_data is None:
+        _game_data = GameData.load()
+
+    return _game_data
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Compile static game data into memory-mappable tables")
+    parser.add_argument('--moves', default=None, help="Showdown moves data as JSON, keyed by move id")
+    parser.add_argument('--species', default=None, help="Showdown pokedex data as JSON, keyed by species id")
+    parser.add_argument('--out', default=GAME_DATA_FILE, help="file to write")
+    args = parser.parse_args()
+
+    num_moves, num_species = build_game_data(args.moves, args.species, args.out)
+    print(f"Wrote {args.out}: {num_moves} moves, {num_species} species, {len(TYPES)} types")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,364 @@
+import argparse
+import asyncio
+import glob
+import logging
+import struct
+import time
+from collections import deque
+from .process_replay import ReplayProcessor, iter_battle_lines, parse_replay_file
+from .showdown_protocol import ParseCounters, TieMessage, TurnMessage, WinMessage, iter_replay_commands
+
+# Frames from the stand-in server are a 4 byte big-endian length followed by
+# one UTF-8 protocol chunk, the same unit a websocket message carries
+FRAME_HEADER = struct.Struct('>I')
+
+logger = logging.getLogger(__name__)
+
+def split_chunk(chunk):
+
+    # ">battle-gen8vgc2021-1\n|line\n|line" -> ('battle-gen8vgc2021-1', lines).
+    # Chunks without a room line belong to the global room ('').
+    lines = chunk.split('\n')
+
+    if lines and lines[0].startswith('>'):
+        return lines[0][1:], lines[1:]
+
+    return '', lines
+
+class LatencyStats(object):
+
+    # Keeps the most recent max_samples latencies for percentiles, so memory
+    # stays bounded on long runs
+
+    def __init__(self, max_samples=100000):
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+
+    def add(self, latency):
+        self.samples.append(latency)
+        self.count += 1
+
+    def percentiles(self, quantiles=(50, 90, 99)):
+
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {f'p{q}': None for q in quantiles}
+
+        return {f'p{q}': ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))] for q in quantiles}
+
+class LiveBattle(object):
+
+    # One battle being followed: its bounded line buffer and the processor
+    # its commands are fed into as they arrive
+
+    def __init__(self, room_id, buffer_size):
+        self.room_id = room_id
+        self.queue = asyncio.Queue(buffer_size)
+        self.processor = ReplayProcessor([])
+        self.counters = ParseCounters()
+        self.num_lines = 0
+        self.num_errors = 0
+        self.winner = None
+        self.finished = False
+        # Set once the room is deinited or its consumer stops; nothing more
+        # is queued for it after that
+        self.closed = False
+
+    def process_line(self, line):
+
+        # Returns the turn number if this line started a new turn
+        self.num_lines += 1
+        commands = list(iter_replay_commands((line,), self.counters))
+        if not commands:
+            return None
+
+        self.processor.add_commands(commands)
+
+        new_turn = None
+        for command in commands:
+            if isinstance(command, TurnMessage):
+                new_turn = self.processor.count_commands_of_type(TurnMessage)
+            elif isinstance(command, WinMessage):
+                self.winner = command.user
+                self.finished = True
+            elif isinstance(command, TieMessage):
+                self.finished = True
+
+        return new_turn
+
+class BattleMultiplexer(object):
+
+    # Splits a feed of protocol chunks into per-battle line streams, each
+    # processed by its own task.
+    #
+    # Every battle buffers at most buffer_size lines. When a battle falls
+    # behind, feed_chunk waits for room in its buffer, which in turn stops
+    # the feed from being read, so a slow consumer pushes back on the source
+    # instead of growing memory.
+    #
+    # on_turn(battle, state) is called with the state snapshot at the start of
+    # every turn and on_finish(battle) once a battle's room is closed.
+    #
+    # A line that fails to parse, or whose on_turn call raises, is counted in
+    # num_errors and logged, and the battle carries on with the next line.
+
+    def __init__(self, buffer_size=256, on_turn=None, on_finish=None):
+        self.buffer_size = buffer_size
+        self.on_turn = on_turn
+        self.on_finish = on_finish
+
+        self.battles = {}
+        self._tasks = {}
+        self.latency = LatencyStats()
+        self.num_events = 0
+        self.num_errors = 0
+        self.num_battles = 0
+        self.num_finished = 0
+
+    def _get_battle(self, room_id):
+
+        battle = self.battles.get(room_id)
+        if battle is None:
+            battle = LiveBattle(room_id, self.buffer_size)
+            self.battles[room_id] = battle
+            self._tasks[room_id] = asyncio.ensure_future(self._consume(battle))
+            self.num_battles += 1
+
+        return battle
+
+    async def _consume(self, battle):
+
+        try:
+            while True:
+                item = await battle.queue.get()
+                if item is None:
+                    break
+
+                line, received = item
+                try:
+                    new_turn = battle.process_line(line)
+                    if new_turn is not None and self.on_turn is not None:
+                        self.on_turn(battle, battle.processor.get_state_at_turn(new_turn))
+                except Exception:
+                    battle.num_errors += 1
+                    self.num_errors += 1
+                    logger.exception("Failed to process line %r of %s", line, battle.room_id)
+
+                self.latency.add(time.perf_counter() - received)
+                self.num_events += 1
+        finally:
+            # Nothing reads the queue from here on: release any feed_chunk
+            # waiting for room in it, which then sees the battle closed
+            battle.closed = True
+            while not battle.queue.empty():
+                battle.queue.get_nowait()
+
+            self.num_finished += 1
+            self.battles.pop(battle.room_id, None)
+            self._tasks.pop(battle.room_id, None)
+
+        if self.on_finish is not None:
+            self.on_finish(battle)
+
+    async def feed_chunk(self, chunk, received=None):
+
+        if received is None:
+            received = time.perf_counter()
+
+        room_id, lines = split_chunk(chunk)
+        if not room_id.startswith('battle-'):
+            return
+
+        battle = self._get_battle(room_id)
+
+        for line in lines:
+            # Lines after |deinit, or for a battle whose consumer stopped,
+            # have no reader and are dropped
+            if battle.closed:
+                return
+            if line.startswith('|deinit'):
+                battle.closed = True
+                await battle.queue.put(None)
+                return
+            if line:
+                await battle.queue.put((line, received))
+
+    async def close(self):
+
+        # Ends every battle still open, e.g. when the feed disconnects
+        for battle in list(self.battles.values()):
+            if not battle.closed:
+                battle.closed = True
+                await battle.queue.put(None)
+
+        await asyncio.gather(*list(self._tasks.values()))
+
+    async def run(self, chunks):
+
+        async for chunk in chunks:
+            await self.feed_chunk(chunk)
+
+        await self.close()
+
+    def get_stats(self):
+
+        stats = {
+            'battles': self.num_battles,
+            'finished': self.num_finished,
+            'events': self.num_events,
+            'errors': self.num_errors
+        }
+        stats.update(self.latency.percentiles())
+
+        return stats
+
+async def read_frames(reader):
+
+    while True:
+        try:
+            header = await reader.readexactly(FRAME_HEADER.size)
+            chunk = await reader.readexactly(FRAME_HEADER.unpack(header)[0])
+        except asyncio.IncompleteReadError:
+            return
+        yield chunk.decode('utf-8')
+
+async def stand_in_chunks(host, port):
+
+    reader, writer = await asyncio.open_connection(host, port)
+
+    try:
+        async for chunk in read_frames(reader):
+            yield chunk
+    finally:
+        writer.close()
+
+async def websocket_chunks(url, commands=()):
+
+    # Live feed from a Showdown server. Needs the optional websockets package.
+    try:
+        import websockets
+    except ImportError:
+        raise ImportError("websocket_chunks needs the websockets package") from None
+
+    async with websockets.connect(url) as websocket:
+        for command in commands:
+            await websocket.send(command)
+        async for message in websocket:
+            yield message
+
+def split_replay_into_chunks(battle_text):
+
+    # Groups a finished log into the chunks a live server would have sent:
+    # one per turn, each with its |t:| timestamp (None if it has none)
+    chunks = []
+    lines = []
+    timestamp = None
+
+    for line in iter_battle_lines(battle_text):
+        if line.startswith('|t:|') and timestamp is None:
+            timestamp = int(line[4:])
+        lines.append(line)
+        if line.startswith('|turn|'):
+            chunks.append((timestamp, '\n'.join(lines)))
+            lines = []
+            timestamp = None
+
+    if lines:
+        chunks.append((timestamp, '\n'.join(lines)))
+
+    return chunks
+
+class ReplayServer(object):
+
+    # Local stand-in for a Showdown feed: every connection gets each replay
+    # `copies` times as concurrent battles, chunked per turn. Gaps between
+    # chunks follow the replay's timestamps divided by speed; speed=0 sends
+    # everything as fast as the client reads it.
+
+    def __init__(self, replay_files, copies=1, speed=0, host='127.0.0.1', port=0):
+        self.battle_chunks = [split_replay_into_chunks(parse_replay_file(replay_file)) for replay_file in replay_files]
+        self.copies = copies
+        self.speed = speed
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def start(self):
+
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+
+        self.server.close()
+        await self.server.wait_closed()
+
+    def _write_frame(self, writer, chunk):
+        data = chunk.encode('utf-8')
+        writer.write(FRAME_HEADER.pack(len(data)) + data)
+
+    async def _stream_battle(self, writer, room_id, chunks):
+
+        previous_timestamp = None
+
+        for timestamp, chunk in chunks:
+            if self.speed and timestamp is not None and previous_timestamp is not None:
+                await asyncio.sleep(max(0, timestamp - previous_timestamp) / self.speed)
+            if timestamp is not None:
+                previous_timestamp = timestamp
+
+            self._write_frame(writer, f">{room_id}\n{chunk}")
+            await writer.drain()
+
+        self._write_frame(writer, f">{room_id}\n|deinit|")
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+
+        streams = []
+        for copy in range(self.copies):
+            for replay_idx, chunks in enumerate(self.battle_chunks):
+                room_id = f"battle-standin-{copy}-{replay_idx}"
+                streams.append(self._stream_battle(writer, room_id, chunks))
+
+        try:
+            await asyncio.gather(*streams)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+async def run_stand_in(replay_files, copies, speed, buffer_size):
+
+    server = ReplayServer(replay_files, copies, speed)
+    await server.start()
+
+    multiplexer = BattleMultiplexer(buffer_size)
+    start_time = time.perf_counter()
+
+    try:
+        await multiplexer.run(stand_in_chunks(server.host, server.port))
+    finally:
+        await server.stop()
+
+    return multiplexer, time.perf_counter() - start_time
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Follow replays streamed by a local stand-in server as live battles")
+    parser.add_argument('source', nargs='?', default='replays/*.html', help="glob of replays to stream")
+    parser.add_argument('--copies', type=int, default=100, help="concurrent copies of each replay")
+    parser.add_argument('--speed', type=float, default=0, help="playback speed multiplier (0: no delays)")
+    parser.add_argument('--buffer', type=int, default=256, help="per-battle line buffer size")
+    args = parser.parse_args()
+
+    multiplexer, elapsed = asyncio.run(run_stand_in(sorted(glob.glob(args.source)), args.copies, args.speed, args.buffer))
+
+    stats = multiplexer.get_stats()
+    print(f"{stats['battles']} battles, {stats['events']} events in {elapsed:.2f}s "
+          f"({stats['events'] / elapsed:.0f} events/s), {stats['errors']} errors")
+    print("latency: " + ", ".join(f"{name} {value * 1000:.2f}ms" for name, value in stats.items()
+                                  if name.startswith('p') and value is not None))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+import time
+from .corpus import ingest_corpus
+from .replay_cache import PARSER_VERSION
+from .sources import MEMBER_SEPARATOR, find_sources, is_bundle, iter_bundle
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    parser_version TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    processed_at REAL NOT NULL
+) WITHOUT ROWID;
+'''
+
+OK = 'ok'
+ERROR = 'error'
+
+def hash_file(path, block_size=1 << 20):
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+class CorpusManifest(object):
+
+    # Persistent record of every file of a corpus that has been processed:
+    # its size, mtime and content hash, the parser version that read it and
+    # whether that worked. sync only processes files that are new, changed
+    # or were read by another parser version, and forgets removed ones.
+    #
+    # Outcomes are committed every commit_every files or commit_interval
+    # seconds, whichever comes first, so a run that crashes or is interrupted
+    # picks up after the last commit and redoes at most that much work.
+
+    def __init__(self, manifest_file, commit_every=100, commit_interval=10.0):
+        self.manifest_file = manifest_file
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.connection = sqlite3.connect(manifest_file)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.executescript(SCHEMA)
+        self._pending = 0
+        self._last_commit = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def flush(self):
+        self.connection.commit()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+
+    def get(self, path):
+
+        # The record of path as a dict, or None if it isn't in the manifest
+        cursor = self.connection.execute('SELECT * FROM files WHERE path = ?', (os.path.abspath(path),))
+        row = cursor.fetchone()
+
+        return None if row is None else dict(zip([column[0] for column in cursor.description], row))
+
+    def get_errors(self):
+        return self.connection.execute("SELECT path, error FROM files WHERE status = ? ORDER BY path", (ERROR,)).fetchall()
+
+    def record(self, path, stat, content_hash, error=None):
+
+        self.connection.execute(
+            'INSERT OR REPLACE INTO files (path, size, mtime_ns, content_hash, parser_version, status, error, '
+            'processed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (path, stat.st_size, stat.st_mtime_ns, content_hash, PARSER_VERSION, ERROR if error else OK, error,
+             time.time())
+        )
+
+        self._pending += 1
+        if self._pending >= self.commit_every or time.monotonic() - self._last_commit >= self.commit_interval:
+            self.flush()
+
+    def diff(self, source, retry_errors=False):
+
+        # (changed, touched, removed): [(path, stat, content hash)] of files
+        # to process, the same for files whose stat changed but contents
+        # didn't, and paths no longer in source. Contents are only hashed
+        # when the size or mtime differ from the manifest's.
+        records = {path: (size, mtime_ns, content_hash, parser_version, status) for
+                   path, size, mtime_ns, content_hash, parser_version, status in self.connection.execute(
+                       'SELECT path, size, mtime_ns, content_hash, parser_version, status FROM files')}
+
+        changed = []
+        touched = []
+        paths = set()
+
+        for path in find_sources(source):
+            path = os.path.abspath(path)
+            paths.add(path)
+            stat = os.stat(path)
+            record = records.get(path)
+
+            current = (record is not None and record[3] == PARSER_VERSION and
+                       not (retry_errors and record[4] == ERROR))
+            if current and record[:2] == (stat.st_size, stat.st_mtime_ns):
+                continue
+
+            content_hash = hash_file(path)
+            if current and record[2] == content_hash:
+                touched.append((path, stat, content_hash))
+            else:
+                changed.append((path, stat, content_hash))
+
+        removed = [path for path in records if path not in paths]
+
+        return changed, touched, removed
+
+    def sync(self, source, process=None, workers=None, chunksize=8, on_result=None, on_remove=None,
+             retry_errors=False, stats=None, symbol_file=None):
+
+        # Brings the manifest up to date with source (a directory, glob or
+        # file; see sources), processing what changed with ingest_corpus.
+        # on_result gets every ReplayResult, and on_remove every path dropped
+        # from the manifest. Archives and JSONL bundles are one file each,
+        # failed if any replay in them fails.
+        start_time = time.perf_counter()
+        changed, touched, removed = self.diff(source, retry_errors)
+
+        for path in removed:
+            self.connection.execute('DELETE FROM files WHERE path = ?', (path,))
+            if on_remove is not None:
+                on_remove(path)
+
+        for path, stat, content_hash in touched:
+            self.connection.execute('UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?',
+                                    (stat.st_size, stat.st_mtime_ns, path))
+        self.flush()
+
+        pending = {path: (stat, content_hash) for path, stat, content_hash in changed}
+
+        def iter_items():
+            # Members or bundles that can't be read come through as failed results
+            for path, _, _ in changed:
+                if is_bundle(path):
+                    yield from iter_bundle(path)
+                else:
+                    yield path
+
+        counts = {'processed': 0, 'failed': 0, 'touched': len(touched), 'removed': len(removed)}
+        current = None
+        errors = []
+
+        def finish(path, errors):
+            stat, content_hash = pending.pop(path)
+            error = '\n'.join(errors) or None
+            self.record(path, stat, content_hash, error)
+            counts['processed'] += 1
+            counts['failed'] += error is not None
+
+        try:
+            # Ordered, so a bundle's replays arrive together and it can be
+            # recorded as soon as the next file's first result comes in
+            for result in ingest_corpus(iter_items(), workers, chunksize, ordered=True, process=process, stats=stats,
+                                        symbol_file=symbol_file):
+                path = result.path.split(MEMBER_SEPARATOR)[0]
+                if path != current:
+                    if current is not None:
+                        finish(current, errors)
+                    current = path
+                    errors = []
+                if not result.ok:
+                    errors.append(f"{result.path}:\n{result.error}")
+                if on_result is not None:
+                    on_result(result)
+
+            if current is not None:
+                finish(current, errors)
+
+            # Bundles with no replays in them
+            for path in list(pending):
+                finish(path, [])
+        finally:
+            self.flush()
+
+        counts['elapsed'] = time.perf_counter() - start_time
+
+        return counts
+
+    def watch(self, source, interval=60.0, **sync_args):
+
+        # Syncs every interval seconds, yielding each sync's counts; stop by
+        # breaking out of the loop
+        while True:
+            start_time = time.monotonic()
+            yield self.sync(source, **sync_args)
+            time.sleep(max(0.0, interval - (time.monotonic() - start_time)))
+
+def _print_counts(manifest, counts):
+    print(f"{time.strftime('%H:%M:%S')} processed {counts['processed']} files ({counts['failed']} failed), "
+          f"{counts['touched']} touched, {counts['removed']} removed in {counts['elapsed']:.2f}s; "
+          f"{len(manifest)} in the manifest")
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Process only the replays that are new or changed since the last run")
+    parser.add_argument('manifest', help="SQLite manifest file")
+    parser.add_argument('source', help="directory of replays, archives and exports, or a glob pattern")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: cpu count)")
+    parser.add_argument('--watch', type=float, default=None, help="keep syncing every this many seconds")
+    parser.add_argument('--retry-errors', action='store_true', help="process files that failed before again")
+    parser.add_argument('--symbols', default=None, help="symbol table file to load and update")
+    args = parser.parse_args()
+
+    sync_args = {'workers': args.workers, 'retry_errors': args.retry_errors, 'symbol_file': args.symbols}
+
+    with CorpusManifest(args.manifest) as manifest:
+        if args.watch is None:
+            _print_counts(manifest, manifest.sync(args.source, **sync_args))
+            return
+
+        for counts in manifest.watch(args.source, args.watch, **sync_args):
+            _print_counts(manifest, counts)
+
+if __name__ == '__main__':
+    main()
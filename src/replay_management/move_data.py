@@ -0,0 +1,137 @@
+import json
+import os
+import re
+from collections import Counter
+import numpy as np
+
+MOVES_FILE = os.path.join(os.path.dirname(__file__), '..', '..', 'lookups', 'moves.json')
+
+UNKNOWN_MOVE = -1
+
+_non_id_chars = re.compile(r'[^a-z0-9]')
+
+def to_move_id(name):
+
+    # Showdown's id form: "King's Shield", "kings-shield" -> "kingsshield"
+    return _non_id_chars.sub('', name.lower())
+
+def slug_to_display_name(slug):
+
+    # "fake-out" -> "Fake Out". Only a best guess for names with punctuation,
+    # which still resolve through their id.
+    return ' '.join(word.capitalize() for word in slug.split('-'))
+
+class MoveTable(object):
+
+    # Resolves move names as they appear anywhere (Showdown display names,
+    # Showdown ids, moves.json slugs) to their moves.json index.
+    #
+    # moves.json is only read on first use. Every name resolved is added to
+    # the alias map, so each distinct spelling is normalized once and later
+    # lookups are a single dict access.
+
+    def __init__(self, moves_file=MOVES_FILE):
+        self.moves_file = moves_file
+        self._aliases = None
+        self._by_id = None
+        self.slugs = None
+        # Occurrences of each name that didn't resolve
+        self.unknown = Counter()
+
+    def _load(self):
+
+        with open(self.moves_file, 'r') as f:
+            moves = json.load(f)
+
+        self.slugs = [None] * (max(moves.values()) + 1)
+        self._by_id = {}
+        self._aliases = {}
+
+        for slug, idx in moves.items():
+            self.slugs[idx] = slug
+            self._by_id[to_move_id(slug)] = idx
+            self._aliases[slug] = idx
+            self._aliases[to_move_id(slug)] = idx
+            self._aliases[slug_to_display_name(slug)] = idx
+
+    @property
+    def aliases(self):
+        if self._aliases is None:
+            self._load()
+        return self._aliases
+
+    def _resolve(self, move):
+
+        move_id = to_move_id(move)
+        idx = self._by_id.get(move_id)
+
+        # "Hidden Power Fire" etc. share the Hidden Power entry
+        if idx is None and move_id.startswith('hiddenpower'):
+            idx = self._by_id.get('hiddenpower')
+
+        return UNKNOWN_MOVE if idx is None else idx
+
+    def find_index(self, move):
+
+        # get_index without counting a miss in unknown, for lookups that
+        # aren't occurrences in a replay
+        idx = self.aliases.get(move)
+        if idx is None:
+            idx = self._resolve(move)
+            self._aliases[move] = idx
+
+        return idx
+
+    def get_index(self, move):
+
+        idx = self.find_index(move)
+        if idx == UNKNOWN_MOVE:
+            self.unknown[move] += 1
+
+        return idx
+
+    def get_indices(self, moves, return_unknown=False):
+
+        # Maps a whole column of move names to an int32 index array. Each
+        # distinct name is resolved once and the result is gathered back over
+        # the column, so the per-element work is a single dict lookup.
+        codes = {}
+        moves = list(moves)
+        inverse = np.fromiter((codes.setdefault(move, len(codes)) for move in moves), dtype=np.intp, count=len(moves))
+
+        aliases = self.aliases
+        resolved = []
+        for move in codes:
+            idx = aliases.get(move)
+            if idx is None:
+                idx = self._resolve(move)
+                aliases[move] = idx
+            resolved.append(idx)
+
+        lookup = np.array(resolved, dtype=np.int32)
+        indices = lookup[inverse]
+
+        unknown = [move for move, idx in zip(codes, resolved) if idx == UNKNOWN_MOVE]
+        if unknown:
+            counts = np.bincount(inverse, minlength=len(codes))
+            for move in unknown:
+                self.unknown[move] += int(counts[codes[move]])
+
+        if return_unknown:
+            return indices, unknown
+
+        return indices
+
+    def get_slug(self, idx):
+        if self.slugs is None:
+            self._load()
+        return self.slugs[idx]
+
+# Shared table, loaded on first lookup
+move_table = MoveTable()
+
+def get_move_index(move):
+    return move_table.get_index(move)
+
+def get_move_indices(moves, return_unknown=False):
+    return move_table.get_indices(moves, return_unknown)
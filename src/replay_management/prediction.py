@@ -0,0 +1,327 @@
+import argparse
+import glob
+import json
+import queue
+import socketserver
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from .features import PLAYERS, StateEncoder
+from .live import LatencyStats
+from .process_replay import ReplayProcessor, iter_battle_lines, parse_replay
+from .showdown_protocol import iter_replay_commands
+
+class HpDifferenceModel(object):
+
+    # Baseline model until a trained one exists: p1's win probability as a
+    # logistic of the difference in remaining team HP. Any callable taking the
+    # encoder's (floats, ints) batch and returning one row per state can be
+    # served in its place.
+
+    def __init__(self, encoder, scale=3.0):
+        self.scale = scale
+        columns = {name: idx for idx, name in enumerate(encoder.float_names)}
+        self.hp_cols = {
+            player: [columns[f'{player}:team{idx}:hp'] for idx in range(encoder.team_size)] for player in PLAYERS
+        }
+        self.fainted_cols = {
+            player: [columns[f'{player}:team{idx}:fainted'] for idx in range(encoder.team_size)] for player in PLAYERS
+        }
+
+    def __call__(self, floats, ints):
+
+        remaining = {}
+        for player in PLAYERS:
+            hp = floats[:, self.hp_cols[player]]
+            alive = 1.0 - floats[:, self.fainted_cols[player]]
+            remaining[player] = (hp * alive).sum(axis=1)
+
+        return 1.0 / (1.0 + np.exp(-self.scale * (remaining['p1'] - remaining['p2']) / len(self.hp_cols['p1'])))
+
+class PredictionService(object):
+
+    # Serves predictions for single BattleStates by running the model on
+    # micro-batches. A worker takes the oldest waiting request, then keeps
+    # collecting until it has max_batch_size or that request has waited
+    # max_wait seconds, whichever is first, and runs the whole batch through
+    # the encoder and model at once.
+    #
+    # submit returns a concurrent.futures.Future (asyncio callers can wrap it
+    # with asyncio.wrap_future); predict blocks for the result.
+    #
+    # The encoder's caches aren't thread-safe, so workers take turns encoding
+    # and only run the model concurrently.
+
+    def __init__(self, model=None, encoder=None, max_batch_size=64, max_wait=0.005, workers=1):
+        self.encoder = encoder if encoder is not None else StateEncoder()
+        self.model = model if model is not None else HpDifferenceModel(self.encoder)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.num_workers = workers
+
+        self._queue = queue.Queue()
+        self._workers = []
+        self._stats_lock = threading.Lock()
+        self._encode_lock = threading.Lock()
+
+        self.batch_sizes = Counter()
+        self.latency = LatencyStats()
+        self.num_requests = 0
+        self.num_errors = 0
+
+    def start(self):
+
+        for _ in range(self.num_workers):
+            worker = threading.Thread(target=self._work, daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+        return self
+
+    def stop(self):
+
+        # Requests already queued are still served before the workers exit
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+        self._workers = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def submit(self, state):
+
+        future = Future()
+        self._queue.put((state, future, time.perf_counter()))
+
+        return future
+
+    def predict(self, state, timeout=None):
+        return self.submit(state).result(timeout)
+
+    def predict_many(self, states, timeout=None):
+        futures = [self.submit(state) for state in states]
+        return [future.result(timeout) for future in futures]
+
+    def _next_batch(self):
+
+        first = self._queue.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = first[2] + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if item is None:
+                # Hand the stop signal back so this worker exits after the batch
+                self._queue.put(None)
+                break
+
+            batch.append(item)
+
+        return batch
+
+    def _work(self):
+
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if batch:
+                self._run_batch(batch)
+
+    def _run_batch(self, batch):
+
+        try:
+            with self._encode_lock:
+                floats, ints = self.encoder.encode([state for state, _, _ in batch])
+            outputs = self.model(floats, ints)
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            with self._stats_lock:
+                self.num_errors += len(batch)
+            return
+
+        for idx, (_, future, _) in enumerate(batch):
+            future.set_result(outputs[idx])
+
+        now = time.perf_counter()
+        with self._stats_lock:
+            self.batch_sizes[len(batch)] += 1
+            self.num_requests += len(batch)
+            for _, _, submitted in batch:
+                self.latency.add(now - submitted)
+
+    def get_stats(self):
+
+        with self._stats_lock:
+            num_batches = sum(self.batch_sizes.values())
+            stats = {
+                'queue_depth': self._queue.qsize(),
+                'requests': self.num_requests,
+                'errors': self.num_errors,
+                'batches': num_batches,
+                'mean_batch_size': self.num_requests / num_batches if num_batches else 0.0,
+                'batch_sizes': dict(sorted(self.batch_sizes.items()))
+            }
+            stats.update(self.latency.percentiles((50, 99)))
+
+        return stats
+
+def state_from_log(battle_text, turn=None):
+
+    # The state at the start of turn, or at the end of the log if turn isn't given
+    processor = ReplayProcessor(list(iter_replay_commands(iter_battle_lines(battle_text))))
+    if turn is None:
+        return processor.get_final_state()
+    if turn < 1:
+        raise IndexError(f"Battle has no turn {turn}")
+
+    return processor.get_state_at_turn(turn)
+
+class PredictionRequestHandler(BaseHTTPRequestHandler):
+
+    # POST /predict with {"log": "<protocol lines>", "turn": n} predicts on
+    # that state; GET /stats returns the service's stats
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+
+        if self.path != '/stats':
+            self._send_json(404, {'error': "not found"})
+            return
+
+        self._send_json(200, self.server.service.get_stats())
+
+    def do_POST(self):
+
+        if self.path != '/predict':
+            self._send_json(404, {'error': "not found"})
+            return
+
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            state = state_from_log(request['log'], request.get('turn'))
+        except (ValueError, KeyError, IndexError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        except Exception as e:
+            self._send_json(500, {'error': repr(e)})
+            return
+
+        try:
+            prediction = self.server.service.predict(state)
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+            return
+
+        self._send_json(200, {'prediction': prediction.tolist() if hasattr(prediction, 'tolist') else prediction})
+
+    def log_message(self, format, *args):
+        pass
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+    def get_request(self):
+        # Unix sockets have no client address, but the handler expects a tuple
+        request, _ = super().get_request()
+        return request, ('local', 0)
+
+def make_server(service, port=None, unix_socket=None, host='127.0.0.1'):
+
+    if unix_socket is not None:
+        server = UnixHTTPServer(unix_socket, PredictionRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port or 0), PredictionRequestHandler)
+
+    server.service = service
+
+    return server
+
+def run_load(service, states, clients):
+
+    # Submits every state from `clients` threads, one request at a time each,
+    # and returns the elapsed time
+    def client(client_states):
+        for state in client_states:
+            service.predict(state)
+
+    threads = [threading.Thread(target=client, args=(states[idx::clients],)) for idx in range(clients)]
+
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return time.perf_counter() - start_time
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Micro-batching prediction service over battle states")
+    parser.add_argument('source', nargs='?', default='replays/*.html', help="glob of replays for the load test")
+    parser.add_argument('--batch-size', type=int, default=64, help="largest batch run through the model")
+    parser.add_argument('--max-wait', type=float, default=5.0, help="longest a request waits for a batch (ms)")
+    parser.add_argument('--workers', type=int, default=1, help="batching worker threads")
+    parser.add_argument('--clients', type=int, default=32, help="concurrent clients in the load test")
+    parser.add_argument('--copies', type=int, default=200, help="times each replay's states are requested")
+    parser.add_argument('--port', type=int, default=None, help="serve HTTP on this port instead of load testing")
+    parser.add_argument('--unix-socket', default=None, help="serve HTTP on this Unix socket instead of load testing")
+    args = parser.parse_args()
+
+    service = PredictionService(max_batch_size=args.batch_size, max_wait=args.max_wait / 1000,
+                                workers=args.workers)
+
+    with service:
+        if args.port is not None or args.unix_socket is not None:
+            server = make_server(service, args.port, args.unix_socket)
+            print(f"Serving on {args.unix_socket or server.server_address}")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            server.server_close()
+            return
+
+        states = []
+        for replay_file in sorted(glob.glob(args.source)):
+            states.extend(ReplayProcessor(parse_replay(replay_file)).iter_states())
+        states = states * args.copies
+
+        elapsed = run_load(service, states, args.clients)
+
+    stats = service.get_stats()
+    print(f"{stats['requests']} requests in {elapsed:.2f}s ({stats['requests'] / elapsed:.0f} requests/s), "
+          f"{stats['batches']} batches, mean size {stats['mean_batch_size']:.1f}")
+    print(f"latency: p50 {stats['p50'] * 1000:.2f}ms, p99 {stats['p99'] * 1000:.2f}ms")
+    print(f"batch sizes: {stats['batch_sizes']}")
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,12 @@
+import mmap
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import nullcontext
 from html.parser import HTMLParser
-from .showdown_protocol import PlayerMessage, PokeMessage, StartMessage, TurnMessage, WinMessage, generate_replay_commands
+from .battle_log import ColumnarBattleLog
+from .battle_state import BattleState
+from .symbols import symbol_table
+from .showdown_protocol import ShowdownMessage, PlayerMessage, PokeMessage, StartMessage, TurnMessage, WinMessage, TieMessage, iter_replay_commands
 
 class BattleHTMLParser(HTMLParser):
 
@@ -20,7 +27,60 @@ class BattleHTMLParser(HTMLParser):
         if self.active_reading:
             self.battle_commands.append(data)
 
-def parse_replay_file(replay_file):
+BATTLE_LOG_MARKER = b'battle-log-data'
+SCRIPT_OPEN = b'<script'
+SCRIPT_CLOSE = b'</script'
+
+def _scan_battle_log(data):
+
+    # Byte-level equivalent of BattleHTMLParser for well-formed replay pages.
+    # Returns None whenever the page doesn't look exactly like we expect, so
+    # the caller can fall back to the full HTML tokenizer.
+
+    marker_idx = data.find(BATTLE_LOG_MARKER)
+    if marker_idx == -1:
+        return None
+
+    tag_start = data.rfind(SCRIPT_OPEN, 0, marker_idx)
+    if tag_start == -1 or data.find(b'>', tag_start, marker_idx) != -1:
+        return None
+
+    body_start = data.find(b'>', marker_idx)
+    if body_start == -1:
+        return None
+    body_start += 1
+
+    # Script contents are CDATA, so the tokenizer only stops on "</". Showdown
+    # escapes closing tags inside the log as "<\/", and entities are passed
+    # through untouched, so the first "</" has to be the closing script tag.
+    body_end = data.find(b'</', body_start)
+    if body_end == -1 or body_end == body_start:
+        return None
+    if data[body_end:body_end + len(SCRIPT_CLOSE)].lower() != SCRIPT_CLOSE:
+        return None
+
+    try:
+        battle_text = data[body_start:body_end].decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+
+    # Match the newline translation done by reading the file in text mode
+    if '\r' in battle_text:
+        battle_text = battle_text.replace('\r\n', '\n').replace('\r', '\n')
+
+    return battle_text
+
+def extract_battle_log(replay_file):
+
+    try:
+        with open(replay_file, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return _scan_battle_log(data)
+    except ValueError:
+        # Empty files can't be mapped
+        return None
+
+def parse_replay_file_html(replay_file):
 
     with open(replay_file, 'r') as f:
         replay_data = f.read()
@@ -31,19 +91,193 @@ def parse_replay_file(replay_file):
 
     return parser.battle_commands[0]
 
-def parse_replay(replay_file):
+def parse_replay_file(replay_file):
+
+    battle_text = extract_battle_log(replay_file)
 
-    battle_text = parse_replay_file(replay_file)
-    battle_commands_text = battle_text.split('\n')
-    battle_commands = generate_replay_commands(battle_commands_text)
+    if battle_text is None:
+        battle_text = parse_replay_file_html(replay_file)
 
-    return battle_commands
+    return battle_text
 
-class ReplayProcessor(object):
+def iter_battle_lines(battle_text):
+
+    # Equivalent to battle_text.split('\n'), without building the whole list
+    start = 0
+    end = battle_text.find('\n')
+
+    while end != -1:
+        yield battle_text[start:end]
+        start = end + 1
+        end = battle_text.find('\n', start)
+
+    yield battle_text[start:]
+
+def _extract_timed(replay_file, counters):
+
+    if counters is None:
+        return parse_replay_file(replay_file)
+
+    with counters.stage('extract'):
+        return parse_replay_file(replay_file)
+
+def stream_replay(replay_file, counters=None):
+
+    battle_text = _extract_timed(replay_file, counters)
+
+    return iter_replay_commands(iter_battle_lines(battle_text), counters)
+
+def parse_replay(replay_file, counters=None, cache=None):
+
+    # cache is an optional ReplayCache; hits skip extraction and tokenizing
+    if cache is not None:
+        return list(cache.parse(replay_file, counters))
+
+    return list(stream_replay(replay_file, counters))
+
+def parse_replay_columnar(replay_file, strings=None, counters=None, cache=None):
+
+    # Logs served from a cache keep their own string table rather than strings
+    if cache is not None:
+        return cache.parse(replay_file, counters)
+
+    battle_text = _extract_timed(replay_file, counters)
 
-    def __init__(self, battle_commands):
+    if counters is None:
+        return ColumnarBattleLog.from_lines(iter_battle_lines(battle_text), strings)
+
+    with counters.stage('columnar'):
+        return ColumnarBattleLog.from_lines(iter_battle_lines(battle_text), strings, counters)
+
+def iter_initial_state(battle_commands):
+
+    # Yields from the start command up to (not including) the first turn, and
+    # stops reading battle_commands there
+    started = False
+
+    for command in battle_commands:
+        if isinstance(command, TurnMessage):
+            return
+        if isinstance(command, StartMessage):
+            started = True
+        if started:
+            yield command
+
+def iter_turns(battle_commands):
+
+    # Lazy counterpart of ReplayProcessor.split_into_turns: each turn runs from
+    # its turn command up to the next one, and the last ends at the win or tie
+    turn = None
+
+    for command in battle_commands:
+        if isinstance(command, (TurnMessage, WinMessage, TieMessage)):
+            if turn is not None:
+                yield turn
+            if not isinstance(command, TurnMessage):
+                return
+            turn = []
+        if turn is not None:
+            turn.append(command)
+
+_indexed_class_cache = {}
+
+def _indexed_classes(command_type):
+
+    classes = _indexed_class_cache.get(command_type)
+    if classes is None:
+        classes = tuple(cls for cls in command_type.__mro__ if issubclass(cls, ShowdownMessage))
+        _indexed_class_cache[command_type] = classes
+
+    return classes
+
+class TurnView(object):
+
+    # Commands start to stop of a processor's battle_commands, read in place
+    # rather than copied out, so a view costs the same whatever its length.
+    # Type queries use the processor's type index.
+
+    __slots__ = ('processor', 'start', 'stop')
+
+    def __init__(self, processor, start, stop):
+        self.processor = processor
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __iter__(self):
+        commands = self.processor.battle_commands
+        for idx in range(self.start, self.stop):
+            yield commands[idx]
+
+    def __getitem__(self, idx):
+
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            if step == 1:
+                return TurnView(self.processor, self.start + start, self.start + max(start, stop))
+            return [self.processor.battle_commands[self.start + i] for i in range(start, stop, step)]
+
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("Turn index out of range")
+
+        return self.processor.battle_commands[self.start + idx]
+
+    def __repr__(self):
+        return f'<TurnView of commands {self.start}:{self.stop} {list(self)!r}>'
+
+    def get_command_offsets(self, command_cls):
+
+        # Offsets into battle_commands of the commands of command_cls
+        offsets = self.processor._type_index[command_cls]
+
+        return offsets[bisect_left(offsets, self.start):bisect_left(offsets, self.stop)]
+
+    def get_commands_of_type(self, command_cls):
+
+        commands = self.processor.battle_commands
+        return [commands[idx] for idx in self.get_command_offsets(command_cls)]
+
+    def count_commands_of_type(self, command_cls):
+
+        offsets = self.processor._type_index[command_cls]
+        return bisect_left(offsets, self.stop) - bisect_left(offsets, self.start)
+
+class ReplayProcessor(object):
 
-        self.battle_commands = battle_commands
+    def __init__(self, battle_commands, counters=None):
+
+        # counters, a ParseCounters with timing on, collects the time spent
+        # indexing commands and building states
+        self.counters = counters if counters is not None and counters.timed else None
+
+        # Offsets of every command, keyed by each ShowdownMessage class in its
+        # MRO, so isinstance-style queries are plain list lookups
+        self._type_index = defaultdict(list)
+        self._type_counts = Counter()
+
+        # battle_commands may be a list, a ColumnarBattleLog or any iterable
+        # of commands, such as the output of stream_replay. Iterables are only
+        # consumed as far as the queries made so far need, and columnar logs
+        # are indexed from their opcodes without building any messages.
+        if isinstance(battle_commands, list):
+            self.battle_commands = battle_commands
+            self._command_stream = None
+            with self._stage('index'):
+                for idx, command in enumerate(battle_commands):
+                    self._index_command_type(idx, type(command))
+        elif isinstance(battle_commands, ColumnarBattleLog):
+            self.battle_commands = battle_commands
+            self._command_stream = None
+            with self._stage('index'):
+                for idx, command_type in enumerate(battle_commands.command_types()):
+                    self._index_command_type(idx, command_type)
+        else:
+            self.battle_commands = []
+            self._command_stream = iter(battle_commands)
 
         self.players = {}
         self.pokemon = {}
@@ -51,60 +285,259 @@ class ReplayProcessor(object):
         self._populate_player_lookup()
         self._populate_pokemon_lookup()
 
-        self.battle_state = {}
+        # Live state, advanced by process_turn, plus the snapshot taken at
+        # each turn command so far (_state_snapshots[n - 1] is turn n)
+        self.battle_state = BattleState()
+        self._state_offset = 0
+        self._state_snapshots = []
+        self._final_state = None
+
+    def __setstate__(self, state):
+
+        # Re-intern the ids in the lookups, which were assigned by the
+        # symbol_table of the process that pickled us
+        self.__dict__.update(state)
+
+        for player in self.players.values():
+            player['username_id'] = symbol_table.intern('username', player['username'])
+
+        for team in self.pokemon.values():
+            for name, poke in team.items():
+                poke['species_id'] = symbol_table.intern('species', name)
+
+    def _stage(self, name):
+        return self.counters.stage(name) if self.counters is not None else nullcontext()
+
+    def _index_command_type(self, idx, command_type):
+
+        self._type_counts[command_type] += 1
+
+        for cls in _indexed_classes(command_type):
+            self._type_index[cls].append(idx)
+
+    def _pull_command(self):
+
+        if self._command_stream is None:
+            return None
+
+        command = next(self._command_stream, None)
+        if command is None:
+            self._command_stream = None
+        else:
+            self._index_command_type(len(self.battle_commands), type(command))
+            self.battle_commands.append(command)
+
+        return command
+
+    def _pull_until(self, command_cls, n=0):
+
+        # Reads the stream until the nth command of command_cls is loaded
+        offsets = self._type_index[command_cls]
+        while len(offsets) <= n and self._pull_command() is not None:
+            pass
+
+        return offsets
+
+    def _pull_all(self):
+
+        while self._pull_command() is not None:
+            pass
+
+    def _get_command_offsets(self, command_cls):
+
+        self._pull_all()
+
+        return self._type_index[command_cls]
 
     def _get_all_commands_of_type(self, command_cls):
 
-        return [(idx, command) for idx, command in enumerate(self.battle_commands) if isinstance(command, command_cls)]
+        return [(idx, self.battle_commands[idx]) for idx in self._get_command_offsets(command_cls)]
+
+    def get_commands_of_type(self, command_cls):
+
+        # Every command of command_cls in the battle, in order
+        commands = self.battle_commands
+        return [commands[idx] for idx in self._get_command_offsets(command_cls)]
 
     def _get_nth_command_of_type(self, command_cls, n):
 
-        return self._get_all_commands_of_type(command_cls)[n]
+        idx = self._pull_until(command_cls, n)[n]
+
+        return idx, self.battle_commands[idx]
+
+    def count_commands_of_type(self, command_cls):
+
+        return len(self._get_command_offsets(command_cls))
+
+    def get_command_counts(self):
+
+        self._pull_all()
+
+        return dict(self._type_counts)
+
+    def get_turn_boundaries(self):
+
+        # Offsets of every turn command followed by the offset the battle
+        # ended at (the first win or tie)
+        ends = self._get_command_offsets(WinMessage) + self._get_command_offsets(TieMessage)
+
+        return self._get_command_offsets(TurnMessage) + [min(ends)]
 
     def _populate_player_lookup(self):
 
-        player_commands = [pc[1] for pc in self._get_all_commands_of_type(PlayerMessage)]
+        # Team setup always precedes the start command, so a stream only
+        # needs to be read that far
+        self._pull_until(StartMessage)
+
+        player_commands = [self.battle_commands[idx] for idx in self._type_index[PlayerMessage]]
 
         for pc in player_commands:
-            self.players[pc.player] = {
-                'username': pc.username,
-                'rating': pc.rating
-            }
+            self._add_player(pc)
 
     def _populate_pokemon_lookup(self):
 
-        poke_commands = [pc[1] for pc in self._get_all_commands_of_type(PokeMessage)]
+        poke_commands = [self.battle_commands[idx] for idx in self._type_index[PokeMessage]]
 
         self.pokemon = {k: {} for k in self.players.keys()}
 
         for pc in poke_commands:
-            self.pokemon[pc.player][pc.name] = {
-                'level': pc.level,
-                'gender': pc.gender
-            }
+            self._add_pokemon(pc)
+
+    def _add_player(self, pc):
+
+        self.players[pc.player] = {
+            'username': pc.username,
+            'username_id': pc.username_id,
+            'rating': pc.rating
+        }
+
+    def _add_pokemon(self, pc):
+
+        self.pokemon.setdefault(pc.player, {})[pc.name] = {
+            'species_id': pc.name_id,
+            'level': pc.level,
+            'gender': pc.gender
+        }
+
+    def add_commands(self, commands):
+
+        # Appends commands as they arrive, for processors following a live
+        # battle. Only list-backed processors can grow like this.
+        if not isinstance(self.battle_commands, list) or self._command_stream is not None:
+            raise TypeError("Commands can only be added to a processor built from a list")
+
+        for command in commands:
+            self._index_command_type(len(self.battle_commands), type(command))
+            self.battle_commands.append(command)
+
+            if isinstance(command, PlayerMessage):
+                self._add_player(command)
+                self.pokemon.setdefault(command.player, {})
+            elif isinstance(command, PokeMessage):
+                self._add_pokemon(command)
 
     def get_battle_initial_state(self):
 
         start_idx = self._get_nth_command_of_type(StartMessage, 0)[0]
         first_turn_idx = self._get_nth_command_of_type(TurnMessage, 0)[0]
 
-        initial_setup = self.battle_commands[start_idx:first_turn_idx]
-
-        return initial_setup
+        return TurnView(self, start_idx, first_turn_idx)
 
     def split_into_turns(self):
 
-        tcis = [tc[0] for tc in self._get_all_commands_of_type(TurnMessage)]
+        # A TurnView per turn, between consecutive entries of the boundary table
+        tcis = self.get_turn_boundaries()
+
+        return [TurnView(self, tcis[i], tcis[i+1]) for i in range(len(tcis)-1)]
+
+    def iter_turns(self):
+
+        # Streams are read a turn at a time; anything already indexed yields
+        # views without waiting on the boundary table for the whole battle
+        if self._command_stream is not None:
+            return iter_turns(self._iter_commands())
+
+        return self._iter_turn_views()
+
+    def _iter_turn_views(self):
 
-        win_idx = self._get_nth_command_of_type(WinMessage, 0)[0]
-        tcis.append(win_idx)
+        turn_offsets = self._type_index[TurnMessage]
+        ends = self._type_index[WinMessage][:1] + self._type_index[TieMessage][:1]
+        end = min(ends) if ends else None
 
-        turns = [self.battle_commands[tcis[i]: tcis[i+1]] for i in range(len(tcis)-1)]
+        # As with iter_turns, a last turn with no win or tie after it is left out
+        for i, start in enumerate(turn_offsets):
+            if end is not None and start >= end:
+                return
+            if i + 1 < len(turn_offsets):
+                stop = turn_offsets[i + 1] if end is None else min(turn_offsets[i + 1], end)
+            elif end is not None:
+                stop = end
+            else:
+                return
+            yield TurnView(self, start, stop)
 
-        return turns
+    def _iter_commands(self):
+
+        idx = 0
+        while True:
+            if idx == len(self.battle_commands) and self._pull_command() is None:
+                return
+            yield self.battle_commands[idx]
+            idx += 1
 
     def process_turn(self, turn):
-        pass
+
+        # Applies a run of commands to battle_state and returns a snapshot of
+        # the result
+        for command in turn:
+            self.battle_state.apply(command)
+
+        return self.battle_state.snapshot()
+
+    def _advance_state(self, stop):
+
+        with self._stage('state'):
+            snapshot = self.process_turn(TurnView(self, self._state_offset, stop))
+        self._state_offset = stop
+
+        return snapshot
+
+    def get_state_at_turn(self, n):
+
+        # State as of the nth turn command, before any of that turn's actions.
+        # Turns are only processed once, so later queries are lookups.
+        if n < 1:
+            raise IndexError(f"Battle has no turn {n}")
+
+        while len(self._state_snapshots) < n:
+            turn_offsets = self._pull_until(TurnMessage, len(self._state_snapshots))
+            if len(turn_offsets) <= len(self._state_snapshots):
+                raise IndexError(f"Battle has no turn {n}")
+            self._state_snapshots.append(self._advance_state(turn_offsets[len(self._state_snapshots)] + 1))
+
+        return self._state_snapshots[n - 1]
+
+    def get_final_state(self):
+
+        if self._final_state is None:
+            # Record any turns we haven't snapshotted yet on the way
+            num_turns = self.count_commands_of_type(TurnMessage)
+            if num_turns:
+                self.get_state_at_turn(num_turns)
+            self._final_state = self._advance_state(len(self.battle_commands))
+
+        return self._final_state
+
+    def iter_states(self):
+
+        n = 1
+        while True:
+            try:
+                yield self.get_state_at_turn(n)
+            except IndexError:
+                return
+            n += 1
 
 
 
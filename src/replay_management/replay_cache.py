@@ -0,0 +1,241 @@
+import hashlib
+import mmap
+import os
+import shutil
+import tempfile
+from . import battle_log, process_replay, showdown_protocol, symbols
+from .battle_log import FORMAT_VERSION, ColumnarBattleLog
+from .process_replay import iter_battle_lines, parse_replay_file
+
+# Version directories are named with this prefix, and only those are ever
+# removed from a cache directory
+VERSION_PREFIX = 'v-'
+
+def _get_parser_version():
+
+    # Any change to the log extraction, the tokenizer and protocol
+    # definitions, the symbol tables or the binary layout gets a new version,
+    # and so a fresh cache directory
+    digest = hashlib.blake2b(b'%d' % FORMAT_VERSION, digest_size=8)
+    for module in (process_replay, showdown_protocol, symbols, battle_log):
+        with open(module.__file__, 'rb') as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()
+
+PARSER_VERSION = _get_parser_version()
+
+def hash_battle_log(battle_text):
+
+    return hashlib.blake2b(battle_text.encode('utf-8'), digest_size=16).hexdigest()
+
+def _write_atomic(path, data):
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+class ReplayCache(object):
+
+    # On-disk cache of parsed replays, stored as ColumnarBattleLog binaries.
+    #
+    # Entries are keyed by a hash of the extracted battle log, so copies of the
+    # same battle under different names share one entry. A small record per
+    # replay path remembers the size, mtime and key it had when last parsed,
+    # so an unchanged file is served without reading its HTML at all. Entries
+    # are least recently used first once the cache grows past max_bytes, and
+    # every eviction also drops the path records of evicted entries and of
+    # files that no longer exist.
+    #
+    # Every file is replaced atomically, so several processes can share a
+    # cache directory.
+
+    def __init__(self, cache_dir, max_bytes=1 << 30):
+        self.root_dir = cache_dir
+        self.cache_dir = os.path.join(cache_dir, VERSION_PREFIX + PARSER_VERSION)
+        self.entry_dir = os.path.join(self.cache_dir, 'entries')
+        self.path_dir = os.path.join(self.cache_dir, 'paths')
+        self.max_bytes = max_bytes
+
+        os.makedirs(self.entry_dir, exist_ok=True)
+        os.makedirs(self.path_dir, exist_ok=True)
+
+        self._remove_stale_versions()
+
+        self.hits = 0
+        self.path_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = sum(entry.stat().st_size for entry in os.scandir(self.entry_dir) if entry.name.endswith('.bin'))
+
+    def _remove_stale_versions(self):
+
+        current = os.path.basename(self.cache_dir)
+        for entry in os.scandir(self.root_dir):
+            if entry.is_dir() and entry.name.startswith(VERSION_PREFIX) and entry.name != current:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def _entry_path(self, key):
+        return os.path.join(self.entry_dir, key + '.bin')
+
+    def _path_record(self, replay_file):
+        path_key = hashlib.blake2b(os.path.abspath(replay_file).encode('utf-8'), digest_size=16).hexdigest()
+        return os.path.join(self.path_dir, path_key)
+
+    def _read_path_record(self, record_path):
+
+        # (size, mtime_ns, key, path) or None if it's missing or unreadable
+        try:
+            with open(record_path, 'r', encoding='utf-8') as f:
+                size, mtime_ns, key, path = f.read().split(' ', 3)
+            return int(size), int(mtime_ns), key, path
+        except (OSError, ValueError):
+            return None
+
+    def _lookup_path(self, replay_file, stat):
+
+        record = self._read_path_record(self._path_record(replay_file))
+        if record is None:
+            return None
+
+        size, mtime_ns, key, _ = record
+
+        if size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+            return None
+
+        return key
+
+    def _record_path(self, replay_file, stat, key):
+        record = f"{stat.st_size} {stat.st_mtime_ns} {key} {os.path.abspath(replay_file)}"
+        _write_atomic(self._path_record(replay_file), record.encode('utf-8'))
+
+    def load(self, key):
+
+        entry_path = self._entry_path(key)
+
+        try:
+            with open(entry_path, 'rb') as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # Touch the entry so eviction sees it as recently used
+            os.utime(entry_path)
+        except (OSError, ValueError):
+            return None
+
+        try:
+            return ColumnarBattleLog.from_buffer(buffer)
+        except ValueError:
+            # Corrupt or truncated: drop the entry, so it's parsed and stored
+            # again as a miss
+            try:
+                self.size -= os.path.getsize(entry_path)
+                os.unlink(entry_path)
+            except FileNotFoundError:
+                pass
+            return None
+
+    def store(self, key, battle_log):
+
+        data = battle_log.to_bytes()
+        _write_atomic(self._entry_path(key), data)
+
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+
+        # Oldest entries go first, down to 90% of max_bytes so we don't evict
+        # again on the very next store
+        entries = []
+        for entry in os.scandir(self.entry_dir):
+            if entry.name.endswith('.bin'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        entries.sort()
+
+        self.size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+
+        for _, size, path in entries:
+            if self.size <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+            self.evictions += 1
+
+        self.prune_paths()
+
+    def prune_paths(self):
+
+        # Removes path records that can't be served any more: their entry was
+        # evicted or their file is gone. Returns how many were removed.
+        removed = 0
+        for entry in os.scandir(self.path_dir):
+            if entry.name.endswith('.tmp'):
+                continue
+            record = self._read_path_record(entry.path)
+            if (record is None or not os.path.exists(self._entry_path(record[2])) or
+                    not os.path.exists(record[3])):
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+                removed += 1
+
+        return removed
+
+    def parse(self, replay_file, counters=None):
+
+        # Returns the replay's ColumnarBattleLog, from the cache if possible
+        stat = os.stat(replay_file)
+
+        key = self._lookup_path(replay_file, stat)
+        if key is not None:
+            battle_log = self.load(key)
+            if battle_log is not None:
+                self.hits += 1
+                self.path_hits += 1
+                return battle_log
+
+        battle_text = parse_replay_file(replay_file)
+        key = hash_battle_log(battle_text)
+
+        battle_log = self.load(key)
+        if battle_log is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            battle_log = ColumnarBattleLog.from_lines(iter_battle_lines(battle_text), counters=counters)
+            self.store(key, battle_log)
+
+        self._record_path(replay_file, stat, key)
+
+        return battle_log
+
+    def clear(self):
+
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.entry_dir, exist_ok=True)
+        os.makedirs(self.path_dir, exist_ok=True)
+        self.size = 0
+
+    def get_stats(self):
+
+        lookups = self.hits + self.misses
+
+        return {
+            'hits': self.hits,
+            'path_hits': self.path_hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'size': self.size
+        }
@@ -0,0 +1,353 @@
+import argparse
+import fnmatch
+import logging
+import os
+import sqlite3
+import time
+from .corpus import ingest_corpus
+from .sources import MEMBER_SEPARATOR, find_sources, is_bundle, iter_bundle
+from .showdown_protocol import (GametypeMessage, GenMessage, MoveMessage, RatedMessage, TierMessage, TimeMessage,
+                                TurnMessage, WinMessage)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS replays (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    tier TEXT,
+    gametype TEXT,
+    gen INTEGER,
+    rated INTEGER NOT NULL,
+    num_turns INTEGER NOT NULL,
+    winner TEXT,
+    start_time INTEGER
+);
+CREATE TABLE IF NOT EXISTS players (
+    replay_id INTEGER NOT NULL REFERENCES replays(id) ON DELETE CASCADE,
+    player TEXT NOT NULL,
+    username TEXT NOT NULL,
+    rating INTEGER
+);
+CREATE TABLE IF NOT EXISTS species (
+    replay_id INTEGER NOT NULL REFERENCES replays(id) ON DELETE CASCADE,
+    player TEXT NOT NULL,
+    species TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS moves (
+    replay_id INTEGER NOT NULL REFERENCES replays(id) ON DELETE CASCADE,
+    player TEXT NOT NULL,
+    move TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS replays_tier ON replays(tier COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS replays_gametype ON replays(gametype);
+CREATE INDEX IF NOT EXISTS players_username ON players(username COLLATE NOCASE, replay_id);
+CREATE INDEX IF NOT EXISTS players_replay ON players(replay_id, rating);
+CREATE INDEX IF NOT EXISTS species_species ON species(species COLLATE NOCASE, replay_id, player);
+CREATE INDEX IF NOT EXISTS species_replay ON species(replay_id);
+CREATE INDEX IF NOT EXISTS moves_move ON moves(move COLLATE NOCASE, replay_id, player);
+CREATE INDEX IF NOT EXISTS moves_replay ON moves(replay_id);
+'''
+
+logger = logging.getLogger(__name__)
+
+def _first(processor, command_cls, attr):
+
+    commands = processor.get_commands_of_type(command_cls)
+
+    return getattr(commands[0], attr) if commands else None
+
+def _index_path(name):
+
+    # Absolute path of a replay file, or "bundle::member" with the bundle's
+    # path made absolute
+    path, separator, member = name.partition(MEMBER_SEPARATOR)
+
+    return os.path.abspath(path) + separator + member
+
+def _in_source(path, source):
+
+    # Whether a file path is one find_sources(source) would cover, whether or
+    # not it still exists: a directory's direct children, the file itself,
+    # or a match of the glob pattern
+    source = os.path.abspath(source)
+    if os.path.isdir(source):
+        return os.path.dirname(path) == source
+    if '**' in source:
+        return fnmatch.fnmatchcase(path, source)
+
+    # Component by component, so * doesn't match across directories
+    parts = path.split(os.sep)
+    pattern = source.split(os.sep)
+
+    return len(parts) == len(pattern) and all(fnmatch.fnmatchcase(part, pat) for part, pat in zip(parts, pattern))
+
+def _to_int(value):
+
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def replay_metadata(processor):
+
+    # Everything the index records about one replay. Module level, so it can
+    # be passed to ingest_corpus as the process run in each worker.
+    players = [(player, info['username'], _to_int(info['rating'])) for player, info in processor.players.items()]
+    species = [(player, name) for player, team in processor.pokemon.items() for name in team]
+
+    moves = set()
+    for command in processor.get_commands_of_type(MoveMessage):
+        moves.add((command.player, command.move))
+
+    return {
+        'tier': _first(processor, TierMessage, 'formatname'),
+        'gametype': _first(processor, GametypeMessage, 'gametype'),
+        'gen': _to_int(_first(processor, GenMessage, 'gennum')),
+        'rated': processor.count_commands_of_type(RatedMessage) > 0,
+        'num_turns': processor.count_commands_of_type(TurnMessage),
+        'winner': _first(processor, WinMessage, 'user'),
+        'start_time': _to_int(_first(processor, TimeMessage, 'timestamp')),
+        'players': players,
+        'species': species,
+        'moves': sorted(moves)
+    }
+
+class ReplayIndex(object):
+
+    # SQLite index of replay metadata (tier, game type, players and ratings,
+    # species brought, moves used) for picking subsets of a corpus without
+    # parsing it again.
+    #
+    # update only ingests replays that are new or whose size or mtime changed
+    # since they were indexed, and drops replays that no longer exist or
+    # fail to parse. Replays in archives and JSONL exports are indexed as
+    # "bundle::member" with the bundle's size and mtime, and a bundle is only
+    # read again when it changes.
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self.connection = sqlite3.connect(index_file)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM replays').fetchone()[0]
+
+    def _indexed_stats(self):
+
+        # {file path: {(size, mtime_ns) of its rows}}, bundles' members grouped
+        # under the bundle
+        indexed = {}
+        for path, size, mtime_ns in self.connection.execute('SELECT path, size, mtime_ns FROM replays'):
+            indexed.setdefault(path.split(MEMBER_SEPARATOR)[0], set()).add((size, mtime_ns))
+
+        return indexed
+
+    def _remove_file(self, path):
+
+        # Every row of a file: the replay itself or all of a bundle's members
+        self.connection.execute('DELETE FROM replays WHERE path = ? OR substr(path, 1, ?) = ?',
+                                (path, len(path) + len(MEMBER_SEPARATOR), path + MEMBER_SEPARATOR))
+
+    def add(self, replay_file, metadata, stat=None):
+
+        # Records (or replaces) one replay; commits are left to the caller.
+        # stat is required for bundle members.
+        if stat is None:
+            stat = os.stat(replay_file)
+
+        path = _index_path(replay_file)
+        connection = self.connection
+        connection.execute('DELETE FROM replays WHERE path = ?', (path,))
+
+        cursor = connection.execute(
+            'INSERT INTO replays (path, size, mtime_ns, tier, gametype, gen, rated, num_turns, winner, start_time) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (path, stat.st_size, stat.st_mtime_ns, metadata['tier'], metadata['gametype'], metadata['gen'],
+             int(metadata['rated']), metadata['num_turns'], metadata['winner'], metadata['start_time'])
+        )
+        replay_id = cursor.lastrowid
+
+        connection.executemany('INSERT INTO players (replay_id, player, username, rating) VALUES (?, ?, ?, ?)',
+                               [(replay_id,) + player for player in metadata['players']])
+        connection.executemany('INSERT INTO species (replay_id, player, species) VALUES (?, ?, ?)',
+                               [(replay_id,) + species for species in metadata['species']])
+        connection.executemany('INSERT INTO moves (replay_id, player, move) VALUES (?, ?, ?)',
+                               [(replay_id,) + move for move in metadata['moves']])
+
+        return replay_id
+
+    def remove(self, replay_file):
+        self.connection.execute('DELETE FROM replays WHERE path = ?', (_index_path(replay_file),))
+
+    def update(self, source, workers=None, chunksize=8, prune=True, symbol_file=None):
+
+        # Brings the index up to date with source, a path, directory or glob
+        # read with sources.find_sources, or a list of replay files and
+        # bundles. Returns (added, removed, failed) counts; failures are
+        # logged. prune drops replays that were covered by source and no
+        # longer exist, leaving everything indexed from other sources alone.
+        # A list has no bounds to prune within, so it only adds.
+        replay_files = find_sources(source) if isinstance(source, str) else list(source)
+        indexed = self._indexed_stats()
+
+        stats = {}
+        changed = []
+        for replay_file in replay_files:
+            stat = os.stat(replay_file)
+            path = os.path.abspath(replay_file)
+            stats[path] = stat
+            if indexed.get(path) != {(stat.st_size, stat.st_mtime_ns)}:
+                changed.append(replay_file)
+
+        removed = 0
+        if prune and isinstance(source, str):
+            for path in indexed:
+                if path not in stats and _in_source(path, source):
+                    self._remove_file(path)
+                    removed += 1
+
+        added = 0
+        failed = 0
+
+        def iter_items():
+            # Members or bundles that can't be read come through as failed results
+            for replay_file in changed:
+                if not is_bundle(replay_file):
+                    yield replay_file
+                    continue
+                # Members that are gone from the bundle go with the old rows
+                self._remove_file(os.path.abspath(replay_file))
+                yield from iter_bundle(replay_file)
+
+        with self.connection:
+            for result in ingest_corpus(iter_items(), workers, chunksize, ordered=False, process=replay_metadata,
+                                        symbol_file=symbol_file):
+                if not result.ok:
+                    # Rows from an earlier parse no longer match the file
+                    logger.warning("Failed to index %s:\n%s", result.path, result.error)
+                    self.remove(result.path)
+                    failed += 1
+                    continue
+                self.add(result.path, result.output, stats[os.path.abspath(result.path.split(MEMBER_SEPARATOR)[0])])
+                added += 1
+
+        return added, removed, failed
+
+    def query(self, tier=None, gametype=None, gen=None, rated=None, player=None, rating_above=None, species=(),
+              moves=(), limit=None):
+
+        # Paths of the replays matching every filter given:
+        #   tier: case-insensitive substring of the format, e.g. "VGC 2021"
+        #   player: a username that played in the replay
+        #   rating_above: both players rated above this (strictly)
+        #   species: all brought by the same player
+        #   moves: all used in the replay, by either side
+        conditions = []
+        params = []
+
+        if tier is not None:
+            conditions.append("r.tier LIKE ? ESCAPE '\\'")
+            params.append('%' + tier.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        if gametype is not None:
+            conditions.append('r.gametype = ?')
+            params.append(gametype)
+        if gen is not None:
+            conditions.append('r.gen = ?')
+            params.append(gen)
+        if rated is not None:
+            conditions.append('r.rated = ?')
+            params.append(int(rated))
+        if player is not None:
+            conditions.append('r.id IN (SELECT replay_id FROM players WHERE username = ? COLLATE NOCASE)')
+            params.append(player)
+        if rating_above is not None:
+            conditions.append('NOT EXISTS (SELECT 1 FROM players p WHERE p.replay_id = r.id '
+                              'AND (p.rating IS NULL OR p.rating <= ?))')
+            params.append(rating_above)
+
+        species = list(dict.fromkeys(name.lower() for name in species))
+        if species:
+            conditions.append(
+                f"r.id IN (SELECT replay_id FROM species WHERE species COLLATE NOCASE IN "
+                f"({', '.join('?' * len(species))}) GROUP BY replay_id, player "
+                f"HAVING COUNT(DISTINCT LOWER(species)) = ?)"
+            )
+            params.extend(species)
+            params.append(len(species))
+
+        moves = list(dict.fromkeys(move.lower() for move in moves))
+        if moves:
+            conditions.append(
+                f"r.id IN (SELECT replay_id FROM moves WHERE move COLLATE NOCASE IN "
+                f"({', '.join('?' * len(moves))}) GROUP BY replay_id "
+                f"HAVING COUNT(DISTINCT LOWER(move)) = ?)"
+            )
+            params.extend(moves)
+            params.append(len(moves))
+
+        sql = 'SELECT r.path FROM replays r'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY r.path'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        return [path for path, in self.connection.execute(sql, params)]
+
+def _split_names(value):
+    return [name.strip() for name in value.split(',') if name.strip()] if value else []
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Index replay metadata and select replays from the index")
+    parser.add_argument('index', help="SQLite index file")
+    subparsers = parser.add_subparsers(dest='action', required=True)
+
+    update_parser = subparsers.add_parser('update', help="index new and changed replays")
+    update_parser.add_argument('source', help="directory of replays, archives and exports, or a glob pattern")
+    update_parser.add_argument('--workers', type=int, default=None, help="worker processes (default: cpu count)")
+    update_parser.add_argument('--keep-missing', action='store_true', help="keep replays that no longer exist")
+
+    query_parser = subparsers.add_parser('query', help="print the paths of matching replays")
+    query_parser.add_argument('--tier', default=None, help="substring of the format, e.g. 'VGC 2021'")
+    query_parser.add_argument('--gametype', default=None, help="singles, doubles, ...")
+    query_parser.add_argument('--gen', type=int, default=None)
+    query_parser.add_argument('--player', default=None, help="username that played")
+    query_parser.add_argument('--rating-above', type=int, default=None, help="both players rated above this")
+    query_parser.add_argument('--species', default=None, help="comma separated, all on one team")
+    query_parser.add_argument('--moves', default=None, help="comma separated, all used in the battle")
+    query_parser.add_argument('--limit', type=int, default=None)
+    args = parser.parse_args()
+
+    with ReplayIndex(args.index) as index:
+        if args.action == 'update':
+            start_time = time.perf_counter()
+            added, removed, failed = index.update(args.source, args.workers, prune=not args.keep_missing)
+            print(f"Indexed {added} replays, removed {removed}, {failed} failed in "
+                  f"{time.perf_counter() - start_time:.2f}s; {len(index)} in the index")
+            return
+
+        start_time = time.perf_counter()
+        paths = index.query(args.tier, args.gametype, args.gen, None, args.player, args.rating_above,
+                            _split_names(args.species), _split_names(args.moves), args.limit)
+        elapsed = time.perf_counter() - start_time
+
+        for path in paths:
+            print(path)
+        print(f"{len(paths)} replays in {elapsed * 1000:.1f}ms")
+
+if __name__ == '__main__':
+    main()
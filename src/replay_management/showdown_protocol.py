@@ -1,11 +1,45 @@
 
 import abc
-from re import S, split
+import inspect
+import json
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import cached_property
+from .symbols import SymbolField, get_symbol_fields, symbol_table
+
+try:
+    import orjson
+    decode_json = orjson.loads
+except ImportError:
+    decode_json = json.loads
+
+_lazy_field_cache = {}
+
+# symbol_table keeps its per-kind tables for the life of the process
+_position_table = symbol_table.tables['position']
+_species_table = symbol_table.tables['species']
+
+def get_lazy_fields(cls):
+
+    # Names of the cached_property attributes on cls, which are cached in the
+    # instance __dict__ under the same name
+    fields = _lazy_field_cache.get(cls)
+    if fields is None:
+        fields = tuple(name for klass in cls.__mro__ for name, attr in vars(klass).items()
+                       if isinstance(attr, cached_property))
+        _lazy_field_cache[cls] = fields
+
+    return fields
 
 # Abstract Classes
 
 class ShowdownMessage(abc.ABC):
 
+    # Bracketed tags (e.g. [still], [miss]) that didn't fit an optional argument
+    tags = ()
+
     def __init__(self, message_str):
         self.message_str = message_str
         self.frm = None
@@ -17,14 +51,43 @@ class ShowdownMessage(abc.ABC):
     def set_of(self, of):
         self.of = of
 
+    def set_tags(self, tags):
+        self.tags = tags
+
+    # Symbol ids are only meaningful within one process's symbol_table, so
+    # pickled messages carry the strings and re-intern them when loaded.
+    # Lazily decoded fields are left out and decoded again if read.
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in get_lazy_fields(type(self)):
+            state.pop(name, None)
+        for id_attr, kind in get_symbol_fields(type(self)).items():
+            if state.get(id_attr) is not None:
+                state[id_attr] = symbol_table.lookup(kind, state[id_attr])
+        return state
+
+    def __setstate__(self, state):
+        for id_attr, kind in get_symbol_fields(type(self)).items():
+            if state.get(id_attr) is not None:
+                state[id_attr] = symbol_table.intern(kind, state[id_attr])
+        self.__dict__.update(state)
+
 class PokemonBasedMessage(ShowdownMessage, abc.ABC):
 
     split_chars = ": "
 
+    position = SymbolField('position')
+    name = SymbolField('species')
+
     def __init__(self, message_str, pokemon):
         super().__init__(message_str)
 
-        self.position, self.name = pokemon.split(self.split_chars)
+        # Most lines name a Pokemon, so intern straight into the tables
+        # rather than through the SymbolField descriptors
+        position, name = pokemon.split(self.split_chars)
+        self.position_id = _position_table.intern(position)
+        self.name_id = _species_table.intern(name)
 
     @property
     def pokemon(self):
@@ -117,6 +180,8 @@ class MessageMessage(ShowdownMessage):
 
 class PlayerMessage(ShowdownMessage):
 
+    username = SymbolField('username')
+
     def __init__(self, player, username, avatar, rating):
         super().__init__("player")
         self.player = player
@@ -156,10 +221,19 @@ class RatedMessage(MessageMessage):
 
 class RuleMessage(ShowdownMessage):
 
+    # Keeps the raw "Rule: description" text; it's only split if read
+
     def __init__(self, rule):
         super().__init__("rule")
+        self.rule_text = rule
+
+    @cached_property
+    def rule(self):
+        return self.rule_text.partition(': ')[0]
 
-        self.rule, self.description = rule.split(': ')
+    @cached_property
+    def description(self):
+        return self.rule_text.partition(': ')[2]
 
 class ClearPokeMessage(ShowdownMessage):
 
@@ -168,30 +242,30 @@ class ClearPokeMessage(ShowdownMessage):
 
 class PokeMessage(ShowdownMessage):
 
+    # Level and gender are parsed up front: every processor reads them into
+    # its pokemon lookup, so decoding them lazily would save nothing
+
     split_chars = ", "
 
+    name = SymbolField('species')
+
     def __init__(self, player, details, item):
         super().__init__("poke")
         self.player = player
         self.item = item
+        self.details = details
 
-        pokemon_details = details.split(self.split_chars)
-
-        self.name = pokemon_details[0]
-        self.level = pokemon_details[1][1:]
-
-        if len(pokemon_details) == 3:
-            self.gender = pokemon_details[2]
-        else:
-            self.gender = None
-
-    @property
-    def details(self):
-        to_concat = [self.name, self.level]
-        if self.gender is not None:
-            to_concat.append(self.gender)
+        fields = details.split(self.split_chars)
+        self.name = fields[0]
 
-        self.split_chars.join(to_concat)
+        # Level is left out of the details at 100
+        self.level = '100'
+        self.gender = None
+        for field in fields[1:]:
+            if field[:1] == 'L':
+                self.level = field[1:]
+            elif field in ('M', 'F'):
+                self.gender = field
 
 class StartMessage(ShowdownMessage):
 
@@ -207,10 +281,16 @@ class SpacerMessage(ShowdownMessage):
 
 class RequestMessage(ShowdownMessage):
 
+    # request is the raw JSON, decoded into request_data on first access
+
     def __init__(self, request):
         super().__init__("request")
         self.request = request
 
+    @cached_property
+    def request_data(self):
+        return decode_json(self.request) if self.request else None
+
 class InactiveMessage(MessageMessage):
 
     def __init__(self, message):
@@ -253,6 +333,8 @@ class TimeMessage(ShowdownMessage):
 
 class MoveMessage(PokemonTargetMessage):
 
+    move = SymbolField('move')
+
     def __init__(self, pokemon, move, target, info=None):
         # Info field can collect things like spread move info
         super().__init__("move", pokemon, target)
@@ -687,57 +769,238 @@ class_lookup = {
     "-singleturn": SingleTurnMessage
 }
 
-def check_for_special_value(split_message, special_val):
-
-    for idx, s in enumerate(split_message):
-        if special_val in s:
-            return idx
-
-    return -1
-
-def generate_replay_commands(battle_messages):
-
-    match_history = []
+def _get_command_spec(cls):
+
+    params = list(inspect.signature(cls.__init__).parameters.values())[1:]
+    min_args = sum(1 for param in params if param.default is param.empty)
+
+    return min_args, len(params)
+
+# (min, max) positional arguments accepted by each command's message class
+command_specs = {command: _get_command_spec(cls) for command, cls in class_lookup.items()}
+
+# Matches protocol tags like "[from] item: Life Orb" or "[silent]", but not
+# argument values that happen to start with a bracket like "[Gen 8] VGC 2021"
+tag_re = re.compile(r'\[[a-z]+\]')
+
+class ParseCounters(object):
+
+    # Everything counted while parsing: messages per command, and the lines
+    # skipped as invalid, unknown or malformed. With timed=True it also keeps
+    # wall and CPU time per stage (see stage) and the time spent building
+    # each command's messages. Counters from many replays can be merged into
+    # one for a whole corpus.
+
+    def __init__(self, timed=False):
+        self.timed = timed
+        self.commands = Counter()
+        self.unknown = Counter()
+        self.malformed = Counter()
+        self.invalid_lines = 0
+
+        self.build_time = Counter()
+        self.stage_calls = Counter()
+        self.stage_wall = Counter()
+        self.stage_cpu = Counter()
+
+    def clear(self):
+        self.commands.clear()
+        self.unknown.clear()
+        self.malformed.clear()
+        self.invalid_lines = 0
+        self.build_time.clear()
+        self.stage_calls.clear()
+        self.stage_wall.clear()
+        self.stage_cpu.clear()
+
+    @contextmanager
+    def stage(self, name):
+
+        # Times the block as the named stage, if timing is on
+        if not self.timed:
+            yield
+            return
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            self.add_stage_time(name, time.perf_counter() - wall_start, time.process_time() - cpu_start)
+
+    def add_stage_time(self, name, wall, cpu=None):
+
+        # cpu is None for stages only timed by wall clock, e.g. tokenize and
+        # build, which interleave with whatever consumes the messages
+        self.stage_calls[name] += 1
+        self.stage_wall[name] += wall
+        if cpu is not None:
+            self.stage_cpu[name] += cpu
+
+    def merge(self, other):
+
+        self.commands.update(other.commands)
+        self.unknown.update(other.unknown)
+        self.malformed.update(other.malformed)
+        self.invalid_lines += other.invalid_lines
+        self.build_time.update(other.build_time)
+        self.stage_calls.update(other.stage_calls)
+        self.stage_wall.update(other.stage_wall)
+        self.stage_cpu.update(other.stage_cpu)
+
+        return self
+
+    def as_dict(self):
+
+        stages = {}
+        for name, calls in self.stage_calls.items():
+            stages[name] = {'calls': calls, 'wall': self.stage_wall[name], 'cpu': self.stage_cpu.get(name)}
+
+        commands = {}
+        for command, count in self.commands.most_common():
+            commands[command] = {'count': count}
+            if command in self.build_time:
+                commands[command]['build_time'] = self.build_time[command]
+
+        return {
+            'stages': stages,
+            'commands': commands,
+            'unknown': dict(self.unknown),
+            'malformed': dict(self.malformed),
+            'invalid_lines': self.invalid_lines
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.as_dict(), **kwargs)
+
+def tokenize_replay_messages(battle_messages, counters=None):
+
+    # Yields (command, args, from, of, tags) for every known protocol line
+    # without building message objects. Tags other than [from]/[of] fill any
+    # optional arguments left over after the positional ones, and whatever
+    # remains is returned in tags. Unknown commands and lines that don't fit
+    # their message class are counted in counters and skipped. Counting is
+    # opt-in: without counters, they go to a throwaway ParseCounters.
+
+    if counters is None:
+        counters = ParseCounters()
+
+    match_tag = tag_re.match
+    counts = counters.commands
 
     for message in battle_messages:
 
-        if message == '|':
+        if message == '|' or not message:
             continue
 
         split_message = message.split('|')
 
         if len(split_message) <= 1:
-            print(message)
+            counters.invalid_lines += 1
+            continue
+
+        command = split_message[1]
+
+        spec = command_specs.get(command)
+        if spec is None:
+            counters.unknown[command] += 1
             continue
 
+        args = split_message[2:]
+        tags = []
         from_text = None
         of_text = None
 
-        from_idx = check_for_special_value(split_message, '[from]')
-        if from_idx != -1:
-            from_text = split_message[from_idx]
-            del split_message[from_idx]
+        # Most lines carry no tags, so only walk the fields when one might
+        if '|[' in message:
+            args = []
+            for field in split_message[2:]:
+                if field[:1] == '[' and match_tag(field):
+                    if from_text is None and field.startswith('[from]'):
+                        from_text = field
+                    elif of_text is None and field.startswith('[of]'):
+                        of_text = field
+                    else:
+                        tags.append(field)
+                else:
+                    args.append(field)
+
+        min_args, max_args = spec
+
+        if tags and len(args) < max_args:
+            num_filled = max_args - len(args)
+            args.extend(tags[:num_filled])
+            tags = tags[num_filled:]
+
+        if not min_args <= len(args) <= max_args:
+            counters.malformed[command] += 1
+            continue
 
-        of_idx = check_for_special_value(split_message, '[of]')
-        if of_idx != -1:
-            of_text = split_message[of_idx]
-            del split_message[of_idx]
+        counts[command] += 1
 
-        cls = class_lookup.get(split_message[1], None)
-        if cls is None:
-            print(f"Unknown command: {message}")
-            continue
-        #print(f"Class: {cls}, text: {message}")
+        yield command, args, from_text, of_text, tags
 
-        msg_cls = cls(*split_message[2:])
-        if from_text is not None:
-            msg_cls.set_from(from_text)
-        if of_text is not None:
-            msg_cls.set_of(of_text)
+def build_command(command, args, from_text=None, of_text=None, tags=None):
+
+    msg_cls = class_lookup[command](*args)
+    if from_text is not None:
+        msg_cls.set_from(from_text)
+    if of_text is not None:
+        msg_cls.set_of(of_text)
+    if tags:
+        msg_cls.set_tags(tags)
+
+    return msg_cls
 
-        match_history.append(msg_cls)
+def _iter_replay_commands_timed(battle_messages, counters):
 
-    return match_history
-        
+    # iter_replay_commands, splitting the time spent between tokenizing and
+    # building each command's messages. Time spent by the consumer between
+    # messages isn't counted.
+    clock = time.perf_counter
+    build_time = counters.build_time
+    tokenize_total = 0.0
+    build_total = 0.0
+
+    try:
+        start = clock()
+        for command, args, from_text, of_text, tags in tokenize_replay_messages(battle_messages, counters):
+            tokenized = clock()
+            message = build_command(command, args, from_text, of_text, tags)
+            built = clock()
+
+            tokenize_total += tokenized - start
+            build_total += built - tokenized
+            build_time[command] += built - tokenized
+
+            yield message
+            start = clock()
+
+        tokenize_total += clock() - start
+    finally:
+        counters.add_stage_time('tokenize', tokenize_total)
+        counters.add_stage_time('build', build_total)
+
+def iter_replay_commands(battle_messages, counters=None):
+
+    # Lazily turns protocol lines into message objects; lines are only read
+    # from battle_messages as commands are requested, so consumers can stop early
+
+    if counters is not None and counters.timed:
+        yield from _iter_replay_commands_timed(battle_messages, counters)
+        return
+
+    # build_command inlined, as this runs once per line
+    for command, args, from_text, of_text, tags in tokenize_replay_messages(battle_messages, counters):
+        message = class_lookup[command](*args)
+        if from_text is not None:
+            message.frm = from_text
+        if of_text is not None:
+            message.of = of_text
+        if tags:
+            message.tags = tags
+        yield message
 
+def generate_replay_commands(battle_messages, counters=None):
 
+    return list(iter_replay_commands(battle_messages, counters))
@@ -0,0 +1,169 @@
+import glob
+import gzip
+import os
+import tarfile
+import zipfile
+from .process_replay import BattleHTMLParser, _scan_battle_log, parse_replay_file
+from .showdown_protocol import decode_json
+
+# Replays can come as saved .html pages, Showdown's .json replay exports
+# (the battle log is their "log" field) and raw .log files, any of them
+# gzipped, plus bundles of those: .zip and .tar(.gz/.bz2/.xz) archives and
+# .jsonl(.gz) files with one JSON export per line.
+#
+# iter_replays turns a source into items ingest_replay takes: the path of
+# each file that can be read on its own, so workers read them in parallel,
+# and (name, battle_text) entries for replays streamed out of bundles,
+# which are only read in order. Member names are "bundle::member".
+#
+# A member that can't be read comes out as (name, exception) instead, and a
+# bundle that can't be opened or read any further as (bundle, exception),
+# so ingest_replay reports them as failed replays and the rest of the
+# corpus goes on.
+
+REPLAY_SUFFIXES = ('.html', '.htm', '.json', '.log')
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+JSONL_SUFFIXES = ('.jsonl', '.jsonl.gz')
+
+MEMBER_SEPARATOR = '::'
+
+def _strip_gz(name):
+    return name[:-3] if name.endswith('.gz') else name
+
+def _normalize_newlines(battle_text):
+
+    # Match the newline translation done by reading a file in text mode
+    if '\r' in battle_text:
+        battle_text = battle_text.replace('\r\n', '\n').replace('\r', '\n')
+
+    return battle_text
+
+def is_replay_file(name):
+    return _strip_gz(name.lower()).endswith(REPLAY_SUFFIXES)
+
+def is_bundle(name):
+    return name.lower().endswith(ARCHIVE_SUFFIXES + JSONL_SUFFIXES)
+
+def battle_log_from_bytes(name, data):
+
+    # Battle log text of one replay file's contents; the format comes from
+    # the name's suffix
+    name = name.lower()
+    if name.endswith('.gz'):
+        data = gzip.decompress(data)
+        name = name[:-3]
+
+    if name.endswith('.json'):
+        return _normalize_newlines(decode_json(data)['log'])
+
+    if name.endswith('.log'):
+        return _normalize_newlines(data.decode('utf-8'))
+
+    battle_text = _scan_battle_log(data)
+    if battle_text is None:
+        parser = BattleHTMLParser()
+        parser.feed(_normalize_newlines(data.decode('utf-8')))
+        battle_text = parser.battle_commands[0]
+
+    return battle_text
+
+def read_battle_log(replay_file):
+
+    # Battle log text of a replay file of any of the formats above. Plain
+    # .html pages keep the mapped fast path of parse_replay_file.
+    lower = replay_file.lower()
+    if lower.endswith(('.html', '.htm')):
+        return parse_replay_file(replay_file)
+
+    with open(replay_file, 'rb') as f:
+        return battle_log_from_bytes(replay_file, f.read())
+
+def _read_member(name, read):
+
+    try:
+        return name, read()
+    except Exception as e:
+        return name, e
+
+def iter_zip(archive_file):
+
+    try:
+        with zipfile.ZipFile(archive_file) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not is_replay_file(info.filename):
+                    continue
+                yield _read_member(archive_file + MEMBER_SEPARATOR + info.filename,
+                                   lambda: battle_log_from_bytes(info.filename, archive.read(info)))
+    except Exception as e:
+        yield archive_file, e
+
+def iter_tar(archive_file):
+
+    # Read as a stream ('r|*'), so compressed archives are decompressed once
+    # front to back without seeking. A stream can't skip past a bad block,
+    # so reading stops there.
+    try:
+        with tarfile.open(archive_file, 'r|*') as archive:
+            for member in archive:
+                if not member.isfile() or not is_replay_file(member.name):
+                    continue
+                yield _read_member(archive_file + MEMBER_SEPARATOR + member.name,
+                                   lambda: battle_log_from_bytes(member.name, archive.extractfile(member).read()))
+    except Exception as e:
+        yield archive_file, e
+
+def _jsonl_entry(jsonl_file, line_no, line):
+
+    # One JSON replay export per line, named by its id or line number
+    replay = decode_json(line)
+    name = replay.get('id') or str(line_no)
+
+    return jsonl_file + MEMBER_SEPARATOR + name, _normalize_newlines(replay['log'])
+
+def iter_jsonl(jsonl_file):
+
+    opener = gzip.open if jsonl_file.lower().endswith('.gz') else open
+    try:
+        with opener(jsonl_file, 'rb') as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield _jsonl_entry(jsonl_file, line_no, line)
+                except Exception as e:
+                    yield jsonl_file + MEMBER_SEPARATOR + str(line_no), e
+    except Exception as e:
+        yield jsonl_file, e
+
+def iter_bundle(bundle_file):
+
+    lower = bundle_file.lower()
+    if lower.endswith('.zip'):
+        return iter_zip(bundle_file)
+    if lower.endswith(JSONL_SUFFIXES):
+        return iter_jsonl(bundle_file)
+
+    return iter_tar(bundle_file)
+
+def find_sources(source):
+
+    # Replay files and bundles in a directory (not recursively), or matching
+    # a glob pattern, or source itself if it's a file
+    if os.path.isdir(source):
+        names = sorted(os.listdir(source))
+        return [os.path.join(source, name) for name in names if is_replay_file(name) or is_bundle(name)]
+
+    if os.path.isfile(source):
+        return [source]
+
+    return [path for path in sorted(glob.glob(source, recursive=True)) if is_replay_file(path) or is_bundle(path)]
+
+def iter_replays(source):
+
+    # Lazily yields every replay in source, a path, directory or glob pattern,
+    # as a path or a (name, battle_text) entry
+    for path in find_sources(source):
+        if is_bundle(path):
+            yield from iter_bundle(path)
+        else:
+            yield path
@@ -0,0 +1,149 @@
+import json
+import os
+import tempfile
+import threading
+
+# Taken only when a new string is added, so threads interning into the same
+# table (e.g. the prediction service's) agree on every id. Module level, as
+# tables are pickled and locks can't be.
+_intern_lock = threading.Lock()
+
+class StringTable(object):
+
+    # Interns strings to small integer ids. A single table can be shared by
+    # many logs so repeated names are only stored once across a corpus.
+
+    def __init__(self, strings=None):
+        self.ids = {}
+        self.strings = []
+
+        for value in strings or []:
+            self.intern(value)
+
+    def intern(self, value):
+        value_id = self.ids.get(value)
+        if value_id is None:
+            with _intern_lock:
+                value_id = self.ids.get(value)
+                if value_id is None:
+                    value_id = len(self.strings)
+                    self.strings.append(value)
+                    self.ids[value] = value_id
+        return value_id
+
+    def get_id(self, value):
+        return self.ids.get(value)
+
+    def __getitem__(self, value_id):
+        return self.strings[value_id]
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __contains__(self, value):
+        return value in self.ids
+
+class SymbolTable(object):
+
+    # One id space per kind of symbol, so ids stay small and dense enough to
+    # index feature arrays with directly
+
+    kinds = ('position', 'species', 'move', 'username')
+
+    def __init__(self):
+        self.tables = {kind: StringTable() for kind in self.kinds}
+
+    def intern(self, kind, value):
+        return self.tables[kind].intern(value)
+
+    def get_id(self, kind, value):
+        return self.tables[kind].get_id(value)
+
+    def lookup(self, kind, symbol_id):
+        return self.tables[kind][symbol_id]
+
+    def size(self, kind):
+        return len(self.tables[kind])
+
+    def to_dict(self):
+        return {kind: table.strings for kind, table in self.tables.items()}
+
+    def update_from_dict(self, data):
+
+        # Ids must agree with what's already interned, so only tables that are
+        # a prefix of the saved ones can be extended
+        for kind, strings in data.items():
+            table = self.tables.setdefault(kind, StringTable())
+            if table.strings != strings[:len(table)]:
+                raise ValueError(f"Symbol table for {kind} doesn't match the saved one")
+            for value in strings[len(table):]:
+                table.intern(value)
+
+    def save(self, path):
+
+        # Written to a temporary file and renamed so readers never see a
+        # partially written table
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    def read(self, path):
+
+        with open(path, 'r') as f:
+            self.update_from_dict(json.load(f))
+
+    @classmethod
+    def load(cls, path):
+
+        table = cls()
+        table.read(path)
+
+        return table
+
+# The table every parsed message interns into. Load a saved table into it
+# with symbol_table.read(path) before parsing to reuse an earlier id space.
+symbol_table = SymbolTable()
+
+class SymbolField(object):
+
+    # Descriptor for message attributes holding a symbol: the value is
+    # interned into symbol_table on assignment and only the id is stored, in
+    # the instance attribute <name>_id. Reading the attribute returns the
+    # table's shared copy of the string.
+
+    def __init__(self, kind):
+        self.kind = kind
+
+    def __set_name__(self, owner, name):
+        self.id_attr = name + '_id'
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+
+        symbol_id = obj.__dict__[self.id_attr]
+        if symbol_id is None:
+            return None
+
+        return symbol_table.tables[self.kind].strings[symbol_id]
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.id_attr] = None if value is None else symbol_table.tables[self.kind].intern(value)
+
+_symbol_field_cache = {}
+
+def get_symbol_fields(cls):
+
+    # {id attribute: kind} for every SymbolField on cls
+    fields = _symbol_field_cache.get(cls)
+    if fields is None:
+        fields = {}
+        for klass in reversed(cls.__mro__):
+            for attr in vars(klass).values():
+                if isinstance(attr, SymbolField):
+                    fields[attr.id_attr] = attr.kind
+        _symbol_field_cache[cls] = fields
+
+    return fields
@@ -0,0 +1,435 @@
+import argparse
+import os
+from functools import partial
+import numpy as np
+from .battle_state import parse_details
+from .corpus import IngestStats, ingest_corpus
+from .dedup import SeenSet
+from .showdown_protocol import DragMessage, MoveMessage, SwitchMessage, WinMessage
+from .symbols import StringTable
+
+# Upper bounds of the rating buckets after bucket 0, which holds unrated
+# players; the last bucket is everything from the top edge up
+RATING_EDGES = (1100, 1300, 1500, 1700)
+
+# Count arrays kept by UsageStats. Every one has a leading rating bucket
+# axis, followed by axes over the species ('s') or move ('m') vocabulary.
+COUNT_ARRAYS = {
+    # Teams that brought each species, and those that won
+    'species_usage': 's',
+    'species_wins': 's',
+    # Teams that brought both species; the diagonal is left at zero
+    'teammates': 'ss',
+    # Teams that led with each species, and with each pair in doubles
+    'leads': 's',
+    'lead_pairs': 'ss',
+    # Teams that used each move, and each move on each species
+    'move_usage': 'm',
+    'species_moves': 'sm'
+}
+
+def _to_int(value):
+
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+class UsageStats(object):
+
+    # Metagame counts over many battles, per team and rating bucket: species
+    # and move usage, teammates, leads and wins. Species and moves are
+    # interned into this object's own string tables, and the counts are
+    # numpy arrays indexed by those ids, grown as the tables grow.
+    #
+    # Stats from separate replays or worker processes combine with merge,
+    # which maps the other's ids into these tables first, so merging is
+    # associative and the order partials arrive in doesn't matter.
+
+    def __init__(self, rating_edges=RATING_EDGES):
+        self.rating_edges = tuple(rating_edges)
+        self.num_buckets = len(self.rating_edges) + 2
+
+        self.species = StringTable()
+        self.moves = StringTable()
+
+        self.battles = 0
+        self.teams = np.zeros(self.num_buckets, dtype=np.int64)
+        self.team_wins = np.zeros(self.num_buckets, dtype=np.int64)
+
+        self._capacity = {'s': 0, 'm': 0}
+        self.counts = {}
+        self._reserve(16, 16)
+
+    def _reserve(self, num_species, num_moves):
+
+        # Grows every array so ids up to these sizes fit, doubling capacity
+        wanted = {'s': num_species, 'm': num_moves}
+        if all(wanted[axis] <= self._capacity[axis] for axis in wanted):
+            return
+
+        capacity = {axis: max(self._capacity[axis], 1) for axis in wanted}
+        for axis in capacity:
+            while capacity[axis] < wanted[axis]:
+                capacity[axis] *= 2
+
+        for name, axes in COUNT_ARRAYS.items():
+            grown = np.zeros((self.num_buckets,) + tuple(capacity[axis] for axis in axes), dtype=np.int64)
+            old = self.counts.get(name)
+            if old is not None:
+                grown[(slice(None),) + tuple(slice(0, size) for size in old.shape[1:])] = old
+            self.counts[name] = grown
+
+        self._capacity = capacity
+
+    def _sizes(self):
+        return {'s': len(self.species), 'm': len(self.moves)}
+
+    def get_counts(self, name):
+
+        # Count array trimmed to the species and moves seen so far
+        sizes = self._sizes()
+        return self.counts[name][(slice(None),) + tuple(slice(0, sizes[axis]) for axis in COUNT_ARRAYS[name])]
+
+    def bucket(self, rating):
+        if rating is None:
+            return 0
+        return int(np.searchsorted(self.rating_edges, rating, side='right')) + 1
+
+    def bucket_names(self):
+
+        names = ['unrated', f'<{self.rating_edges[0]}']
+        for low, high in zip(self.rating_edges, self.rating_edges[1:]):
+            names.append(f'{low}-{high - 1}')
+        names.append(f'{self.rating_edges[-1]}+')
+
+        return names
+
+    def add_team(self, rating, species, won=False, leads=(), moves=None):
+
+        # One team: the species it brought, the ones it led with, and
+        # moves, {species: moves it used}
+        intern_species = self.species.intern
+        intern_move = self.moves.intern
+
+        species_ids = np.array(sorted({intern_species(name) for name in species}), dtype=np.int64)
+        lead_ids = list(dict.fromkeys(intern_species(name) for name in leads))
+        move_pairs = {(intern_species(name), intern_move(move)) for name, used in (moves or {}).items() for move in used}
+        self._reserve(len(self.species), len(self.moves))
+
+        b = self.bucket(rating)
+        counts = self.counts
+        self.teams[b] += 1
+        self.team_wins[b] += bool(won)
+
+        counts['species_usage'][b, species_ids] += 1
+        if won:
+            counts['species_wins'][b, species_ids] += 1
+        counts['teammates'][b, species_ids[:, None], species_ids[None, :]] += 1
+        counts['teammates'][b, species_ids, species_ids] -= 1
+
+        if lead_ids:
+            counts['leads'][b, lead_ids] += 1
+        if len(lead_ids) >= 2:
+            counts['lead_pairs'][b, lead_ids[0], lead_ids[1]] += 1
+            counts['lead_pairs'][b, lead_ids[1], lead_ids[0]] += 1
+
+        if move_pairs:
+            pair_species, pair_moves = np.array(sorted(move_pairs), dtype=np.int64).T
+            counts['species_moves'][b, pair_species, pair_moves] += 1
+            counts['move_usage'][b, np.unique(pair_moves)] += 1
+
+    def add_replay(self, processor):
+
+        self.battles += 1
+        for player, team in replay_teams(processor):
+            self.add_team(**team)
+
+        return self
+
+    def merge(self, other):
+
+        if other.rating_edges != self.rating_edges:
+            raise ValueError("Can't merge usage stats with different rating buckets")
+
+        # Ids are unique within each table, so the maps never repeat an index
+        # and plain fancy-indexed += is safe
+        maps = {
+            's': np.array([self.species.intern(name) for name in other.species.strings], dtype=np.int64),
+            'm': np.array([self.moves.intern(move) for move in other.moves.strings], dtype=np.int64)
+        }
+        self._reserve(len(self.species), len(self.moves))
+
+        buckets = np.arange(self.num_buckets)
+        for name, axes in COUNT_ARRAYS.items():
+            index = np.ix_(buckets, *[maps[axis] for axis in axes])
+            self.counts[name][index] += other.get_counts(name)
+
+        self.battles += other.battles
+        self.teams += other.teams
+        self.team_wins += other.team_wins
+
+        return self
+
+    # Queries. bucket is a rating bucket index (see bucket and bucket_names),
+    # or None for all of them together.
+
+    def _select(self, array, bucket):
+        return array.sum(axis=0) if bucket is None else array[bucket]
+
+    def _top(self, counts, names, n, totals=None):
+
+        # [(name, count, share)] for the n largest nonzero counts, share being
+        # count / totals (per entry, or one total). names is a sequence or a
+        # function of the index.
+        n = min(n, int(np.count_nonzero(counts)))
+        if n <= 0:
+            return []
+
+        best = np.argpartition(-counts, n - 1)[:n]
+        best = best[np.argsort(-counts[best], kind='stable')]
+
+        name_of = names if callable(names) else names.__getitem__
+        totals = np.broadcast_to(totals if totals is not None else 0, counts.shape)
+
+        return [(name_of(idx), int(counts[idx]), float(counts[idx] / totals[idx]) if totals[idx] else 0.0)
+                for idx in best]
+
+    def _species_id(self, species):
+
+        species_id = self.species.get_id(species)
+        if species_id is None:
+            raise KeyError(f"No usage recorded for {species}")
+
+        return species_id
+
+    def num_teams(self, bucket=None):
+        return int(self._select(self.teams, bucket))
+
+    def top_species(self, n=10, bucket=None):
+        counts = self._select(self.get_counts('species_usage'), bucket)
+        return self._top(counts, self.species.strings, n, self.num_teams(bucket))
+
+    def top_moves(self, n=10, species=None, bucket=None):
+
+        # Moves by the share of teams using them, or of teams with species
+        # whose species used them
+        if species is None:
+            counts = self._select(self.get_counts('move_usage'), bucket)
+            return self._top(counts, self.moves.strings, n, self.num_teams(bucket))
+
+        species_id = self._species_id(species)
+        counts = self._select(self.get_counts('species_moves')[:, species_id], bucket)
+        total = self._select(self.get_counts('species_usage')[:, species_id], bucket)
+
+        return self._top(counts, self.moves.strings, n, total)
+
+    def teammates_of(self, species, n=10, bucket=None):
+
+        # Species most often on the same team, with the share of species'
+        # teams they're on
+        species_id = self._species_id(species)
+        counts = self._select(self.get_counts('teammates')[:, species_id], bucket)
+        total = self._select(self.get_counts('species_usage')[:, species_id], bucket)
+
+        return self._top(counts, self.species.strings, n, total)
+
+    def top_leads(self, n=10, bucket=None):
+        counts = self._select(self.get_counts('leads'), bucket)
+        return self._top(counts, self.species.strings, n, self.num_teams(bucket))
+
+    def top_lead_pairs(self, n=10, bucket=None):
+
+        # [((species, species), count, share of teams)], each pair once
+        counts = np.triu(self._select(self.get_counts('lead_pairs'), bucket))
+        num_species = counts.shape[0]
+
+        def pair_name(idx):
+            return self.species[idx // num_species], self.species[idx % num_species]
+
+        return self._top(counts.reshape(-1), pair_name, n, self.num_teams(bucket))
+
+    def win_rate(self, species, bucket=None):
+
+        species_id = self._species_id(species)
+        used = self._select(self.get_counts('species_usage')[:, species_id], bucket)
+        won = self._select(self.get_counts('species_wins')[:, species_id], bucket)
+
+        return float(won / used) if used else 0.0
+
+    def usage_by_bucket(self, species):
+
+        # [(bucket name, teams with species, share of the bucket's teams)]
+        species_id = self._species_id(species)
+        used = self.get_counts('species_usage')[:, species_id]
+
+        return [(name, int(count), float(count / teams) if teams else 0.0)
+                for name, count, teams in zip(self.bucket_names(), used, self.teams)]
+
+    def save(self, path):
+
+        # Uncompressed .npz, written to a temporary file and renamed
+        arrays = {name: self.get_counts(name) for name in COUNT_ARRAYS}
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(
+                f,
+                rating_edges=np.array(self.rating_edges, dtype=np.int64),
+                species=np.array(self.species.strings, dtype=str),
+                moves=np.array(self.moves.strings, dtype=str),
+                battles=np.array(self.battles, dtype=np.int64),
+                teams=self.teams,
+                team_wins=self.team_wins,
+                **arrays
+            )
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+
+        with np.load(path) as data:
+            stats = cls(tuple(int(edge) for edge in data['rating_edges']))
+            stats.species = StringTable(str(name) for name in data['species'])
+            stats.moves = StringTable(str(move) for move in data['moves'])
+            stats._reserve(len(stats.species), len(stats.moves))
+
+            stats.battles = int(data['battles'])
+            stats.teams[:] = data['teams']
+            stats.team_wins[:] = data['team_wins']
+            for name in COUNT_ARRAYS:
+                stats.counts[name][(slice(None),) + tuple(slice(0, size) for size in data[name].shape[1:])] = data[name]
+
+        return stats
+
+def _resolve_preview_species(team, switched):
+
+    # Team preview hides some formes ("Urshifu-*"); use the forme that was
+    # switched in where there is one
+    resolved = []
+    for name in team:
+        if name.endswith('-*'):
+            base = name[:-2]
+            name = next((species for species in switched if species == base or species.startswith(base + '-')), name)
+        resolved.append(name)
+
+    return resolved
+
+def replay_teams(processor):
+
+    # (player, add_team arguments) for both sides of a replay
+    # Nicknames to species, and the species each side switched in, in order
+    # (those only ever dragged in come after the rest)
+    species_of = {}
+    switched = {}
+    for command in processor.get_commands_of_type(SwitchMessage) + processor.get_commands_of_type(DragMessage):
+        key = (command.player, command.name)
+        if key not in species_of:
+            species_of[key] = parse_details(command.details)[0]
+            switched.setdefault(command.player, []).append(species_of[key])
+
+    # Leads are whoever is switched in before the first turn
+    leads = {}
+    try:
+        initial_state = processor.get_battle_initial_state()
+    except IndexError:
+        initial_state = ()
+    for command in (initial_state.get_commands_of_type(SwitchMessage) if initial_state else ()):
+        leads.setdefault(command.player, []).append(species_of.get((command.player, command.name), command.name))
+
+    moves = {}
+    for command in processor.get_commands_of_type(MoveMessage):
+        # Moves called by other moves or abilities weren't chosen
+        if command.frm is not None:
+            continue
+        species = species_of.get((command.player, command.name), command.name)
+        moves.setdefault(command.player, {}).setdefault(species, set()).add(command.move)
+
+    wins = processor.get_commands_of_type(WinMessage)
+    winner = wins[0].user if wins else None
+
+    teams = []
+    for player, info in processor.players.items():
+        team = list(processor.pokemon.get(player, {})) or switched.get(player, [])
+        teams.append((player, {
+            'rating': _to_int(info['rating']),
+            'species': _resolve_preview_species(team, switched.get(player, [])),
+            'won': winner is not None and info['username'] == winner,
+            'leads': leads.get(player, []),
+            'moves': moves.get(player, {})
+        }))
+
+    return teams
+
+def replay_usage(processor, rating_edges=RATING_EDGES):
+
+    # Usage stats of one replay, to merge into the totals. Module level, so
+    # it can run in ingest_corpus workers.
+    return UsageStats(rating_edges).add_replay(processor)
+
+def aggregate_usage(source, workers=None, chunksize=8, usage=None, stats=None, seen=None):
+
+    # Counts usage over a corpus in worker processes and merges the partial
+    # results into usage, a UsageStats to add to (a new one by default)
+    if usage is None:
+        usage = UsageStats()
+
+    process = partial(replay_usage, rating_edges=usage.rating_edges)
+    for result in ingest_corpus(source, workers, chunksize, ordered=False, process=process, stats=stats, seen=seen):
+        if result.ok:
+            usage.merge(result.output)
+
+    return usage
+
+def _print_rows(title, rows):
+
+    print(title)
+    for name, count, share in rows:
+        if isinstance(name, tuple):
+            name = ' + '.join(name)
+        print(f"  {name:<32} {count:8d} {share:7.1%}")
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Count species, move and lead usage over a corpus of replays")
+    parser.add_argument('source', help="replay file, archive, directory or glob pattern (see sources)")
+    parser.add_argument('--stats', default=None, help=".npz file of stats to add to, updated in place; battles "
+                        "already counted in it (kept in <stats>.seen) are skipped")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: cpu count)")
+    parser.add_argument('--top', type=int, default=10, help="rows per table")
+    parser.add_argument('--species', default=None, help="also show the moves and teammates of this species")
+    parser.add_argument('--bucket', type=int, default=None, help="only this rating bucket (0 is unrated)")
+    args = parser.parse_args()
+
+    usage = None
+    seen = None
+    if args.stats is not None:
+        # The battles already in the stats file, so rerunning over the same
+        # replays doesn't count them twice
+        if os.path.exists(args.stats):
+            usage = UsageStats.load(args.stats)
+        elif os.path.exists(args.stats + '.seen'):
+            os.unlink(args.stats + '.seen')
+        seen = SeenSet(args.stats + '.seen')
+
+    ingest_stats = IngestStats()
+    try:
+        usage = aggregate_usage(args.source, args.workers, usage=usage, stats=ingest_stats, seen=seen)
+        if args.stats is not None:
+            usage.save(args.stats)
+    finally:
+        if seen is not None:
+            seen.close()
+    print(ingest_stats.summary())
+
+    print(f"{usage.battles} battles, {usage.num_teams(args.bucket)} teams")
+    _print_rows("Species", usage.top_species(args.top, args.bucket))
+    _print_rows("Leads", usage.top_leads(args.top, args.bucket))
+    _print_rows("Lead pairs", usage.top_lead_pairs(args.top, args.bucket))
+    _print_rows("Moves", usage.top_moves(args.top, bucket=args.bucket))
+
+    if args.species is not None:
+        _print_rows(f"Moves of {args.species}", usage.top_moves(args.top, args.species, args.bucket))
+        _print_rows(f"Teammates of {args.species}", usage.teammates_of(args.species, args.top, args.bucket))
+        print(f"Win rate of {args.species}: {usage.win_rate(args.species, args.bucket):.1%}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import numpy as np
+from src.replay_management.actions import ACTION_WIDTH, MOVE, SWITCH, JointActionEnumerator
+from src.replay_management.battle_state import BattleState
+from src.replay_management.move_data import move_table
+from src.replay_management.showdown_protocol import iter_replay_commands
+
+BATTLE = '''|poke|p1|Incineroar, L50, M|
+|poke|p1|Regieleki, L50|
+|poke|p1|Rillaboom, L50, F|
+|poke|p1|Urshifu-*, L50, F|
+|poke|p2|Amoonguss, L50, F|
+|poke|p2|Tornadus, L50, M|
+|switch|p1a: Incin|Incineroar, L50, M|100/100
+|switch|p1b: Regieleki|Regieleki, L50|100/100
+|switch|p2a: Amoonguss|Amoonguss, L50, F|100/100
+|switch|p2b: Tornadus|Tornadus, L50, M|100/100
+|turn|1
+|move|p1a: Incin|Fake Out|p2a: Amoonguss
+|-damage|p2a: Amoonguss|50/100
+|move|p1a: Incin|Flare Blitz|p2b: Tornadus
+|move|p1b: Regieleki|Not A Real Move|p2b: Tornadus
+|turn|2'''
+
+def _state():
+
+    state = BattleState()
+    for command in iter_replay_commands(BATTLE.split('\n')):
+        state.apply(command)
+    return state.snapshot()
+
+def test_enumerates_every_joint_action():
+
+    state = _state()
+    enumerator = JointActionEnumerator()
+    unknown = dict(move_table.unknown)
+
+    actions = enumerator.enumerate(state, 'p1')
+
+    # Incineroar: 2 moves at 3 targets or 2 switches. Regieleki: its move
+    # at 3 targets or 2 switches. Less both slots switching to one Pokemon.
+    assert actions.shape == (8 * 5 - 2, 2 * ACTION_WIDTH)
+    assert len({row.tobytes() for row in actions}) == len(actions)
+    switches = actions[(actions[:, 0] == SWITCH) & (actions[:, ACTION_WIDTH] == SWITCH)]
+    assert len(switches) == 2 and (switches[:, 3] != switches[:, ACTION_WIDTH + 3]).all()
+
+    assert enumerator.enumerate(state, 'p1') is actions
+    # Nothing to switch to, and no moves seen: one unknown move at 3 targets
+    assert len(enumerator.enumerate(state, 'p2')) == 3 * 3
+    # Enumerating doesn't count the unresolved move as a replay miss
+    assert dict(move_table.unknown) == unknown
+
+def test_top_k_is_best_first():
+
+    state = _state()
+    enumerator = JointActionEnumerator()
+    actions, scores = enumerator.score(state, 'p1')
+
+    best, best_scores = enumerator.top_k(state, 'p1', k=5)
+    assert best.shape == (5, 2 * ACTION_WIDTH)
+    assert best_scores.tolist() == sorted(scores.tolist(), reverse=True)[:5]
+    # Both slots attacking the weakened Amoonguss score highest
+    assert (best[:2, [0, ACTION_WIDTH]] == MOVE).all() and (best[:2, [2, ACTION_WIDTH + 2]] == 1).all()
+    assert {enumerator.describe(state, 'p1', row) for row in best[:2]} == {'move 1 1, move 1 1', 'move 2 1, move 1 1'}
+    assert best_scores[1] > best_scores[2]
+
+    all_actions, all_scores = enumerator.top_k(state, 'p1', k=len(actions) + 10)
+    assert len(all_actions) == len(actions)
+    assert (np.diff(all_scores) <= 0).all()
@@ -0,0 +1,50 @@
+import glob
+import pytest
+from src.replay_management.battle_log import ColumnarBattleLog, parse_position
+from src.replay_management.process_replay import iter_battle_lines, parse_replay, parse_replay_file
+from src.replay_management.symbols import StringTable
+
+REPLAY_FILES = sorted(glob.glob('replays/*.html'))
+
+def _describe(commands):
+    return [(type(command), command.__getstate__()) for command in commands]
+
+def test_parse_position():
+
+    assert parse_position('p1a: Groudon') == (1, 0)
+    assert parse_position('p2b') == (2, 1)
+    assert parse_position('p2') == (2, -1)
+    assert parse_position('Groudon') == (-1, -1)
+
+@pytest.mark.parametrize('replay_file', REPLAY_FILES)
+def test_matches_parsed_commands(replay_file):
+
+    battle_log = ColumnarBattleLog.from_lines(iter_battle_lines(parse_replay_file(replay_file)))
+    commands = parse_replay(replay_file)
+
+    assert len(battle_log) == len(commands)
+    assert _describe(battle_log) == _describe(commands)
+    assert _describe(battle_log[-3:]) == _describe(commands[-3:])
+    assert [type(command) for command in commands] == list(battle_log.command_types())
+
+@pytest.mark.parametrize('replay_file', REPLAY_FILES)
+def test_binary_round_trip(replay_file):
+
+    # Built against a shared table holding other strings, stored compactly
+    shared = StringTable(['unrelated', 'strings'])
+    battle_log = ColumnarBattleLog.from_lines(iter_battle_lines(parse_replay_file(replay_file)), shared)
+    data = battle_log.to_bytes()
+    loaded = ColumnarBattleLog.from_buffer(bytearray(data))
+
+    assert 'unrelated' not in loaded.strings
+    assert len(loaded) == len(battle_log)
+    assert _describe(loaded) == _describe(battle_log)
+    assert loaded.to_bytes() == data
+
+def test_rejects_other_data():
+
+    data = bytearray(ColumnarBattleLog.from_lines(['|turn|1']).to_bytes())
+    data[:4] = b'XXXX'
+
+    with pytest.raises(ValueError):
+        ColumnarBattleLog.from_buffer(data)
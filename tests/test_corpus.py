@@ -0,0 +1,65 @@
+import glob
+import shutil
+import pytest
+from src.replay_management.corpus import IngestStats, ingest_corpus, ingest_replay
+from src.replay_management.dedup import SeenSet, fingerprint_battle_log
+from src.replay_management.process_replay import parse_replay_file
+
+REPLAY_FILES = sorted(glob.glob('replays/*.html'))
+
+@pytest.fixture
+def corpus(tmp_path):
+
+    # Every replay twice, under different names
+    for copy in range(2):
+        for idx, replay_file in enumerate(REPLAY_FILES):
+            shutil.copy(replay_file, tmp_path / f'{copy}-{idx}.html')
+
+    return str(tmp_path / '*.html')
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_ingest_skips_duplicates(corpus, workers):
+
+    seen = SeenSet()
+    stats = IngestStats()
+    results = list(ingest_corpus(corpus, workers, chunksize=1, stats=stats, seen=seen))
+
+    assert [result.ok for result in results] == [True] * len(REPLAY_FILES)
+    assert len({result.fingerprint for result in results}) == len(REPLAY_FILES)
+    assert (stats.replays, stats.duplicates) == (len(REPLAY_FILES), len(REPLAY_FILES))
+    assert len(seen) == len(REPLAY_FILES)
+
+    # Everything is in seen now, so a second run ingests nothing
+    stats = IngestStats()
+    assert list(ingest_corpus(corpus, workers, stats=stats, seen=seen)) == []
+    assert stats.duplicates == 2 * len(REPLAY_FILES)
+
+def test_ingest_without_seen_keeps_copies(corpus):
+
+    results = list(ingest_corpus(corpus, 1))
+
+    assert len(results) == 2 * len(REPLAY_FILES)
+    assert all(result.fingerprint is None for result in results)
+
+def test_seen_battles_are_not_tokenized():
+
+    seen = SeenSet()
+    seen.add(fingerprint_battle_log(parse_replay_file(REPLAY_FILES[0])), 'first.html')
+
+    result = ingest_replay(REPLAY_FILES[0], fingerprint=True, seen=seen)
+    assert result.duplicate and result.ok and result.output is None
+    assert not result.counters.commands
+
+    result = ingest_replay(REPLAY_FILES[0], fingerprint=True, seen=SeenSet())
+    assert not result.duplicate and result.counters.commands
+
+def test_pool_workers_read_seen_file(corpus, tmp_path):
+
+    seen_file = str(tmp_path / 'seen.db')
+    with SeenSet(seen_file) as seen:
+        assert len(list(ingest_corpus(corpus, 2, chunksize=1, seen=seen))) == len(REPLAY_FILES)
+
+    with SeenSet(seen_file) as seen:
+        stats = IngestStats()
+        assert list(ingest_corpus(corpus, 2, chunksize=1, stats=stats, seen=seen)) == []
+        assert (stats.replays, stats.duplicates, stats.lines) == (0, 2 * len(REPLAY_FILES), 0)
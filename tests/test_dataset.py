@@ -0,0 +1,66 @@
+import glob
+import numpy as np
+from src.replay_management.dataset import DatasetReader, DatasetWriter, replay_samples
+from src.replay_management.process_replay import ReplayProcessor, iter_battle_lines, parse_replay, parse_replay_file
+from src.replay_management.showdown_protocol import ParseCounters, TurnMessage, iter_replay_commands
+
+REPLAY_FILES = sorted(glob.glob('replays/*.html'))
+
+def _unfinished_processor(replay_file):
+
+    battle_text = '\n'.join(line for line in parse_replay_file(replay_file).split('\n')
+                            if not line.startswith(('|win|', '|tie')))
+
+    return ReplayProcessor(list(iter_replay_commands(iter_battle_lines(battle_text), ParseCounters())))
+
+def test_finished_battle_has_a_sample_per_turn():
+
+    processor = ReplayProcessor(parse_replay(REPLAY_FILES[0]))
+    states, actions, winner = replay_samples(processor)
+
+    assert len(states) == len(actions) == processor.count_commands_of_type(TurnMessage)
+    assert winner in (0, 1)
+
+def test_unfinished_battle_samples_have_actions():
+
+    processor = _unfinished_processor(REPLAY_FILES[0])
+    finished_states, finished_actions, _ = replay_samples(ReplayProcessor(parse_replay(REPLAY_FILES[0])))
+    states, actions, winner = replay_samples(processor)
+
+    # The open last turn has no sample; the others match the finished battle
+    assert len(states) == len(actions) == processor.count_commands_of_type(TurnMessage) - 1
+    assert np.array_equal(actions, finished_actions[:len(actions)])
+    assert winner == -1
+
+def test_shards_round_trip(tmp_path):
+
+    samples = [(replay_file, *replay_samples(ReplayProcessor(parse_replay(replay_file)))) for replay_file in REPLAY_FILES]
+    total = sum(len(states) for _, states, _, _ in samples)
+
+    with DatasetWriter(str(tmp_path), shard_size=3, writer_id='a') as writer:
+        for replay_file, states, actions, winner in samples:
+            writer.add_replay(replay_file, states, actions, winner)
+
+    reader = DatasetReader(str(tmp_path))
+    assert len(reader) == writer.num_rows == total
+    assert len(reader.shards) == writer.num_shards == -(-total // 3)
+
+    rows = reader.get_slice(0, len(reader))
+    assert np.array_equal(rows['actions'], np.concatenate([actions for _, _, actions, _ in samples]))
+    assert np.array_equal(rows['turn'], [state.turn for _, states, _, _ in samples for state in states])
+    assert reader.get_replay(len(reader) - 1) == REPLAY_FILES[-1]
+
+    shuffled = np.concatenate([batch['turn'] for batch in reader.iter_batches(4, ['turn'], shuffle=True, seed=0)])
+    assert sorted(shuffled) == sorted(rows['turn'])
+
+def test_writers_keep_their_own_symbols(tmp_path):
+
+    states, actions, winner = replay_samples(ReplayProcessor(parse_replay(REPLAY_FILES[0])))
+
+    for writer_id in ('a', 'b'):
+        with DatasetWriter(str(tmp_path), writer_id=writer_id) as writer:
+            writer.add_replay(REPLAY_FILES[0], states, actions, winner)
+
+    reader = DatasetReader(str(tmp_path))
+    assert [shard['symbols'] for shard in reader.shards] == ['a.symbols.json', 'b.symbols.json']
+    assert reader.get_symbols(0).size('species') > 0
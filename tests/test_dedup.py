@@ -0,0 +1,41 @@
+import glob
+import os
+from src.replay_management.dedup import BloomFilter, SeenSet, fingerprint_battle_log
+from src.replay_management.process_replay import parse_replay_file
+
+REPLAY_FILES = sorted(glob.glob('replays/*.html'))
+
+def test_fingerprint_ignores_room_noise():
+
+    battle_text = parse_replay_file(REPLAY_FILES[0])
+    noisy = '|j|☆someone\n' + battle_text.replace('\n|turn|2', '\n|c|☆someone|gg\n  |turn|2  ')
+
+    assert fingerprint_battle_log(noisy) == fingerprint_battle_log(battle_text)
+    assert len({fingerprint_battle_log(parse_replay_file(replay_file)) for replay_file in REPLAY_FILES}) == \
+        len(REPLAY_FILES)
+
+def test_bloom_filter_has_no_false_negatives():
+
+    bloom = BloomFilter(1000, 0.01)
+    added = [os.urandom(16) for _ in range(1000)]
+    for fingerprint in added:
+        bloom.add(fingerprint)
+
+    assert all(fingerprint in bloom for fingerprint in added)
+    assert sum(os.urandom(16) in bloom for _ in range(10000)) < 500
+
+def test_seen_set_persists_and_grows(tmp_path):
+
+    seen_file = str(tmp_path / 'seen.db')
+    fingerprints = [os.urandom(16) for _ in range(50)]
+
+    with SeenSet(seen_file, capacity=10) as seen:
+        for idx, fingerprint in enumerate(fingerprints):
+            seen.add(fingerprint, f'{idx}.html')
+        # The filter was rebuilt bigger instead of filling up
+        assert seen.bloom.capacity >= 50
+
+    with SeenSet(seen_file) as seen:
+        assert len(seen) == 50
+        assert seen.get(fingerprints[3]) == '3.html'
+        assert os.urandom(16) not in seen
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+from src.replay_management.battle_state import BattleState
+from src.replay_management.features import MISSING, StateEncoder
+from src.replay_management.move_data import get_move_index
+from src.replay_management.showdown_protocol import iter_replay_commands
+from src.replay_management.symbols import symbol_table
+
+TURN_1 = '''|poke|p1|Incineroar, L50, M|
+|poke|p1|Regieleki, L50|
+|poke|p2|Rillaboom, L50, F|
+|switch|p1a: Incin|Incineroar, L50, M|100/100
+|switch|p2a: Rilla|Rillaboom, L50, F|100/100
+|-weather|RainDance
+|turn|1'''
+
+TURN_2 = '''|move|p1a: Incin|Fake Out|p2a: Rilla
+|-damage|p2a: Rilla|60/100
+|-boost|p1a: Incin|atk|1
+|-status|p2a: Rilla|brn
+|-sidestart|p2: someone|move: Tailwind
+|turn|2'''
+
+def _apply(state, lines):
+    for command in iter_replay_commands(lines.split('\n')):
+        state.apply(command)
+    return state
+
+def test_snapshots_are_isolated_copy_on_write():
+
+    state = _apply(BattleState(), TURN_1)
+    first = state.snapshot()
+    incineroar = first.pokemon['p1', 'Incin']
+
+    _apply(state, TURN_2)
+    second = state.snapshot()
+    _apply(state, '|-damage|p2a: Rilla|10/100\n|-clearallboost')
+
+    # The earlier snapshots kept what they had
+    assert first.turn == 1 and second.turn == 2
+    assert first.pokemon['p2', 'Rilla'].hp == 100 and first.pokemon['p2', 'Rilla'].status is None
+    assert first.pokemon['p1', 'Incin'].boosts == {} and first.pokemon['p1', 'Incin'].moves == ()
+    assert first.sides['p2'].conditions == {}
+    assert second.pokemon['p2', 'Rilla'].hp == 60 and second.pokemon['p2', 'Rilla'].status == 'brn'
+    assert second.pokemon['p1', 'Incin'].boosts == {'atk': 1}
+    assert second.sides['p2'].conditions == {'Tailwind': 1}
+    assert state.pokemon['p2', 'Rilla'].hp == 10 and state.pokemon['p1', 'Incin'].boosts == {}
+
+    # Records were only copied once they changed
+    assert incineroar is not second.pokemon['p1', 'Incin']
+    assert first.sides['p1'] is second.sides['p1']
+
+def test_encoder_writes_known_state():
+
+    state = _apply(_apply(BattleState(), TURN_1), TURN_2).snapshot()
+    encoder = StateEncoder()
+    floats, ints = encoder.encode([state, state], start=1)
+
+    assert floats.shape == (3, encoder.num_floats) and floats.dtype == np.float32
+    assert ints.shape == (3, encoder.num_ints) and ints.dtype == np.int32
+    assert not floats[0].any() and (ints[0] == MISSING).all()
+    assert np.array_equal(floats[1], floats[2]) and np.array_equal(ints[1], ints[2])
+
+    written = {name: float(value) for name, value in zip(encoder.float_names, floats[1]) if value}
+    assert written == {
+        'turn': 2.0,
+        'weather:RainDance': 1.0,
+        'p2:side:Tailwind': 1.0,
+        'p1:active0:present': 1.0, 'p1:active0:hp': 1.0, 'p1:active0:boost:atk': pytest.approx(1 / 6),
+        'p2:active0:present': 1.0, 'p2:active0:hp': pytest.approx(0.6), 'p2:active0:status:brn': 1.0,
+        'p1:team0:present': 1.0, 'p1:team0:hp': 1.0, 'p1:team0:active': 1.0,
+        'p1:team1:present': 1.0, 'p1:team1:hp': 1.0,
+        'p2:team0:present': 1.0, 'p2:team0:hp': pytest.approx(0.6), 'p2:team0:active': 1.0
+    }
+
+    written = {name: int(value) for name, value in zip(encoder.int_names, ints[1]) if value != MISSING}
+    assert written == {
+        'p1:active0:species': symbol_table.intern('species', 'Incineroar'),
+        'p1:active0:move0': get_move_index('Fake Out'),
+        'p2:active0:species': symbol_table.intern('species', 'Rillaboom'),
+        'p1:team0:species': symbol_table.intern('species', 'Incineroar'),
+        'p1:team1:species': symbol_table.intern('species', 'Regieleki'),
+        'p2:team0:species': symbol_table.intern('species', 'Rillaboom')
+    }
+
+def test_encoder_rejects_non_contiguous_arrays():
+
+    encoder = StateEncoder()
+    floats, ints = encoder.allocate(4)
+    state = _apply(BattleState(), TURN_1)
+
+    with pytest.raises(ValueError):
+        encoder.encode([state], floats[::2], ints[::2])
+
+def test_team_layout_cache_is_bounded():
+
+    encoder = StateEncoder(max_team_layouts=2)
+    for species in ('A', 'B', 'C', 'A'):
+        encoder._team_layout('p1', (species,))
+
+    assert list(encoder._team_layouts) == [('p1', ('C',)), ('p1', ('A',))]
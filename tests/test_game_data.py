@@ -0,0 +1,63 @@
+import json
+import numpy as np
+import pytest
+from src.replay_management.game_data import MISSING, GameData, build_game_data, type_ids
+from src.replay_management.move_data import get_move_index, move_table
+
+MOVES = {
+    'flamethrower': {'name': 'Flamethrower', 'type': 'Fire', 'category': 'Special', 'basePower': 90,
+                     'accuracy': 100, 'pp': 15},
+    'aerialace': {'name': 'Aerial Ace', 'type': 'Flying', 'category': 'Physical', 'basePower': 60,
+                  'accuracy': True, 'pp': 20},
+    'notarealmove': {'name': 'Not A Real Move', 'type': 'Normal', 'basePower': 1}
+}
+
+POKEDEX = {
+    'charizard': {'name': 'Charizard', 'types': ['Fire', 'Flying'], 'baseStats': {'hp': 78, 'atk': 84, 'def': 78,
+                                                                                   'spa': 109, 'spd': 85, 'spe': 100}},
+    'blastoise': {'name': 'Blastoise', 'types': ['Water'], 'baseStats': {'hp': 79, 'atk': 83, 'def': 100,
+                                                                         'spa': 85, 'spd': 105, 'spe': 78}},
+    'garchomp': {'name': 'Garchomp', 'types': ['Dragon', 'Ground']}
+}
+
+@pytest.fixture
+def game_data(tmp_path):
+
+    (tmp_path / 'moves.json').write_text(json.dumps(MOVES))
+    (tmp_path / 'pokedex.json').write_text(json.dumps(POKEDEX))
+
+    unknown = dict(move_table.unknown)
+    assert build_game_data(str(tmp_path / 'moves.json'), str(tmp_path / 'pokedex.json'),
+                           str(tmp_path / 'game_data.bin')) == (2, 3)
+    # Compiling isn't a replay occurrence of the unknown move
+    assert dict(move_table.unknown) == unknown
+
+    return GameData.load(str(tmp_path / 'game_data.bin'))
+
+def test_known_matchups(game_data):
+
+    species = game_data.species_indices(['Charizard', 'Blastoise', 'Garchomp', 'Missingno'])
+    defenders = game_data.species_types[species]
+    attacks = np.array([type_ids[name] for name in ('Water', 'Electric', 'Ground', 'Ice', 'Fire')] + [MISSING])
+
+    assert game_data.effectiveness(attacks[:, None], defenders[None]).tolist() == [
+        # Charizard, Blastoise, Garchomp, unknown species
+        [2, 0.5, 1, 1],     # Water
+        [2, 2, 0, 1],       # Electric
+        [0, 1, 1, 1],       # Ground
+        [1, 0.5, 4, 1],     # Ice
+        [0.5, 0.5, 0.5, 1], # Fire
+        [1, 1, 1, 1]        # typeless
+    ]
+
+def test_move_and_species_tables(game_data):
+
+    flamethrower, aerial_ace = get_move_index('Flamethrower'), get_move_index('Aerial Ace')
+    power, accuracy, move_type = game_data.move_attributes([flamethrower, aerial_ace, MISSING],
+                                                           'power', 'accuracy', 'type')
+
+    assert power.tolist() == [90, 60, MISSING]
+    assert accuracy.tolist() == [100, 0, MISSING]
+    assert move_type.tolist() == [type_ids['Fire'], type_ids['Flying'], MISSING]
+    assert game_data.species_stats[game_data.species_index('charizard')].tolist() == [78, 84, 78, 109, 85, 100]
+    assert game_data.species_stats[game_data.species_index('Garchomp')].tolist() == [MISSING] * 6
@@ -0,0 +1,60 @@
+import asyncio
+import glob
+from src.replay_management.live import BattleMultiplexer, split_replay_into_chunks
+from src.replay_management.process_replay import parse_replay_file
+from src.replay_management.showdown_protocol import TurnMessage
+
+REPLAY_FILE = sorted(glob.glob('replays/*.html'))[0]
+
+def _feed(multiplexer, chunks):
+
+    async def feed():
+        for chunk in chunks:
+            await multiplexer.feed_chunk(chunk)
+        await multiplexer.close()
+
+    asyncio.run(asyncio.wait_for(feed(), timeout=10))
+
+def _replay_chunks(room_id):
+    return [f">{room_id}\n{chunk}" for _, chunk in split_replay_into_chunks(parse_replay_file(REPLAY_FILE))]
+
+def test_bad_line_does_not_stop_battle():
+
+    turns = []
+    finished = []
+    multiplexer = BattleMultiplexer(buffer_size=4, on_turn=lambda battle, state: turns.append(state),
+                                    on_finish=finished.append)
+
+    chunks = _replay_chunks('battle-test-1')
+    chunks.insert(1, ">battle-test-1\n|swap|p1a: Groudon|1")
+    _feed(multiplexer, chunks)
+
+    stats = multiplexer.get_stats()
+    assert stats['errors'] == 1
+    assert stats['finished'] == 1
+    assert finished[0].num_errors == 1
+    assert finished[0].finished
+    assert len(turns) == finished[0].processor.count_commands_of_type(TurnMessage)
+
+def test_on_turn_error_is_counted():
+
+    def on_turn(battle, state):
+        raise RuntimeError("callback failed")
+
+    multiplexer = BattleMultiplexer(buffer_size=2, on_turn=on_turn)
+    _feed(multiplexer, _replay_chunks('battle-test-2'))
+
+    stats = multiplexer.get_stats()
+    assert stats['finished'] == 1
+    assert stats['errors'] > 0
+
+def test_lines_after_deinit_are_dropped():
+
+    multiplexer = BattleMultiplexer(buffer_size=2)
+    chunks = _replay_chunks('battle-test-3')
+    chunks.append(">battle-test-3\n|deinit|")
+    chunks.extend(_replay_chunks('battle-test-3'))
+    _feed(multiplexer, chunks)
+
+    assert multiplexer.get_stats()['finished'] >= 1
+    assert not multiplexer.battles
@@ -0,0 +1,62 @@
+import glob
+import os
+import shutil
+import zipfile
+from src.replay_management.manifest import ERROR, OK, CorpusManifest
+
+REPLAY_FILES = sorted(glob.glob('replays/*.html'))
+
+def test_sync_only_processes_changes(tmp_path):
+
+    corpus = tmp_path / 'corpus'
+    corpus.mkdir()
+    for idx, replay_file in enumerate(REPLAY_FILES):
+        shutil.copy(replay_file, corpus / f'{idx}.html')
+    with zipfile.ZipFile(corpus / 'bundle.zip', 'w') as archive:
+        archive.write(REPLAY_FILES[0], 'a.html')
+        archive.writestr('b.html', '<html>no battle log</html>')
+
+    with CorpusManifest(str(tmp_path / 'manifest.db')) as manifest:
+        counts = manifest.sync(str(corpus), workers=1)
+        assert (counts['processed'], counts['failed']) == (len(REPLAY_FILES) + 1, 1)
+        assert manifest.get(str(corpus / '0.html'))['status'] == OK
+        assert manifest.get(str(corpus / 'bundle.zip'))['status'] == ERROR
+
+        counts = manifest.sync(str(corpus), workers=1)
+        assert (counts['processed'], counts['touched'], counts['removed']) == (0, 0, 0)
+
+        # Same contents with a new mtime are only touched; new contents are processed
+        os.utime(corpus / '0.html', ns=(0, 0))
+        shutil.copy(REPLAY_FILES[0], corpus / f'{len(REPLAY_FILES) - 1}.html')
+        os.unlink(corpus / 'bundle.zip')
+        counts = manifest.sync(str(corpus), workers=1)
+        assert (counts['processed'], counts['touched'], counts['removed']) == (int(len(REPLAY_FILES) > 1), 1, 1)
+        assert len(manifest) == len(REPLAY_FILES)
+
+def test_commits_on_interval(tmp_path):
+
+    manifest_file = str(tmp_path / 'manifest.db')
+    shutil.copy(REPLAY_FILES[0], tmp_path / 'a.html')
+
+    manifest = CorpusManifest(manifest_file, commit_every=1000, commit_interval=0.0)
+    manifest.sync(str(tmp_path / 'a.html'), workers=1)
+    manifest.record(str(tmp_path / 'b.html'), os.stat(tmp_path / 'a.html'), 'hash')
+
+    # Committed without a flush, so another connection sees it
+    with CorpusManifest(manifest_file) as other:
+        assert other.get(str(tmp_path / 'b.html')) is not None
+
+    manifest.close()
+
+def test_watch_yields_each_sync(tmp_path):
+
+    shutil.copy(REPLAY_FILES[0], tmp_path / 'a.html')
+
+    with CorpusManifest(str(tmp_path / 'manifest.db')) as manifest:
+        processed = []
+        for counts in manifest.watch(str(tmp_path / '*.html'), interval=0.0, workers=1):
+            processed.append(counts['processed'])
+            if len(processed) == 2:
+                break
+
+    assert processed == [1, 0]
@@ -0,0 +1,29 @@
+from src.replay_management.move_data import UNKNOWN_MOVE, MoveTable, to_move_id
+
+def test_aliases_resolve_to_one_index():
+
+    move_table = MoveTable()
+    idx = move_table.get_index('fake-out')
+
+    assert move_table.get_slug(idx) == 'fake-out'
+    assert {move_table.get_index(name) for name in ('Fake Out', 'fakeout', 'FAKE OUT')} == {idx}
+    # Punctuation only resolves through the id
+    kings_shield = move_table.get_index("King's Shield")
+    assert kings_shield != UNKNOWN_MOVE and move_table.get_slug(kings_shield) == 'kings-shield'
+    assert to_move_id("King's Shield") == 'kingsshield'
+    assert move_table.get_index('Hidden Power Fire') == move_table.get_index('Hidden Power')
+    assert not move_table.unknown
+
+def test_unknown_moves_are_counted():
+
+    move_table = MoveTable()
+    assert move_table.get_index('Not A Real Move') == UNKNOWN_MOVE
+    assert move_table.get_index('Not A Real Move') == UNKNOWN_MOVE
+
+    indices = move_table.get_indices(['Protect', 'Made Up', 'Made Up', 'Protect'])
+    assert indices.tolist() == [move_table.get_index('Protect'), UNKNOWN_MOVE, UNKNOWN_MOVE,
+                                move_table.get_index('Protect')]
+
+    # find_index resolves the same way without counting
+    assert move_table.find_index('Made Up') == UNKNOWN_MOVE
+    assert move_table.unknown == {'Not A Real Move': 2, 'Made Up': 2}
@@ -0,0 +1,69 @@
+import glob
+import http.client
+import json
+import threading
+from src.replay_management.prediction import PredictionService, make_server
+from src.replay_management.process_replay import ReplayProcessor, parse_replay, parse_replay_file
+from src.replay_management.symbols import StringTable
+
+REPLAY_FILES = sorted(glob.glob('replays/*.html'))
+
+def _post(server, body):
+
+    connection = http.client.HTTPConnection(*server.server_address)
+    connection.request('POST', '/predict', json.dumps(body))
+    response = connection.getresponse()
+    result = response.status, json.loads(response.read())
+    connection.close()
+
+    return result
+
+def test_predict_endpoint():
+
+    battle_text = parse_replay_file(REPLAY_FILES[0])
+
+    with PredictionService(workers=2) as service:
+        server = make_server(service, 0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            status, body = _post(server, {'log': battle_text, 'turn': 1})
+            assert status == 200 and 0.0 <= body['prediction'] <= 1.0
+
+            assert _post(server, {'log': battle_text, 'turn': 0})[0] == 400
+            assert _post(server, {'turn': 1})[0] == 400
+
+            # Anything unexpected still gets a JSON error body
+            status, body = _post(server, {'log': battle_text + '\n|swap|p1a: Groudon|1'})
+            assert status == 500 and 'error' in body
+        finally:
+            server.shutdown()
+            server.server_close()
+
+def test_workers_agree_on_predictions():
+
+    states = list(ReplayProcessor(parse_replay(REPLAY_FILES[0])).iter_states())
+
+    with PredictionService(workers=1) as service:
+        expected = service.predict_many(states)
+    with PredictionService(workers=4, max_batch_size=2) as service:
+        assert service.predict_many(states * 4) == expected * 4
+
+def test_concurrent_intern_assigns_one_id_per_string():
+
+    table = StringTable()
+    values = [f'value{idx}' for idx in range(2000)]
+    results = []
+
+    def intern_all():
+        results.append([table.intern(value) for value in values])
+
+    threads = [threading.Thread(target=intern_all) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(table) == len(values)
+    assert all(ids == results[0] for ids in results)
+    assert [table[value_id] for value_id in results[0]] == values
@@ -0,0 +1,56 @@
+import glob
+import pytest
+from src.replay_management.process_replay import ReplayProcessor, parse_replay
+from src.replay_management.showdown_protocol import (MoveMessage, PokemonBasedMessage, ShowdownMessage,
+                                                    StartMessage, SwitchMessage, TurnMessage, WinMessage)
+
+REPLAY_FILES = sorted(glob.glob('replays/*.html'))
+
+def test_turn_view_repr_lists_commands():
+
+    initial_state = ReplayProcessor(parse_replay(REPLAY_FILES[0])).get_battle_initial_state()
+    text = repr(initial_state)
+
+    assert text.startswith(f'<TurnView of commands {initial_state.start}:{initial_state.stop} [')
+    assert text.count('Message object') == len(initial_state)
+    assert isinstance(initial_state[0], StartMessage)
+    assert initial_state.count_commands_of_type(SwitchMessage) > 0
+
+def test_state_at_turn_out_of_range():
+
+    processor = ReplayProcessor(parse_replay(REPLAY_FILES[0]))
+    num_turns = processor.count_commands_of_type(TurnMessage)
+
+    assert processor.get_state_at_turn(1).turn == 1
+    assert processor.get_state_at_turn(num_turns).turn == num_turns
+    for n in (0, -1, num_turns + 1):
+        with pytest.raises(IndexError):
+            processor.get_state_at_turn(n)
+
+@pytest.mark.parametrize('replay_file', REPLAY_FILES)
+def test_command_index_matches_scan(replay_file):
+
+    commands = parse_replay(replay_file)
+    processor = ReplayProcessor(commands)
+
+    for command_cls in (ShowdownMessage, PokemonBasedMessage, MoveMessage, SwitchMessage, TurnMessage, WinMessage):
+        expected = [command for command in commands if isinstance(command, command_cls)]
+        assert processor.get_commands_of_type(command_cls) == expected
+        assert processor.count_commands_of_type(command_cls) == len(expected)
+
+    turn_offsets = [idx for idx, command in enumerate(commands) if isinstance(command, TurnMessage)]
+    win_offset = next(idx for idx, command in enumerate(commands) if isinstance(command, WinMessage))
+    assert processor.get_turn_boundaries() == turn_offsets + [win_offset]
+
+    turns = processor.split_into_turns()
+    assert [list(turn) for turn in turns] == [commands[start:stop] for start, stop in
+                                              zip(turn_offsets, turn_offsets[1:] + [win_offset])]
+
+def test_streamed_processor_matches_list():
+
+    commands = parse_replay(REPLAY_FILES[0])
+    streamed = ReplayProcessor(iter(commands))
+
+    assert streamed.get_state_at_turn(2).turn == 2
+    assert [list(turn) for turn in streamed.iter_turns()] == [list(turn) for turn in
+                                                              ReplayProcessor(commands).iter_turns()]
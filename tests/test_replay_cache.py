@@ -0,0 +1,72 @@
+import glob
+import os
+import shutil
+from src.replay_management.replay_cache import PARSER_VERSION, VERSION_PREFIX, ReplayCache
+from src.replay_management.process_replay import parse_replay
+
+REPLAY_FILES = sorted(glob.glob('replays/*.html'))
+
+def _describe(commands):
+    return [(type(command), command.__getstate__()) for command in commands]
+
+def test_hits_and_shared_entries(tmp_path):
+
+    copy = str(tmp_path / 'copy.html')
+    shutil.copy(REPLAY_FILES[0], copy)
+    cache = ReplayCache(str(tmp_path / 'cache'))
+
+    battle_log = cache.parse(REPLAY_FILES[0])
+    assert cache.get_stats()['misses'] == 1
+    assert _describe(battle_log) == _describe(parse_replay(REPLAY_FILES[0]))
+
+    cache.parse(REPLAY_FILES[0])
+    assert cache.path_hits == 1
+
+    # A copy under another name shares the entry, found by its contents
+    cache.parse(copy)
+    assert (cache.hits, cache.path_hits, cache.misses) == (2, 1, 1)
+
+def test_only_removes_its_own_stale_versions(tmp_path):
+
+    stale = tmp_path / (VERSION_PREFIX + '0' * len(PARSER_VERSION))
+    unrelated = tmp_path / ('x' * len(PARSER_VERSION))
+    stale.mkdir()
+    unrelated.mkdir()
+
+    ReplayCache(str(tmp_path))
+
+    assert not stale.exists()
+    assert unrelated.exists()
+    assert (tmp_path / (VERSION_PREFIX + PARSER_VERSION)).is_dir()
+
+def test_eviction_prunes_path_records(tmp_path):
+
+    copies = []
+    for idx, replay_file in enumerate(REPLAY_FILES):
+        copies.append(str(tmp_path / f'{idx}.html'))
+        shutil.copy(replay_file, copies[-1])
+
+    cache = ReplayCache(str(tmp_path / 'cache'))
+    for replay_file in copies:
+        cache.parse(replay_file)
+    assert len(os.listdir(cache.path_dir)) == len(copies)
+
+    os.unlink(copies[0])
+    cache.max_bytes = 0
+    cache.evict()
+
+    assert cache.size == 0
+    assert os.listdir(cache.path_dir) == []
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+
+    cache = ReplayCache(str(tmp_path / 'cache'))
+    battle_log = cache.parse(REPLAY_FILES[0])
+    entry_path, = [entry.path for entry in os.scandir(cache.entry_dir)]
+    with open(entry_path, 'r+b') as f:
+        f.truncate(os.path.getsize(entry_path) // 2)
+
+    assert cache.parse(REPLAY_FILES[0]) is not None
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert _describe(cache.parse(REPLAY_FILES[0])) == _describe(battle_log)
+    assert cache.path_hits == 1
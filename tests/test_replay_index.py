@@ -0,0 +1,80 @@
+import glob
+import os
+import shutil
+import zipfile
+from src.replay_management.replay_index import ReplayIndex
+
+REPLAY_FILES = sorted(glob.glob('replays/*.html'))
+
+def test_update_reads_sources_and_drops_failures(tmp_path):
+
+    corpus = tmp_path / 'corpus'
+    corpus.mkdir()
+    shutil.copy(REPLAY_FILES[0], corpus / 'single.html')
+    with zipfile.ZipFile(corpus / 'bundle.zip', 'w') as archive:
+        for idx, replay_file in enumerate(REPLAY_FILES):
+            archive.write(replay_file, f'{idx}.html')
+
+    with ReplayIndex(str(tmp_path / 'index.db')) as index:
+        assert index.update(str(corpus), workers=1) == (1 + len(REPLAY_FILES), 0, 0)
+        paths = index.query()
+        assert str(corpus / 'single.html') in paths
+        assert str(corpus / 'bundle.zip') + '::0.html' in paths
+
+        # Nothing changed, so nothing is read again
+        assert index.update(str(corpus), workers=1) == (0, 0, 0)
+
+        # A file that no longer parses loses its old rows
+        (corpus / 'single.html').write_text('<html>no battle log</html>')
+        assert index.update(str(corpus), workers=1) == (0, 0, 1)
+        assert str(corpus / 'single.html') not in index.query()
+
+        os.unlink(corpus / 'bundle.zip')
+        assert index.update(str(corpus), workers=1) == (0, 1, 1)
+        assert len(index) == 0
+
+def test_update_only_prunes_its_own_source(tmp_path):
+
+    first = tmp_path / 'first'
+    second = tmp_path / 'second'
+    for directory in (first, second):
+        directory.mkdir()
+    for idx, replay_file in enumerate(REPLAY_FILES):
+        shutil.copy(replay_file, first / f'{idx}.html')
+    shutil.copy(REPLAY_FILES[0], second / 'other.html')
+    (first / 'sub').mkdir()
+    shutil.copy(REPLAY_FILES[0], first / 'sub' / 'nested.html')
+
+    with ReplayIndex(str(tmp_path / 'index.db')) as index:
+        index.update(str(first), workers=1)
+        index.update(str(first / 'sub' / '*.html'), workers=1)
+        assert index.update(str(second), workers=1) == (1, 0, 0)
+        assert len(index) == len(REPLAY_FILES) + 2
+
+        # A glob only prunes what it matches: not the nested directory
+        os.unlink(first / '0.html')
+        os.unlink(first / 'sub' / 'nested.html')
+        assert index.update(str(first / '*.html'), workers=1) == (0, 1, 0)
+        assert str(first / 'sub' / 'nested.html') in index.query()
+        assert index.update(str(first / 'sub'), workers=1) == (0, 1, 0)
+        assert len(index) == len(REPLAY_FILES)
+
+def test_rating_filter_is_strict(tmp_path):
+
+    with ReplayIndex(str(tmp_path / 'index.db')) as index:
+        index.update('replays/*.html', workers=1)
+        ratings = [row[0] for row in index.connection.execute(
+            'SELECT MIN(rating) FROM players GROUP BY replay_id ORDER BY MIN(rating)')]
+
+        assert len(index.query(rating_above=ratings[0] - 1)) == len(ratings)
+        assert len(index.query(rating_above=ratings[0])) == len(ratings) - 1
+
+def test_unreadable_member_is_counted_and_logged(tmp_path, caplog):
+
+    with zipfile.ZipFile(tmp_path / 'bundle.zip', 'w') as archive:
+        archive.writestr('a.json', '{"id": "no log"}')
+        archive.write(REPLAY_FILES[0], 'b.html')
+
+    with ReplayIndex(str(tmp_path / 'index.db')) as index:
+        assert index.update(str(tmp_path / 'bundle.zip'), workers=1) == (1, 0, 1)
+    assert 'bundle.zip::a.json' in caplog.text
@@ -0,0 +1,55 @@
+import glob
+import pickle
+from src.replay_management.process_replay import iter_battle_lines, parse_replay_file
+from src.replay_management.showdown_protocol import (ParseCounters, PokeMessage, iter_replay_commands,
+                                                    tokenize_replay_messages)
+
+REPLAY_FILES = sorted(glob.glob('replays/*.html'))
+
+def _parse(*lines):
+    return list(iter_replay_commands(lines, ParseCounters()))
+
+def test_poke_details():
+
+    groudon, incineroar = _parse('|poke|p1|Groudon, L50|', '|poke|p2|Incineroar, F|item')
+
+    assert (groudon.player, groudon.name, groudon.level, groudon.gender) == ('p1', 'Groudon', '50', None)
+    assert (incineroar.name, incineroar.level, incineroar.gender, incineroar.item) == ('Incineroar', '100', 'F', 'item')
+
+def test_pickled_poke_keeps_details():
+
+    poke = pickle.loads(pickle.dumps(_parse('|poke|p1|Groudon, L50, M|')[0]))
+
+    assert isinstance(poke, PokeMessage)
+    assert (poke.name, poke.level, poke.gender) == ('Groudon', '50', 'M')
+
+def test_tokenizer_round_trip():
+
+    from_file = [line for replay_file in REPLAY_FILES for line in iter_battle_lines(parse_replay_file(replay_file))]
+    tokens = list(tokenize_replay_messages(from_file, ParseCounters()))
+    assert tokens
+
+    # Lines rebuilt from the tokens tokenize to the same tokens
+    lines = []
+    for command, args, from_text, of_text, tags in tokens:
+        fields = [command, *args] + [text for text in (from_text, of_text) if text is not None] + list(tags)
+        lines.append('|' + '|'.join(fields))
+
+    assert list(tokenize_replay_messages(lines, ParseCounters())) == tokens
+
+def test_tokenizer_tags_and_skipped_lines():
+
+    counters = ParseCounters()
+    tokens = list(tokenize_replay_messages([
+        '|-damage|p1a: Groudon|50/100|[from] item: Life Orb|[of] p2a: Kyogre|[silent]',
+        '|notacommand|x',
+        '|turn',
+        'plain text',
+        '|'
+    ], counters))
+
+    assert tokens == [('-damage', ['p1a: Groudon', '50/100'], '[from] item: Life Orb', '[of] p2a: Kyogre',
+                       ['[silent]'])]
+    assert counters.unknown['notacommand'] == 1
+    assert counters.malformed['turn'] == 1
+    assert counters.invalid_lines == 1
@@ -0,0 +1,87 @@
+import glob
+import gzip
+import io
+import json
+import tarfile
+import zipfile
+from src.replay_management.corpus import ingest_corpus
+from src.replay_management.process_replay import parse_replay_file
+from src.replay_management.sources import (MEMBER_SEPARATOR, find_sources, iter_bundle, iter_replays,
+                                           iter_tar, iter_zip, read_battle_log)
+
+REPLAY_FILES = sorted(glob.glob('replays/*.html'))
+
+def _battle_text():
+    return parse_replay_file(REPLAY_FILES[0])
+
+def _check_entries(entries, bundle, good, bad):
+
+    names = [name for name, _ in entries]
+    assert names == [bundle + MEMBER_SEPARATOR + name for name in good + bad]
+    for _, battle_text in entries[:len(good)]:
+        assert battle_text == _battle_text()
+    for _, error in entries[len(good):]:
+        assert isinstance(error, Exception)
+
+def test_zip_with_bad_member(tmp_path):
+
+    bundle = str(tmp_path / 'replays.zip')
+    with zipfile.ZipFile(bundle, 'w') as archive:
+        archive.write(REPLAY_FILES[0], 'a.html')
+        archive.writestr('b.json', json.dumps({'log': _battle_text()}))
+        archive.writestr('notes.txt', 'skipped')
+        archive.writestr('c.json', json.dumps({'id': 'no log'}))
+
+    _check_entries(list(iter_zip(bundle)), bundle, ['a.html', 'b.json'], ['c.json'])
+
+def test_tar_members(tmp_path):
+
+    bundle = str(tmp_path / 'replays.tar.gz')
+    with tarfile.open(bundle, 'w:gz') as archive:
+        archive.add(REPLAY_FILES[0], 'a.html')
+        data = gzip.compress(_battle_text().encode('utf-8'))
+        info = tarfile.TarInfo('b.log.gz')
+        info.size = len(data)
+        archive.addfile(info, io.BytesIO(data))
+        info = tarfile.TarInfo('c.json')
+        info.size = 3
+        archive.addfile(info, io.BytesIO(b'{{{'))
+
+    _check_entries(list(iter_tar(bundle)), bundle, ['a.html', 'b.log.gz'], ['c.json'])
+
+def test_jsonl_with_bad_lines(tmp_path):
+
+    bundle = str(tmp_path / 'replays.jsonl.gz')
+    with gzip.open(bundle, 'wt') as f:
+        f.write(json.dumps({'id': 'battle-1', 'log': _battle_text().replace('\n', '\r\n')}) + '\n\n')
+        f.write('not json\n')
+        f.write(json.dumps({'log': _battle_text()}) + '\n')
+
+    entries = list(iter_bundle(bundle))
+    _check_entries(entries[:2], bundle, ['battle-1'], ['3'])
+    assert entries[2:] == [(bundle + MEMBER_SEPARATOR + '4', _battle_text())]
+
+def test_unreadable_bundle(tmp_path):
+
+    bundle = str(tmp_path / 'broken.zip')
+    with open(bundle, 'wb') as f:
+        f.write(b'not a zip')
+
+    [(name, error)] = list(iter_zip(bundle))
+    assert name == bundle and isinstance(error, Exception)
+
+def test_bad_members_fail_alone(tmp_path):
+
+    with zipfile.ZipFile(tmp_path / 'replays.zip', 'w') as archive:
+        archive.writestr('a.json', json.dumps({'id': 'no log'}))
+        archive.write(REPLAY_FILES[0], 'b.html')
+    (tmp_path / 'c.log').write_text(_battle_text())
+
+    assert find_sources(str(tmp_path)) == [str(tmp_path / 'c.log'), str(tmp_path / 'replays.zip')]
+    assert read_battle_log(str(tmp_path / 'c.log')) == _battle_text()
+
+    results = {result.path: result for result in ingest_corpus(iter_replays(str(tmp_path)), 1)}
+    assert not results[str(tmp_path / 'replays.zip') + MEMBER_SEPARATOR + 'a.json'].ok
+    assert "KeyError: 'log'" in results[str(tmp_path / 'replays.zip') + MEMBER_SEPARATOR + 'a.json'].error
+    assert results[str(tmp_path / 'replays.zip') + MEMBER_SEPARATOR + 'b.html'].ok
+    assert results[str(tmp_path / 'c.log')].ok
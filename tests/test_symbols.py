@@ -0,0 +1,64 @@
+import json
+import pickle
+import subprocess
+import sys
+import pytest
+from src.replay_management.showdown_protocol import MoveMessage, iter_replay_commands
+from src.replay_management.symbols import StringTable, SymbolTable
+
+def test_save_and_read_round_trip(tmp_path):
+
+    table = SymbolTable()
+    for kind, value in (('species', 'Incineroar'), ('species', 'Rillaboom'), ('move', 'Fake Out'),
+                        ('position', 'p1a'), ('species', 'Incineroar')):
+        table.intern(kind, value)
+    table.save(str(tmp_path / 'symbols.json'))
+
+    loaded = SymbolTable.load(str(tmp_path / 'symbols.json'))
+    assert loaded.to_dict() == table.to_dict()
+    assert loaded.get_id('species', 'Rillaboom') == 1 and loaded.lookup('move', 0) == 'Fake Out'
+    assert [path.name for path in tmp_path.iterdir()] == ['symbols.json']
+
+    # A table that's a prefix of the saved one is extended; one that
+    # disagrees with it is refused
+    extended = SymbolTable()
+    extended.intern('species', 'Incineroar')
+    extended.read(str(tmp_path / 'symbols.json'))
+    assert extended.to_dict() == table.to_dict()
+
+    conflicting = SymbolTable()
+    conflicting.intern('species', 'Rillaboom')
+    with pytest.raises(ValueError):
+        conflicting.read(str(tmp_path / 'symbols.json'))
+
+def test_string_table_ids_are_dense():
+
+    table = StringTable(['a', 'b'])
+    assert table.intern('b') == 1 and table.intern('c') == 2
+    assert len(table) == 3 and table[2] == 'c' and 'a' in table and table.get_id('d') is None
+
+UNPICKLE = '''
+import json, pickle, sys
+from src.replay_management.symbols import symbol_table
+# A different id space to the one the message was pickled in
+for idx in range(10):
+    symbol_table.intern('species', f'Other{idx}')
+    symbol_table.intern('move', f'Other{idx}')
+message = pickle.loads(sys.stdin.buffer.read())
+print(json.dumps([message.pokemon, message.move, message.name_id, message.move_id]))
+'''
+
+def test_symbol_fields_pickle_as_strings():
+
+    message, = iter_replay_commands(['|move|p1a: Incin|Fake Out|p2a: Amoonguss'])
+    assert isinstance(message, MoveMessage)
+
+    data = pickle.dumps(message)
+    state = message.__getstate__()
+    assert state['name_id'] == 'Incin' and state['move_id'] == 'Fake Out'
+
+    loaded = pickle.loads(data)
+    assert (loaded.pokemon, loaded.move, loaded.move_id) == ('p1a: Incin', 'Fake Out', message.move_id)
+
+    output = subprocess.run([sys.executable, '-c', UNPICKLE], input=data, capture_output=True, check=True).stdout
+    assert json.loads(output) == ['p1a: Incin', 'Fake Out', 10, 10]
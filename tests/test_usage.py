@@ -0,0 +1,79 @@
+import glob
+import sys
+import numpy as np
+from src.replay_management import usage
+from src.replay_management.usage import COUNT_ARRAYS, UsageStats
+
+REPLAY_FILES = sorted(glob.glob('replays/*.html'))
+
+def _partial(teams):
+
+    stats = UsageStats()
+    stats.battles = 1
+    for team in teams:
+        stats.add_team(**team)
+    return stats
+
+def _check_same(stats, other):
+
+    assert stats.battles == other.battles
+    assert np.array_equal(stats.teams, other.teams)
+    assert np.array_equal(stats.team_wins, other.team_wins)
+    for name, axes in COUNT_ARRAYS.items():
+        # Compare by name, since ids depend on the order things were interned
+        tables = [{'s': s.species, 'm': s.moves} for s in (stats, other)]
+        order = [np.array([tables[1][axis].get_id(name) for name in tables[0][axis].strings], dtype=np.int64)
+                 for axis in axes]
+        assert np.array_equal(stats.get_counts(name), other.get_counts(name)[np.ix_(range(stats.num_buckets), *order)])
+
+def test_merge_matches_adding_directly():
+
+    teams = [
+        {'rating': 1250, 'species': ['Incineroar', 'Rillaboom'], 'won': True, 'leads': ['Incineroar', 'Rillaboom'],
+         'moves': {'Incineroar': ['Fake Out'], 'Rillaboom': ['Grassy Glide']}},
+        {'rating': None, 'species': ['Regieleki', 'Incineroar'], 'leads': ['Regieleki'],
+         'moves': {'Regieleki': ['Electroweb', 'Protect']}},
+        {'rating': 1600, 'species': ['Rillaboom', 'Urshifu'], 'won': True, 'leads': ['Urshifu', 'Rillaboom'],
+         'moves': {'Urshifu': ['Surging Strikes'], 'Rillaboom': ['Fake Out']}}
+    ]
+
+    direct = _partial(teams)
+    direct.battles = 3
+    merged = UsageStats().merge(_partial(teams[2:])).merge(_partial(teams[:1])).merge(_partial(teams[1:2]))
+
+    _check_same(direct, merged)
+    assert sorted(merged.top_species(2)) == [('Incineroar', 2, 2 / 3), ('Rillaboom', 2, 2 / 3)]
+    assert merged.win_rate('Rillaboom') == 1.0
+    assert merged.win_rate('Regieleki') == 0.0
+    assert sorted(merged.top_moves(species='Rillaboom')) == [('Fake Out', 1, 0.5), ('Grassy Glide', 1, 0.5)]
+    assert {frozenset(pair) for pair, count, share in merged.top_lead_pairs()} == \
+        {frozenset(('Incineroar', 'Rillaboom')), frozenset(('Urshifu', 'Rillaboom'))}
+    assert merged.num_teams(merged.bucket(None)) == 1
+
+def test_save_and_load_round_trip(tmp_path):
+
+    stats = _partial([{'rating': 1350, 'species': ['Incineroar', 'Rillaboom'], 'won': True,
+                       'leads': ['Incineroar', 'Rillaboom'], 'moves': {'Incineroar': ['Fake Out']}}])
+    # Past the initial capacity, so the arrays have been grown
+    stats.add_team(None, [f'Species{idx}' for idx in range(20)], moves={'Species0': [f'Move{idx}' for idx in range(20)]})
+
+    stats.save(str(tmp_path / 'usage.npz'))
+    loaded = UsageStats.load(str(tmp_path / 'usage.npz'))
+
+    assert loaded.rating_edges == stats.rating_edges
+    assert loaded.species.strings == stats.species.strings
+    assert loaded.moves.strings == stats.moves.strings
+    _check_same(stats, loaded)
+
+def test_cli_doesnt_count_battles_twice(tmp_path, monkeypatch, capsys):
+
+    stats_file = str(tmp_path / 'usage.npz')
+    monkeypatch.setattr(sys, 'argv', ['usage', 'replays/*.html', '--stats', stats_file, '--workers', '1'])
+
+    usage.main()
+    first = UsageStats.load(stats_file)
+    usage.main()
+    second = UsageStats.load(stats_file)
+
+    assert first.battles == len(REPLAY_FILES)
+    _check_same(first, second)